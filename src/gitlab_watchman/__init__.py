@@ -1,20 +1,33 @@
 import argparse
 import calendar
 import datetime
-import multiprocessing
 import os
 import sys
 import time
 import traceback
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from importlib import metadata
 from typing import List, Dict, Any
 
 import yaml
 
 from gitlab_watchman import watchman_processor
-from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
+from gitlab_watchman.clients.cassette import Cassette
+from gitlab_watchman.clients.entity_cache import EntityCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
+from gitlab_watchman.clients.http_cache import DEFAULT_CACHE_DIR_SIZE_MB
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter, DEFAULT_MAX_LIMIT, ENDPOINT_CLASSES
+from gitlab_watchman.clients.connection_pool import DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.clients.session import parse_timeout
+from gitlab_watchman.clients.gitlab_client import (
+    ClientOptions,
+    GitLabAPIClient,
+    JSON_DECODERS,
+    DEFAULT_JSON_DECODER
+)
+from gitlab_watchman.matcher import REGEX_ENGINES, DEFAULT_REGEX_ENGINE, engine_report, required_literals
 from gitlab_watchman.signature_downloader import SignatureDownloader
+from gitlab_watchman.watchdog import DEFAULT_ITEM_BUDGET, DEFAULT_STALL_TIMEOUT
 from gitlab_watchman.exceptions import (
     GitLabWatchmanError,
     GitLabWatchmanGetObjectError,
@@ -42,6 +55,7 @@ from gitlab_watchman.models import (
 class SearchArgs:
     """ Dataclass to hold search arguments """
     gitlab_client: GitLabAPIClient
+    worker_pool: watchman_processor.WorkerPool
     sig_list: List[signature.Signature]
     timeframe: int
     logging_type: str
@@ -49,32 +63,38 @@ class SearchArgs:
     debug: bool
     verbose: bool
     scopes: List[str]
+    regex_engine: str = DEFAULT_REGEX_ENGINE
 
 
-def search(search_args: SearchArgs, sig: signature.Signature, scope: str):
-    """ Use the appropriate search function to search GitLab based on the contents
-    of the signature file. Output results to stdout
+def search(search_args: SearchArgs, queries: Dict[str, List[signature.Signature]], scope: str):
+    """ Use the appropriate search function to search GitLab based on the planned
+    queries for a scope. Output results to stdout
 
     Args:
         search_args: SearchArgs object
-        sig: Signature object
+        queries: Unique search strings mapped to the signatures that use them
         scope: What sort of GitLab objects to search
     """
 
     try:
-        OUTPUT_LOGGER.log('INFO', f'Searching for {sig.name} in {scope}')
+        signatures = {}
+        for query_signatures in queries.values():
+            for sig in query_signatures:
+                signatures.setdefault(sig.id, sig)
+        OUTPUT_LOGGER.log('INFO', f'Searching {scope} using {len(queries)} unique search terms '
+                                  f'for {len(signatures)} signatures')
 
         results = watchman_processor.search(
             gitlab=search_args.gitlab_client,
-            logging_type=search_args.logging_type,
-            log_handler=search_args.log_handler,
-            debug=search_args.debug,
-            sig=sig,
+            worker_pool=search_args.worker_pool,
+            queries=queries,
             scope=scope,
             verbose=search_args.verbose,
-            timeframe=search_args.timeframe)
-        if results:
-            for log_data in results:
+            timeframe=search_args.timeframe,
+            regex_engine=search_args.regex_engine)
+        for sig_id, sig_results in results.items():
+            sig = signatures.get(sig_id)
+            for log_data in sig_results:
                 OUTPUT_LOGGER.log(
                     'NOTIFY',
                     log_data,
@@ -90,17 +110,16 @@ def search(search_args: SearchArgs, sig: signature.Signature, scope: str):
 
 
 def perform_search(search_args: SearchArgs):
-    """ Helper function to perform the search for each signature and each scope
+    """ Helper function to plan the unique searches needed by the signatures,
+    then perform them for each scope
 
     Args:
         search_args: SearchArgs object
     """
 
-    for sig in search_args.sig_list:
-        if sig.scope:
-            for scope in search_args.scopes:
-                if scope in sig.scope:
-                    search(search_args, sig, scope)
+    search_plan = watchman_processor.plan_searches(search_args.sig_list, search_args.scopes)
+    for scope, queries in search_plan.items():
+        search(search_args, queries, scope)
 
 
 def validate_variables() -> Dict[str, Any]:
@@ -182,8 +201,93 @@ def main():
         parser.add_argument('--verbose', '-V', dest='verbose', action='store_true',
                             help='Turn on more verbose output for JSON logging. '
                                  'This includes more fields, but is larger')
+        parser.add_argument('--search-concurrency', dest='search_concurrency', type=int, default=4,
+                            help='Maximum number of search result pages to download at the same time. '
+                                 'Default: 4')
+        parser.add_argument('--max-tasks-per-child', dest='max_tasks_per_child',
+                            type=watchman_processor.parse_max_tasks_per_child, default=100,
+                            help='Number of tasks each worker process completes before it is replaced '
+                                 'with a new one, 0 to never replace them. Only used by the process executor. '
+                                 'Default: 100')
+        parser.add_argument('--executor', dest='executor', choices=watchman_processor.EXECUTOR_TYPES,
+                            default='process',
+                            help='How to run the workers that process search results. process uses a pool of '
+                                 'worker processes, thread and async run the workers in this process, sharing one '
+                                 'connection pool and cache. async runs them as coroutines on one event loop, and '
+                                 'needs the async extra. Default: process')
+        parser.add_argument('--workers', dest='workers', type=int,
+                            help='Number of workers. Default: one less than the CPU count for the process '
+                                 f'executor, {watchman_processor.DEFAULT_IO_WORKERS} for thread and async')
+        parser.add_argument('--cache-ttl', dest='cache_ttl', type=int, default=DEFAULT_TTL,
+                            help='Seconds that projects, groups, commits and users are cached for. '
+                                 f'Default: {DEFAULT_TTL}')
+        parser.add_argument('--cache-size', dest='cache_size', type=int, default=DEFAULT_MAX_SIZE,
+                            help='Maximum number of projects, groups, commits and users to cache. '
+                                 f'Default: {DEFAULT_MAX_SIZE}')
+        parser.add_argument('--cache-dir', dest='cache_dir',
+                            help='Directory to keep API responses in between runs. Cached responses are '
+                                 'revalidated with their ETags, so unchanged entities are not downloaded again')
+        parser.add_argument('--cache-dir-size', dest='cache_dir_size', type=int, default=DEFAULT_CACHE_DIR_SIZE_MB,
+                            help='Maximum size of the --cache-dir response cache in megabytes, least recently '
+                                 f'used responses are removed once it is full. Default: {DEFAULT_CACHE_DIR_SIZE_MB}')
+        parser.add_argument('--rate-limit', dest='rate_limit', type=int,
+                            help='Maximum API requests per minute for all workers together. Requests are also '
+                                 'paced to stay under the rate limit reported by GitLab')
+        parser.add_argument('--max-concurrency', dest='max_concurrency', type=int, default=DEFAULT_MAX_LIMIT,
+                            help='Highest number of API requests in flight to each class of endpoint. Limits start '
+                                 'lower and adapt to the latency and errors of the GitLab instance. '
+                                 f'Default: {DEFAULT_MAX_LIMIT}')
+        parser.add_argument('--timeout', dest='timeouts', action='append', type=parse_timeout, default=[],
+                            metavar='CLASS=CONNECT:READ',
+                            help='Connect and read timeouts in seconds for a class of endpoint, one of '
+                                 f'{", ".join(ENDPOINT_CLASSES)}. Can be given more than once, e.g. '
+                                 '--timeout search=10:300 --timeout files=5:30')
+        parser.add_argument('--hedge', dest='hedge_requests', action='store_true',
+                            help='Send a second copy of GET requests that take longer than the recent p95 latency '
+                                 'of their endpoint class, and use whichever response arrives first')
+        parser.add_argument('--json-decoder', dest='json_decoder', choices=list(JSON_DECODERS),
+                            default=DEFAULT_JSON_DECODER,
+                            help='JSON decoder used for search results. Default: orjson if it is installed, '
+                                 'otherwise json')
+        parser.add_argument('--regex-engine', dest='regex_engine', choices=list(REGEX_ENGINES),
+                            default=DEFAULT_REGEX_ENGINE,
+                            help='Regex engine signature patterns are run with. re2, available when google-re2 is '
+                                 'installed, runs in linear time so one pattern can\'t stall a worker on a large '
+                                 'file. Patterns re2 can\'t compile run with re instead. '
+                                 f'Default: {DEFAULT_REGEX_ENGINE}')
+        parser.add_argument('--item-budget', dest='item_budget', type=float, default=DEFAULT_ITEM_BUDGET,
+                            help='Seconds matching a single search result against the signatures can take before '
+                                 'it is skipped. Only the process executor can interrupt a regex search, thread and '
+                                 'async check the budget between patterns. 0 for no limit. '
+                                 f'Default: {DEFAULT_ITEM_BUDGET}')
+        parser.add_argument('--stall-timeout', dest='stall_timeout', type=float, default=DEFAULT_STALL_TIMEOUT,
+                            help='Seconds a worker can go without moving on to a new search result before its '
+                                 'remaining results are skipped. Worker processes are stopped and replaced, threads '
+                                 f'are abandoned. 0 to wait indefinitely. Default: {DEFAULT_STALL_TIMEOUT}')
+        parser.add_argument('--pool-connections', dest='pool_connections', type=int,
+                            default=DEFAULT_POOL_CONNECTIONS,
+                            help='Number of hosts each worker keeps a connection pool for. '
+                                 f'Default: {DEFAULT_POOL_CONNECTIONS}')
+        parser.add_argument('--pool-maxsize', dest='pool_maxsize', type=int,
+                            help='Connections to the GitLab instance each worker process keeps open for reuse. '
+                                 f'Default: {DEFAULT_POOL_MAXSIZE} for the process executor, the number of '
+                                 'workers for thread and async')
+        parser.add_argument('--no-gzip', dest='compress', action='store_false',
+                            help='Ask for uncompressed API responses, using more bandwidth but less CPU time')
+        cassette_group = parser.add_mutually_exclusive_group()
+        cassette_group.add_argument('--record', dest='record_cassette', metavar='PATH',
+                                    help='Record every request and response of this run to a cassette file, '
+                                         'to replay it later with --replay')
+        cassette_group.add_argument('--replay', dest='replay_cassette', metavar='PATH',
+                                    help='Answer every request from a cassette file recorded with --record, '
+                                         'instead of the GitLab instance')
+        parser.add_argument('--replay-timing', dest='replay_timing', choices=['fast', 'original'], default='fast',
+                            help='Replay responses as fast as possible, or taking as long as the recorded '
+                                 'requests did. Default: fast')
 
         args = parser.parse_args()
+        if args.executor == 'async' and (args.record_cassette or args.replay_cassette):
+            parser.error('--record and --replay can\'t be used with --executor async')
         everything = args.everything
         blobs = args.blobs
         commits = args.commits
@@ -205,14 +309,40 @@ def main():
             'a': calendar.timegm(time.gmtime()) + 1576800000
         }
         timeframe = tf_options.get(args.time)
+        max_request_rate = args.rate_limit / 60 if args.rate_limit else None
+        timeouts = dict(args.timeouts)
+        cassette, cassette_mode = None, 'record'
+        if args.record_cassette:
+            cassette = Cassette()
+        elif args.replay_cassette:
+            cassette = Cassette.load(args.replay_cassette)
+            cassette_mode = 'replay-timed' if args.replay_timing == 'original' else 'replay'
 
         OUTPUT_LOGGER = init_logger(logging_type, debug)
 
         config = validate_variables()
         disabled_signatures = config.get('disabled_signatures', [])
+        client_options = ClientOptions(
+            search_concurrency=args.search_concurrency,
+            pool_maxsize=args.pool_maxsize,
+            pool_connections=args.pool_connections,
+            compress=args.compress,
+            timeouts=timeouts,
+            hedge_requests=args.hedge_requests,
+            json_decoder=JSON_DECODERS.get(args.json_decoder),
+            cache_dir=args.cache_dir,
+            cache_dir_size=args.cache_dir_size,
+            cassette=cassette,
+            cassette_mode=cassette_mode)
         gitlab_client = watchman_processor.initiate_gitlab_connection(
             os.environ.get('GITLAB_WATCHMAN_TOKEN'),
-            os.environ.get('GITLAB_WATCHMAN_URL'))
+            os.environ.get('GITLAB_WATCHMAN_URL'),
+            replace(
+                client_options,
+                pool_maxsize=args.pool_maxsize or args.workers or watchman_processor.DEFAULT_IO_WORKERS,
+                entity_cache=EntityCache(args.cache_ttl, args.cache_size),
+                rate_limiter=RateLimiter(max_request_rate),
+                concurrency_limiter=ConcurrencyLimiter(max_limit=args.max_concurrency)))
 
         now = int(time.time())
         today = datetime.date.today().strftime('%Y-%m-%d')
@@ -234,7 +364,18 @@ def main():
             signature_list = supress_disabled_signatures(signature_list, disabled_signatures)
             OUTPUT_LOGGER.log('INFO', f'The following signatures have been suppressed: {disabled_signatures}')
         OUTPUT_LOGGER.log('SUCCESS', f'{len(signature_list)} signatures loaded')
-        OUTPUT_LOGGER.log('INFO', f'{multiprocessing.cpu_count() - 1} cores being used')
+        patterns = {pattern for sig in signature_list for pattern in sig.patterns or []}
+        prefiltered = [pattern for pattern in patterns if required_literals(pattern)]
+        OUTPUT_LOGGER.log('INFO', f'{len(prefiltered)} of {len(patterns)} signature patterns have a literal '
+                                  f'prefilter, the rest are run over every search result')
+        regex_engines = engine_report(signature_list, args.regex_engine)
+        for engine, sig_ids in regex_engines.items():
+            OUTPUT_LOGGER.log('INFO', f'{len(sig_ids)} signatures run on the {engine} regex engine')
+            if engine != args.regex_engine:
+                OUTPUT_LOGGER.log('INFO', f'Signatures falling back to {engine} because {args.regex_engine} '
+                                          f'can\'t compile their patterns: {", ".join(sig_ids)}')
+            else:
+                OUTPUT_LOGGER.log('DEBUG', f'Signatures run on {engine}: {", ".join(sig_ids)}')
 
         instance_metadata = gitlab_client.get_metadata()
         OUTPUT_LOGGER.log('INSTANCE', instance_metadata, detect_type='Instance', notify_type='instance')
@@ -284,15 +425,41 @@ def main():
                 'SUCCESS',
                 f'Projects output to CSV file: {os.path.join(os.getcwd(), "gitlab_projects.csv")}')
 
+        pool_options = watchman_processor.PoolOptions(
+            executor=args.executor,
+            workers=args.workers,
+            max_tasks_per_child=args.max_tasks_per_child or None,
+            cache_ttl=args.cache_ttl,
+            cache_size=args.cache_size,
+            max_request_rate=max_request_rate,
+            max_concurrency=args.max_concurrency,
+            item_budget=args.item_budget or None,
+            stall_timeout=args.stall_timeout or None,
+            client=client_options)
+        worker_pool = watchman_processor.create_worker_pool(
+            os.environ.get('GITLAB_WATCHMAN_TOKEN'),
+            os.environ.get('GITLAB_WATCHMAN_URL'),
+            logging_type=logging_type,
+            log_handler=OUTPUT_LOGGER,
+            debug=debug,
+            options=pool_options,
+            gitlab_client=gitlab_client)
+        OUTPUT_LOGGER.log('INFO', f'{worker_pool.workers} {worker_pool.executor} workers being used')
+        limits_warning = watchman_processor.limits_warning(pool_options, regex_engines)
+        if limits_warning:
+            OUTPUT_LOGGER.log('WARNING', limits_warning)
+
         search_args = SearchArgs(
             gitlab_client=gitlab_client,
+            worker_pool=worker_pool,
             sig_list=signature_list,
             timeframe=timeframe,
             logging_type=logging_type,
             log_handler=OUTPUT_LOGGER,
             debug=debug,
             verbose=verbose,
-            scopes=[])
+            scopes=[],
+            regex_engine=args.regex_engine)
 
         if everything:
             OUTPUT_LOGGER.log('INFO', 'Getting everything...')
@@ -341,6 +508,39 @@ def main():
                 search_args.scopes = ['snippet_titles']
                 perform_search(search_args)
 
+        cache_stats = worker_pool.entity_cache.stats()
+        OUTPUT_LOGGER.log('INFO', f'Entity cache: {cache_stats.get("hits")} hits, '
+                                  f'{cache_stats.get("misses")} misses, '
+                                  f'{cache_stats.get("evictions")} evictions, '
+                                  f'{cache_stats.get("coalesced")} coalesced')
+        if gitlab_client.http_cache:
+            http_cache_stats = worker_pool.api_metrics.response_cache()
+            OUTPUT_LOGGER.log('INFO', f'Response cache: {http_cache_stats.get("revalidated")} revalidated, '
+                                      f'{http_cache_stats.get("stored")} stored, '
+                                      f'{gitlab_client.http_cache.cache.disk_size() // 1024} KB on disk')
+        rate_limiter_stats = worker_pool.rate_limiter.stats()
+        OUTPUT_LOGGER.log('INFO', f'Rate limiter: {rate_limiter_stats.get("delayed")} requests delayed for '
+                                  f'{rate_limiter_stats.get("delay_seconds")}s, '
+                                  f'{rate_limiter_stats.get("throttled")} throttled responses')
+        connections = worker_pool.api_metrics.connections()
+        api_calls = worker_pool.api_metrics.summary()
+        OUTPUT_LOGGER.log('INFO', f'Connections: {connections.get("opened")} opened, '
+                                  f'{connections.get("tls_handshakes")} TLS handshakes for '
+                                  f'{sum(endpoint.get("calls") for endpoint in api_calls)} requests')
+        if args.record_cassette:
+            worker_pool.cassette.save(args.record_cassette)
+            OUTPUT_LOGGER.log('SUCCESS', f'{worker_pool.cassette.stats().get("interactions")} requests recorded '
+                                         f'to cassette: {args.record_cassette}')
+        skipped_items = worker_pool.monitor.skipped()
+        if skipped_items:
+            OUTPUT_LOGGER.log('WARNING', f'{len(skipped_items)} search results skipped, '
+                                         f'{worker_pool.monitor.stats().get("recycled")} stalled workers stopped')
+        OUTPUT_LOGGER.log('SUMMARY', {
+            'api_calls': api_calls,
+            'concurrency': worker_pool.concurrency_limiter.stats(),
+            'skipped_items': skipped_items
+        }, notify_type='api_summary')
+        watchman_processor.close_worker_pool(worker_pool)
         OUTPUT_LOGGER.log('SUCCESS', f'GitLab Watchman finished execution - Execution time:'
                                      f' {str(datetime.timedelta(seconds=time.time() - start_time))}')
 
@@ -0,0 +1,219 @@
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from gitlab.const import RETRYABLE_TRANSIENT_ERROR_CODES
+
+# Responses python-gitlab retries: rate limited requests, and transient server errors
+RETRIED_STATUS_CODES = [429] + RETRYABLE_TRANSIENT_ERROR_CODES
+
+# Latencies are counted in buckets growing by 5%, so percentiles are accurate to within 5%
+# and a histogram stays small however many requests are made
+LATENCY_BUCKET_GROWTH = 1.05
+PERCENTILES = [50, 90, 95, 99]
+
+ENDPOINT_PATTERNS = [
+    (re.compile(r'^/api/v4'), ''),
+    (re.compile(r'^/(projects|groups|users|snippets)/[^/]+'), r'/\1/:id'),
+    (re.compile(r'/repository/(files|commits|blobs)/[^/]+'), r'/repository/\1/:id'),
+    (re.compile(r'/(wikis)/[^/]+'), r'/\1/:slug'),
+    (re.compile(r'/(issues|merge_requests|milestones|notes|members)/\d+'), r'/\1/:id'),
+]
+
+
+def endpoint_template(url: str) -> Tuple[str, str]:
+    """ Convert a GitLab API URL to its endpoint template, so requests for different
+    entities are counted together, e.g. /api/v4/projects/42 becomes /projects/:id
+
+    Args:
+        url: Request URL
+    Returns:
+        Tuple of the endpoint template and the search scope, which is empty for other endpoints
+    """
+
+    parsed = urlparse(url)
+    endpoint = parsed.path
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        endpoint = pattern.sub(replacement, endpoint)
+    return endpoint, parse_qs(parsed.query).get('scope', [''])[0]
+
+
+def _latency_bucket(milliseconds: float) -> int:
+    return math.ceil(math.log(max(milliseconds, 1.0), LATENCY_BUCKET_GROWTH))
+
+
+def _percentile(histogram: Dict[int, int], count: int, percentile: float) -> float:
+    threshold = count * percentile / 100
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= threshold:
+            return round(LATENCY_BUCKET_GROWTH ** bucket, 1)
+    return 0.0
+
+
+class ApiMetrics:
+    """ Thread-safe accounting of the requests made to the GitLab API, by HTTP method, endpoint
+    template and search scope. Counts calls, bytes received, responses served from the on-disk
+    response cache, retried responses and error status codes, and keeps a latency histogram.
+    Error counts are keyed by the status code as a string, the same as they are once logged as JSON.
+    Also counts the connections opened to the GitLab instance, how many needed a TLS handshake,
+    and the responses added to the on-disk response cache.
+    """
+
+    def __init__(self):
+        self._endpoints: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._connections = {'opened': 0, 'tls_handshakes': 0}
+        self._cache_stored = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _new_endpoint() -> Dict[str, Any]:
+        return {
+            'calls': 0,
+            'bytes': 0,
+            'cached': 0,
+            'retries': 0,
+            'errors': defaultdict(int),
+            'latency_ms': 0.0,
+            'histogram': defaultdict(int)
+        }
+
+    def record(self,
+               method: str,
+               url: str,
+               status_code: int,
+               elapsed: float,
+               size: int,
+               *,
+               cached: bool = False):
+        """ Record a response from the GitLab API
+
+        Args:
+            method: HTTP method of the request
+            url: Request URL
+            status_code: Status code of the response
+            elapsed: Seconds taken to receive the response
+            size: Bytes received
+            cached: Whether the body was served from the on-disk response cache
+        """
+
+        endpoint, scope = endpoint_template(url)
+        milliseconds = elapsed * 1000
+        with self._lock:
+            metrics = self._endpoints.setdefault((method, endpoint, scope), self._new_endpoint())
+            metrics['calls'] += 1
+            metrics['bytes'] += size
+            metrics['cached'] += int(cached)
+            metrics['latency_ms'] += milliseconds
+            metrics['histogram'][_latency_bucket(milliseconds)] += 1
+            if status_code in RETRIED_STATUS_CODES:
+                metrics['retries'] += 1
+            if status_code >= 400:
+                metrics['errors'][str(status_code)] += 1
+
+    def record_connection(self, scheme: str):
+        """ Record a new connection to the GitLab instance
+
+        Args:
+            scheme: http or https
+        """
+
+        with self._lock:
+            self._connections['opened'] += 1
+            self._connections['tls_handshakes'] += int(scheme == 'https')
+
+    def record_cache_store(self):
+        """ Record a response added to the on-disk response cache """
+
+        with self._lock:
+            self._cache_stored += 1
+
+    def connections(self) -> Dict[str, int]:
+        """ Return the connection counters
+
+        Returns:
+            Dict with the number of connections opened, and the number of TLS handshakes
+        """
+
+        with self._lock:
+            return dict(self._connections)
+
+    def response_cache(self) -> Dict[str, int]:
+        """ Return the on-disk response cache counters
+
+        Returns:
+            Dict with the number of responses served from the cache after revalidation, and the
+            number of responses added to it
+        """
+
+        with self._lock:
+            return {
+                'revalidated': sum(metrics['cached'] for metrics in self._endpoints.values()),
+                'stored': self._cache_stored
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ Return the raw counters, in a form that can be passed to merge()
+
+        Returns:
+            Dict with a list of the counters for each endpoint, the connection counters and the
+            number of responses added to the on-disk response cache
+        """
+
+        with self._lock:
+            return {
+                'endpoints': [{
+                    'method': method,
+                    'endpoint': endpoint,
+                    'scope': scope,
+                    **metrics,
+                    'errors': dict(metrics['errors']),
+                    'histogram': dict(metrics['histogram'])
+                } for (method, endpoint, scope), metrics in self._endpoints.items()],
+                'connections': dict(self._connections),
+                'cache_stored': self._cache_stored
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """ Add the counters from another ApiMetrics snapshot to these
+
+        Args:
+            snapshot: Output of snapshot()
+        """
+
+        with self._lock:
+            for counter, count in snapshot.get('connections').items():
+                self._connections[counter] += count
+            self._cache_stored += snapshot.get('cache_stored', 0)
+            for other in snapshot.get('endpoints'):
+                key = (other.get('method'), other.get('endpoint'), other.get('scope'))
+                metrics = self._endpoints.setdefault(key, self._new_endpoint())
+                for counter in ['calls', 'bytes', 'cached', 'retries', 'latency_ms']:
+                    metrics[counter] += other.get(counter)
+                for status_code, count in other.get('errors').items():
+                    metrics['errors'][str(status_code)] += count
+                for bucket, count in other.get('histogram').items():
+                    metrics['histogram'][int(bucket)] += count
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """ Summarise the requests made to each endpoint, ordered by the total time spent on them
+
+        Returns:
+            List of dicts with the calls, bytes, cached responses, retries, errors and latency
+            percentiles in milliseconds for each endpoint
+        """
+
+        summary = []
+        for metrics in self.snapshot().get('endpoints'):
+            histogram = metrics.pop('histogram')
+            metrics['latency_ms'] = {
+                'total': round(metrics.get('latency_ms'), 1),
+                **{f'p{p}': _percentile(histogram, metrics.get('calls'), p) for p in PERCENTILES},
+                'max': round(LATENCY_BUCKET_GROWTH ** max(histogram), 1) if histogram else 0.0
+            }
+            summary.append(metrics)
+        return sorted(summary, key=lambda m: m.get('latency_ms').get('total'), reverse=True)
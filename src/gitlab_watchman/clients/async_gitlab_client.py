@@ -0,0 +1,443 @@
+import asyncio
+import time
+from dataclasses import replace
+from typing import List, Dict, Any, Tuple, Callable, Awaitable
+from urllib.parse import quote
+
+from gitlab.const import SearchScope
+from gitlab.exceptions import GitlabAuthenticationError, GitlabHttpError
+
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.concurrency import endpoint_class
+from gitlab_watchman.clients.entity_cache import EntityCache
+from gitlab_watchman.clients.gitlab_client import (
+    DEFAULT_JSON_DECODER,
+    JSON_DECODERS,
+    SCOPE_MAP,
+    ClientOptions,
+    _translate_exceptions,
+    file_metadata_from_headers,
+    select_fields
+)
+from gitlab_watchman.clients.rate_limiter import RateLimiter, parse_retry_after, rate_limit_headers
+from gitlab_watchman.clients.session import DEFAULT_TIMEOUTS
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+RETRY_STATUS_CODES = [429, 502, 503, 504]
+DEFAULT_POOL_MAXSIZE = 100
+
+
+def async_exception_handler(func):
+    """ Decorator to handle exceptions raised by the GitLab API in coroutines. Exceptions
+    are mapped to GitLab Watchman exceptions the same way as exception_handler
+    """
+
+    async def inner_function(*args, **kwargs):
+        with _translate_exceptions(func, args):
+            return await func(*args, **kwargs)
+
+    return inner_function
+
+
+class AsyncGitLabAPIClient:
+    """ Class to interact with the GitLab API using asyncio. Provides the same methods as
+    GitLabAPIClient used when processing search results, as coroutines. Requests share a
+    pooled aiohttp session, so a single process can keep many requests in flight.
+
+    The workers of the async executor share one client, and it can be used from your own event
+    loop too. It needs the async extra: pip install gitlab-watchman[async]
+
+    Use as an async context manager, or call close() when finished:
+
+        async with AsyncGitLabAPIClient(token, url) as client:
+            project = await client.get_project(1)
+
+    Only pool_maxsize, DEFAULT_POOL_MAXSIZE if None, search_concurrency, compress, timeouts,
+    json_decoder, entity_cache, api_metrics and rate_limiter are read from the ClientOptions.
+    Requests in flight are limited by the number of connections rather than a ConcurrencyLimiter.
+
+    Attributes:
+        base_url: Base URL for the GitLab instance
+        options: ClientOptions this client was created with
+        per_page: Number of results to request per page
+        max_retries: Number of times to retry requests that fail with a transient error
+        entity_cache: Cache of projects, groups, commits and users
+        api_metrics: Accounting of every request made by this client, by endpoint and scope
+        rate_limiter: Token bucket pacing requests to stay under the GitLab API rate limit
+    """
+
+    def __init__(self,
+                 token: str,
+                 base_url: str,
+                 options: ClientOptions | None = None,
+                 *,
+                 max_retries: int = 5):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for AsyncGitLabAPIClient, '
+                              'install it with: pip install gitlab-watchman[async]')
+        options = options or ClientOptions()
+        self.options = options = replace(
+            options,
+            pool_maxsize=options.pool_maxsize or DEFAULT_POOL_MAXSIZE,
+            search_concurrency=max(options.search_concurrency, 1),
+            timeouts={**DEFAULT_TIMEOUTS, **(options.timeouts or {})},
+            json_decoder=options.json_decoder or JSON_DECODERS.get(DEFAULT_JSON_DECODER))
+        self.base_url = base_url.rstrip('/')
+        self.per_page = 100
+        self.max_retries = max_retries
+        self.entity_cache = options.entity_cache if options.entity_cache is not None else EntityCache()
+        self.api_metrics = options.api_metrics if options.api_metrics is not None else ApiMetrics()
+        self.rate_limiter = options.rate_limiter if options.rate_limiter is not None else RateLimiter()
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._headers = {'Authorization': f'Bearer {token}'}
+        if not options.compress:
+            self._headers['Accept-Encoding'] = 'identity'
+        self._session = None
+
+    async def __aenter__(self) -> 'AsyncGitLabAPIClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        """ Pooled aiohttp session, created on first use so it belongs to the running event loop """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                connector=aiohttp.TCPConnector(limit=self.options.pool_maxsize))
+        return self._session
+
+    async def close(self):
+        """ Close the session and its connections """
+        if self._session is not None:
+            await self._session.close()
+
+    def _record_response(self, method: str, response: 'aiohttp.ClientResponse', elapsed: float, size: int):
+        """ Record a response, including retried ones, in api_metrics, and update the rate limiter
+        from its rate limit headers
+
+        Args:
+            method: HTTP method of the request
+            response: Response received
+            elapsed: Seconds taken to receive the response
+            size: Bytes received
+        """
+
+        self.api_metrics.record(method, str(response.url), response.status, elapsed, size)
+        remaining, reset, retry_after = rate_limit_headers(response.status, response.headers)
+        if remaining is not None or response.status == 429:
+            self.rate_limiter.update(response.status, remaining, reset, retry_after)
+
+    async def _get(self, path: str, params: Dict[str, Any] | None = None) -> Tuple[Any, Dict[str, str]]:
+        """ Make a GET request to the GitLab API, retrying transient errors
+
+        Args:
+            path: API path, relative to /api/v4
+            params: Query parameters
+        Returns:
+            Tuple of the decoded JSON response and the response headers
+        Raises:
+            GitlabAuthenticationError: If the token is not valid
+            GitlabHttpError: If the request fails
+        """
+        return await self._request('GET', path, params)
+
+    async def _request(self,
+                       method: str,
+                       path: str,
+                       params: Dict[str, Any] | None = None) -> Tuple[Any, Dict[str, str]]:
+        """ Make a request to the GitLab API, retrying transient errors
+
+        Args:
+            method: HTTP method, GET or HEAD
+            path: API path, relative to /api/v4
+            params: Query parameters
+        Returns:
+            Tuple of the decoded JSON response, None for HEAD requests, and the response headers
+        Raises:
+            GitlabAuthenticationError: If the token is not valid
+            GitlabHttpError: If the request fails
+        """
+
+        url = f'{self.base_url}/api/v4{path}'
+        connect_timeout, read_timeout = self.options.timeouts.get(endpoint_class(url))
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        for attempt in range(self.max_retries + 1):
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            start = time.monotonic()
+            async with self.session.request(method, url, params=params, timeout=timeout) as response:
+                body = await response.read()
+                self._record_response(method, response, time.monotonic() - start, len(body))
+                if response.status in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    await asyncio.sleep(retry_after if retry_after is not None else min(2 ** attempt * 0.1, 10))
+                    continue
+                if response.status == 401:
+                    raise GitlabAuthenticationError(
+                        response_code=response.status, error_message=body.decode(errors='replace'), response_body=body)
+                if response.status >= 400:
+                    raise GitlabHttpError(
+                        response_code=response.status, error_message=body.decode(errors='replace'), response_body=body)
+                return self.options.json_decoder(body) if body else None, response.headers.copy()
+
+    async def _get_all_pages(self, path: str, params: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+        """ Get every page of a paginated API path. The total number of pages is read from the
+        first response, and the remaining pages are requested concurrently
+
+        Args:
+            path: API path, relative to /api/v4
+            params: Query parameters
+        Returns:
+            List of results from all pages, in order
+        """
+
+        params = {**(params or {}), 'per_page': self.per_page}
+        first_page, headers = await self._get(path, {**params, 'page': 1})
+        if not headers.get('X-Total-Pages'):
+            return first_page + await self._get_pages_serially(path, params, headers)
+        total_pages = int(headers.get('X-Total-Pages'))
+        if total_pages <= 1:
+            return first_page
+
+        semaphore = asyncio.Semaphore(self.options.search_concurrency)
+
+        async def _get_page(page_number: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                page, _ = await self._get(path, {**params, 'page': page_number})
+                return page
+
+        pages = await asyncio.gather(*(_get_page(page_number) for page_number in range(2, total_pages + 1)))
+        return first_page + [item for page in pages for item in page]
+
+    async def _get_pages_serially(self,
+                                  path: str,
+                                  params: Dict[str, Any],
+                                  headers: Dict[str, str]) -> List[Dict[str, Any]]:
+        """ Follow X-Next-Page headers for paths where GitLab doesn't return the total page count
+
+        Args:
+            path: API path, relative to /api/v4
+            params: Query parameters
+            headers: Headers of the first page
+        Returns:
+            List of results from the remaining pages
+        """
+
+        results = []
+        while next_page := headers.get('X-Next-Page'):
+            page, headers = await self._get(path, {**params, 'page': next_page})
+            results.extend(page)
+        return results
+
+    async def _cached(self,
+                      entity_type: str,
+                      entity_id: Any,
+                      fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """ Return an entity from the entity cache, or fetch it and cache it. Concurrent lookups of
+        the same entity share one fetch, and all get its result or exception
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+            fetch: Coroutine function to call to fetch the entity from the GitLab API
+        Returns:
+            The entity
+        """
+
+        entity = self.entity_cache.get(entity_type, entity_id)
+        if entity is not None:
+            return entity
+        key = (entity_type, str(entity_id))
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.entity_cache.coalesced += 1
+        # Shielded, so one caller being cancelled doesn't cancel the fetch for the others
+        entity = await asyncio.shield(task)
+        if entity is not None:
+            self.entity_cache.set(entity_type, entity_id, entity)
+        return entity
+
+    async def _get_entity(self, path: str, params: Dict[str, Any] | None = None) -> Any:
+        entity, _ = await self._get(path, params)
+        return entity
+
+    @async_exception_handler
+    async def get_project(self, project_id: str) -> Dict[str, Any]:
+        """ Get a GitLab project by its ID
+
+        Args:
+            project_id: ID of the project to return
+        Returns:
+            JSON object with project information
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._cached(
+            'project', project_id,
+            lambda: self._get_entity(f'/projects/{quote(str(project_id), safe="")}'))
+
+    @async_exception_handler
+    async def get_file(self,
+                       project_id: str,
+                       path: str,
+                       ref: str) -> Dict[str, Any]:
+        """ Get a file stored in a project
+
+        Args:
+            project_id: ID of the project to retrieve
+            path: Full path to file
+            ref: The name of branch, tag or commit
+        Returns:
+            JSON object with the file information
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._get_entity(
+            f'/projects/{quote(str(project_id), safe="")}/repository/files/{quote(path, safe="")}',
+            {'ref': ref})
+
+    @async_exception_handler
+    async def get_file_metadata(self,
+                                project_id: str,
+                                path: str,
+                                ref: str) -> Dict[str, Any]:
+        """ Get the metadata of a file stored in a project, without downloading its content
+
+        Args:
+            project_id: ID of the project the file is in
+            path: Full path to file
+            ref: The name of branch, tag or commit
+        Returns:
+            Dict with the same file information as get_file, except for the content
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        _, headers = await self._request(
+            'HEAD',
+            f'/projects/{quote(str(project_id), safe="")}/repository/files/{quote(path, safe="")}',
+            {'ref': ref})
+        return file_metadata_from_headers(headers)
+
+    @async_exception_handler
+    async def get_commit(self,
+                         project_id: str,
+                         commit_id: str) -> Dict[str, Any]:
+        """ Get commit information
+
+        Args:
+            project_id: ID for the project the commit exists in
+            commit_id: ID of the commit
+        Returns:
+            Dict object containing commit data
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._cached(
+            'commit', f'{project_id}:{commit_id}',
+            lambda: self._get_entity(
+                f'/projects/{quote(str(project_id), safe="")}/repository/commits/{quote(commit_id, safe="")}'))
+
+    @async_exception_handler
+    async def get_group(self, group_id: str) -> Dict[str, Any]:
+        """ Get a GitLab group by its ID
+
+        Args:
+            group_id: ID of the group to return
+        Returns:
+            Dict with group information
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._cached(
+            'group', group_id,
+            lambda: self._get_entity(f'/groups/{quote(str(group_id), safe="")}'))
+
+    @async_exception_handler
+    async def get_group_members(self, group_id: str) -> List[Dict]:
+        """ Get members of a GitLab group
+
+        Args:
+            group_id: ID of the group to get members for
+        Returns:
+            Dict object with group member information
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._cached(
+            'group_members', group_id,
+            lambda: self._get_all_pages(f'/groups/{quote(str(group_id), safe="")}/members'))
+
+    @async_exception_handler
+    async def get_user_by_username(self, username: str) -> Dict[str, Any] | None:
+        """ Get a GitLab user by their username
+
+        Args:
+            username: Username of the user
+        Returns:
+            User object containing user data
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitlabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        async def _get_user() -> Dict[str, Any]:
+            users = await self._get_entity('/users', {'username': username, 'active': 'false', 'blocked': 'true'})
+            return users[0]
+
+        return await self._cached('user', username, _get_user)
+
+    @async_exception_handler
+    async def get_wiki_page(self,
+                            project_id: str,
+                            slug: str) -> Dict[str, Any]:
+        """ Get a wiki page from a project
+
+        Args:
+            project_id: ID of the project the wiki page is in
+            slug: URL slug for the wiki page
+        Returns:
+            JSON object containing wiki data
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return await self._get_entity(f'/projects/{quote(str(project_id), safe="")}/wikis/{quote(slug, safe="")}')
+
+    @async_exception_handler
+    async def global_search(self,
+                            search_term: str = '',
+                            search_scope: str = '',
+                            fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        """ Search using the GitLab advanced search API. Uses search term and scope to
+        decide what to search for. Pages after the first are downloaded concurrently.
+
+        Args:
+            search_term: Search string to use
+            search_scope: Scope of what to look for, see GitLabAPIClient.global_search for options
+            fields: Keys to keep in each result, None to keep them all
+        Returns:
+            List containing Dict objects with matches for the search string
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return select_fields(await self._get_all_pages('/search', {
+            'search': search_term,
+            'scope': SCOPE_MAP.get(search_scope, SearchScope.BLOBS).value
+        }), fields)
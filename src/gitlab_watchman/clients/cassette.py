@@ -0,0 +1,267 @@
+import base64
+import gzip
+import http.client
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from gitlab_watchman.clients.api_metrics import endpoint_template
+from gitlab_watchman.exceptions import CassetteMissError
+
+# Record every exchange, replay as fast as possible, or replay taking as long as each original request took
+CASSETTE_MODES = ['record', 'replay', 'replay-timed']
+
+# Response headers that aren't kept, because the body is stored decoded and its length is recomputed
+DROPPED_HEADERS = ['Content-Encoding', 'Content-Length', 'Transfer-Encoding', 'Set-Cookie']
+# Headers dropped when replaying as fast as possible, so the rate limiter doesn't pace requests by
+# a rate limit window that has already passed
+RATE_LIMIT_HEADERS = ['RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'RateLimit-Observed',
+                      'Retry-After']
+
+
+def request_key(method: str, url: str) -> str:
+    """ Key a request is recorded under: its method, path and query string. The host is left out, so
+    a cassette recorded from one GitLab instance can be replayed with any base URL
+
+    Args:
+        method: HTTP method
+        url: Request URL
+    Returns:
+        The key, e.g. GET /api/v4/projects/1
+    """
+
+    parsed = requests.utils.urlparse(url)
+    return f'{method} {parsed.path}?{parsed.query}' if parsed.query else f'{method} {parsed.path}'
+
+
+class Cassette:
+    """ Recording of the HTTP exchanges a client makes with the GitLab API, for replaying a scan
+    offline with the same traffic. Saved as a gzipped JSON Lines file, one exchange per line.
+
+    When the same request was recorded more than once, replays return its responses in the order
+    they were recorded, then keep returning the last one. Requests recorded and replayed are
+    counted by endpoint template, so tests can assert on the requests a scan makes.
+    """
+
+    def __init__(self, interactions: List[Dict[str, Any]] | None = None):
+        self._interactions: List[Dict[str, Any]] = []
+        self._index: Dict[str, List[int]] = {}
+        self._played: Counter = Counter()
+        self._counts: Counter = Counter()
+        self.misses = 0
+        self._lock = threading.Lock()
+        for interaction in interactions or []:
+            self._add(interaction)
+
+    def _add(self, interaction: Dict[str, Any]):
+        self._index.setdefault(request_key(interaction['method'], interaction['url']), []).append(
+            len(self._interactions))
+        self._interactions.append(interaction)
+
+    def record(self,
+               method: str,
+               url: str,
+               status_code: int,
+               headers: Dict[str, str],
+               body: bytes,
+               *,
+               elapsed: float):
+        """ Record an exchange
+
+        Args:
+            method: HTTP method of the request
+            url: Request URL
+            status_code: Status code of the response
+            headers: Response headers
+            body: Decoded response body
+            elapsed: Seconds the request took
+        """
+
+        dropped = {header.lower() for header in DROPPED_HEADERS}
+        with self._lock:
+            self._add({
+                'method': method,
+                'url': url,
+                'status': status_code,
+                'headers': {name: value for name, value in headers.items() if name.lower() not in dropped},
+                'body': body,
+                'elapsed': round(elapsed, 4)
+            })
+            self._counts[f'{method} {endpoint_template(url)[0]}'] += 1
+
+    def play(self, method: str, url: str) -> Dict[str, Any] | None:
+        """ Return the next recorded exchange for a request
+
+        Args:
+            method: HTTP method of the request
+            url: Request URL
+        Returns:
+            Dict with the status, headers, body and elapsed seconds of the recorded response,
+            or None if the request wasn't recorded
+        """
+
+        key = request_key(method, url)
+        with self._lock:
+            positions = self._index.get(key)
+            if not positions:
+                self.misses += 1
+                return None
+            interaction = self._interactions[positions[min(self._played[key], len(positions) - 1)]]
+            self._played[key] += 1
+            self._counts[f'{method} {endpoint_template(url)[0]}'] += 1
+            return interaction
+
+    def interactions(self) -> List[Dict[str, Any]]:
+        """ Return every recorded exchange, in the order they were recorded """
+        with self._lock:
+            return list(self._interactions)
+
+    def request_counts(self) -> Dict[str, int]:
+        """ Return the number of requests recorded or replayed to each endpoint
+
+        Returns:
+            Dict of method and endpoint template, e.g. GET /projects/:id, to the number of requests
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def stats(self) -> Dict[str, int]:
+        """ Return the number of recorded exchanges, and of replayed requests that weren't recorded """
+        with self._lock:
+            return {'interactions': len(self._interactions), 'misses': self.misses}
+
+    def save(self, path: str):
+        """ Write the recorded exchanges to a cassette file
+
+        Args:
+            path: Path of the file
+        """
+
+        with gzip.open(path, 'wt', encoding='utf-8') as cassette_file:
+            for interaction in self.interactions():
+                line = {**interaction}
+                try:
+                    line['body'] = interaction['body'].decode('utf-8')
+                except UnicodeDecodeError:
+                    line['body'] = base64.b64encode(interaction['body']).decode()
+                    line['base64'] = True
+                cassette_file.write(json.dumps(line, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def load(cls, path: str) -> 'Cassette':
+        """ Read a cassette file
+
+        Args:
+            path: Path of the file
+        Returns:
+            Cassette with the recorded exchanges
+        """
+
+        interactions = []
+        with gzip.open(path, 'rt', encoding='utf-8') as cassette_file:
+            for line in cassette_file:
+                interaction = json.loads(line)
+                if interaction.pop('base64', False):
+                    interaction['body'] = base64.b64decode(interaction['body'])
+                else:
+                    interaction['body'] = interaction['body'].encode('utf-8')
+                interactions.append(interaction)
+        return cls(interactions)
+
+
+class RecordingAdapter(BaseAdapter):
+    """ Transport adapter that sends requests with another adapter, and records every exchange in
+    a Cassette. Responses are recorded after any response cache has answered, so a replay gets the
+    same bodies without having to revalidate
+
+    Attributes:
+        cassette: Cassette exchanges are recorded in, can be a proxy to one shared between processes
+        adapter: Adapter that sends the requests
+    """
+
+    def __init__(self, cassette: Cassette, adapter: BaseAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """ Send a request with the wrapped adapter, and record the exchange in the cassette
+
+        Args:
+            request: Request to send
+            kwargs: Options for the wrapped adapter's send, such as timeout and stream
+        Returns:
+            The response
+        """
+
+        start = time.monotonic()
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request.method, request.url, response.status_code, dict(response.headers),
+                             response.content, elapsed=time.monotonic() - start)
+        return response
+
+    def close(self):
+        """ Close the wrapped adapter and its connection pool """
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """ Transport adapter that answers requests from a Cassette, without making any connections.
+    With `timed` set, each response takes as long as the original request did, so a replay with
+    the same workers reproduces the traffic of the recorded scan. Otherwise responses are returned
+    straight away, and the recorded rate limit headers are dropped. Requests that weren't recorded
+    raise CassetteMissError, rather than letting a replay silently drift from the recording
+
+    Attributes:
+        cassette: Cassette to replay, can be a proxy to one shared between processes
+        timed: Whether to take as long as the original requests did
+    """
+
+    def __init__(self, cassette: Cassette, timed: bool = False):
+        super().__init__()
+        self.cassette = cassette
+        self.timed = timed
+
+    def send(self, request: requests.PreparedRequest, **_kwargs) -> requests.Response:
+        """ Answer a request with the next recorded response to it. Send options such as timeout
+        and stream are ignored, as no connection is made
+
+        Args:
+            request: Request to answer
+        Returns:
+            The recorded response
+        Raises:
+            CassetteMissError: If the request wasn't recorded
+        """
+
+        interaction = self.cassette.play(request.method, request.url)
+        if interaction is None:
+            raise CassetteMissError(request.method, request.url)
+        if self.timed:
+            time.sleep(interaction.get('elapsed'))
+
+        headers = CaseInsensitiveDict(interaction.get('headers'))
+        if not self.timed:
+            for header in RATE_LIMIT_HEADERS:
+                headers.pop(header, None)
+        body = interaction.get('body')
+        headers['Content-Length'] = str(len(body))
+
+        response = requests.Response()
+        response.status_code = interaction.get('status')
+        response.reason = http.client.responses.get(response.status_code, '')
+        response.headers = headers
+        response._content = body  # pylint: disable=protected-access
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(headers)
+        return response
+
+    def close(self):
+        """ Nothing to close, as replaying makes no connections """
@@ -0,0 +1,207 @@
+import threading
+import time
+from typing import Any, Dict
+
+from gitlab_watchman.clients.api_metrics import endpoint_template
+
+ENDPOINT_CLASSES = ['search', 'projects', 'files', 'commits', 'members', 'other']
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MAX_LIMIT = 32
+
+# Requests slower than this multiple of the baseline latency count as a sign of an overloaded instance
+LATENCY_TOLERANCE = 2.0
+# Weight of each successful response in the baseline latency, an exponentially weighted moving average
+BASELINE_WEIGHT = 0.05
+# Multiplicative decrease applied after a 429 or 5xx response, and after a slow response
+ERROR_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.9
+
+
+def endpoint_class(url: str) -> str:
+    """ Classify a GitLab API URL into the endpoint class its concurrency is limited by
+
+    Args:
+        url: Request URL
+    Returns:
+        One of ENDPOINT_CLASSES
+    """
+
+    endpoint, _ = endpoint_template(url)
+    if endpoint.startswith('/search'):
+        return 'search'
+    if endpoint.endswith('/members') or endpoint.endswith('/members/all'):
+        return 'members'
+    if '/repository/files/' in endpoint:
+        return 'files'
+    if '/repository/commits/' in endpoint:
+        return 'commits'
+    if endpoint.startswith('/projects'):
+        return 'projects'
+    return 'other'
+
+
+class ConcurrencyLimiter:
+    """ Adaptive limit on the number of requests in flight to each class of endpoint,
+    adjusted with additive-increase/multiplicative-decrease (AIMD).
+
+    Once a class has reached its limit, each successful response raises the limit by 1/limit,
+    so it grows by about one per round of requests, until fewer than half its slots are in use.
+    A 429 or 5xx response halves it, and a response more than LATENCY_TOLERANCE times slower than
+    the baseline latency reduces it by 10%. Decreases happen at most once per baseline latency,
+    so one burst of errors only counts once.
+
+    acquire() waits for at most `timeout` seconds. Call it in a loop until it returns True.
+    Slots can be taken for an owner, such as the ID of the worker process sending the request, so
+    a worker that is killed before it releases its slots can have them released by release_owner().
+
+    Attributes:
+        initial_limit: Limit each endpoint class starts at
+        max_limit: Highest limit an endpoint class can reach
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT, max_limit: int = DEFAULT_MAX_LIMIT):
+        self.max_limit = max(max_limit, 1)
+        self.initial_limit = min(max(initial_limit, 1), self.max_limit)
+        self._classes: Dict[str, Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+
+    def _state(self, name: str) -> Dict[str, Any]:
+        if name not in self._classes:
+            self._classes[name] = {
+                'limit': float(self.initial_limit),
+                'in_flight': 0,
+                'owners': {},
+                'max_in_flight': 0,
+                'saturated': False,
+                'baseline': None,
+                'last_decrease': 0.0,
+                'increases': 0,
+                'decreases': 0,
+                'hedged': 0,
+                'hedge_wins': 0
+            }
+        return self._classes[name]
+
+    def acquire(self, name: str, timeout: float | None = None, owner: int | None = None) -> bool:
+        """ Take a slot for a request to an endpoint class, waiting for one to be released if
+        the class is at its limit
+
+        Args:
+            name: Endpoint class
+            timeout: Seconds to wait for a slot, None to wait until one is free
+            owner: ID of what is taking the slot, e.g. a process ID, for release_owner()
+        Returns:
+            Whether a slot was taken
+        """
+
+        with self._condition:
+            state = self._state(name)
+            if not self._condition.wait_for(lambda: state['in_flight'] < int(state['limit']), timeout):
+                return False
+            state['in_flight'] += 1
+            if owner is not None:
+                state['owners'][owner] = state['owners'].get(owner, 0) + 1
+            state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            if state['in_flight'] >= int(state['limit']):
+                state['saturated'] = True
+            return True
+
+    def release(self, name: str, status_code: int | None, elapsed: float, owner: int | None = None):
+        """ Release a slot, and adjust the limit for the endpoint class from the response
+
+        Args:
+            name: Endpoint class
+            status_code: Status code of the response, None if the request failed without a response
+            elapsed: Seconds the request took
+            owner: ID the slot was taken for, if any. Slots already released by release_owner()
+                aren't released again
+        """
+
+        with self._condition:
+            state = self._state(name)
+            if owner is not None:
+                if not state['owners'].get(owner):
+                    return
+                state['owners'][owner] -= 1
+                if not state['owners'][owner]:
+                    del state['owners'][owner]
+            state['in_flight'] -= 1
+            limit = int(state['limit'])
+            now = time.monotonic()
+            baseline = state['baseline'] if state['baseline'] is not None else elapsed
+            can_decrease = now - state['last_decrease'] > baseline
+            failed = status_code is None or status_code == 429 or status_code >= 500
+            if failed:
+                if can_decrease:
+                    self._decrease(state, ERROR_BACKOFF, now)
+            elif elapsed > baseline * LATENCY_TOLERANCE and can_decrease:
+                self._decrease(state, LATENCY_BACKOFF, now)
+            elif state['saturated'] and state['limit'] < self.max_limit:
+                state['limit'] = min(state['limit'] + 1 / state['limit'], self.max_limit)
+                state['increases'] += 1
+            if not failed:
+                state['baseline'] = baseline + (elapsed - baseline) * BASELINE_WEIGHT
+            if state['in_flight'] * 2 < limit:
+                state['saturated'] = False
+            self._condition.notify_all()
+
+    def release_owner(self, owner: int) -> int:
+        """ Release every slot taken for an owner, e.g. a worker process that was killed part way
+        through its requests, without adjusting the limits
+
+        Args:
+            owner: ID the slots were taken for
+        Returns:
+            Number of slots released
+        """
+
+        with self._condition:
+            released = 0
+            for state in self._classes.values():
+                count = state['owners'].pop(owner, 0)
+                state['in_flight'] -= count
+                released += count
+            if released:
+                self._condition.notify_all()
+            return released
+
+    def record_hedge(self, name: str, won: bool):
+        """ Count a hedged request
+
+        Args:
+            name: Endpoint class
+            won: Whether the hedge answered before the original request
+        """
+
+        with self._condition:
+            state = self._state(name)
+            state['hedged'] += 1
+            state['hedge_wins'] += int(won)
+
+    @staticmethod
+    def _decrease(state: Dict[str, Any], factor: float, now: float):
+        state['limit'] = max(state['limit'] * factor, 1.0)
+        state['last_decrease'] = now
+        state['decreases'] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """ Return the current state of each endpoint class
+
+        Returns:
+            Dict of endpoint class to its limit, the most requests it had in flight, the number of
+            increases and decreases, the number of hedged requests and how many of them answered
+            first, and the baseline latency in milliseconds
+        """
+
+        with self._condition:
+            return {
+                name: {
+                    'limit': round(state['limit'], 1),
+                    'max_in_flight': state['max_in_flight'],
+                    'increases': state['increases'],
+                    'decreases': state['decreases'],
+                    'hedged': state['hedged'],
+                    'hedge_wins': state['hedge_wins'],
+                    'baseline_ms': round(state['baseline'] * 1000, 1) if state['baseline'] is not None else None
+                } for name, state in self._classes.items()
+            }
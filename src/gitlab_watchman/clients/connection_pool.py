@@ -0,0 +1,78 @@
+import socket
+import threading
+from typing import Callable, Type
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+# TCP keep-alive stops idle pooled connections being dropped by load balancers and NAT
+# gateways while workers are busy matching, so they can be reused instead of reconnecting
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+def _counting_pool(pool_class: Type[HTTPConnectionPool],
+                   on_new_connection: Callable[[str], None]) -> Type[HTTPConnectionPool]:
+    """ Subclass a urllib3 connection pool to call `on_new_connection` with the scheme
+    whenever it opens a new connection, rather than reusing a pooled one """
+
+    class CountingConnectionPool(pool_class):
+        """ Connection pool reporting each connection it opens to `on_new_connection` """
+
+        def _new_conn(self):
+            on_new_connection(self.scheme)
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """ Transport adapter that keeps connections to the GitLab instance alive for reuse, and
+    counts every new connection it opens. New HTTPS connections each need a TLS handshake, so
+    a count close to the number of requests means connections aren't being reused.
+
+    Attributes:
+        connections_opened: Number of connections opened
+        tls_handshakes: Number of HTTPS connections opened
+        on_new_connection: Function called with the scheme of each new connection
+    """
+
+    def __init__(self,
+                 pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 on_new_connection: Callable[[str], None] | None = None,
+                 **kwargs):
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.on_new_connection = on_new_connection
+        self._lock = threading.Lock()
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, **kwargs)
+
+    def init_poolmanager(self, connections: int, maxsize: int, block: bool = False, **pool_kwargs):
+        """ Create the pool manager, with TCP keep-alive enabled on its sockets and its
+        connection pools counting each new connection
+
+        Args:
+            connections: Number of hosts to keep connection pools for
+            maxsize: Maximum number of connections to keep open to each host
+            block: Whether to wait for a free connection when the pool is full, rather than opening another
+            pool_kwargs: Extra keyword arguments for the pool manager
+        """
+
+        pool_kwargs.setdefault('socket_options', KEEPALIVE_SOCKET_OPTIONS)
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self._connection_opened),
+            'https': _counting_pool(HTTPSConnectionPool, self._connection_opened),
+        }
+
+    def _connection_opened(self, scheme: str):
+        with self._lock:
+            self.connections_opened += 1
+            if scheme == 'https':
+                self.tls_handshakes += 1
+        if self.on_new_connection:
+            self.on_new_connection(scheme)
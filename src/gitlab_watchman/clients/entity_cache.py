@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_SIZE = 10000
+# Seconds a claim to fetch an entity lasts, so a caller that dies while fetching doesn't hold
+# up everyone else waiting for the same entity
+CLAIM_TIMEOUT = 60
+# Seconds to wait for another caller's fetch in each call to claim() from a client
+CLAIM_WAIT = 0.05
+
+
+class EntityCache:
+    """ Thread-safe in-memory cache of GitLab entities, such as projects, groups, commits and
+    users, keyed by the entity type and its ID. Shared by everything using the same client,
+    so an entity only has to be fetched once per run.
+
+    Entries expire after `ttl` seconds, and once the cache holds `max_size` entries the least
+    recently used entry is evicted.
+
+    Concurrent lookups of an entity that isn't cached are coalesced with claim() and release():
+    the first caller claims the entity and fetches it, and the others wait for it to be cached
+    instead of making the same request.
+
+    Attributes:
+        ttl: Seconds an entry stays valid for, None to never expire entries
+        max_size: Maximum number of entries to hold, None for no limit
+        hits: Number of lookups served from the cache
+        misses: Number of lookups for entities that weren't cached, or had expired
+        evictions: Number of entries evicted to keep the cache within max_size
+        coalesced: Number of lookups served from the cache after waiting for another caller to fetch the entity
+    """
+
+    def __init__(self, ttl: float | None = DEFAULT_TTL, max_size: int | None = DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._entities: OrderedDict[Tuple[str, str], Tuple[float, Any]] = OrderedDict()
+        self._claims: Dict[Tuple[str, str], float] = {}
+        self._condition = threading.Condition()
+
+    def get(self, entity_type: str, entity_id: Any) -> Any | None:
+        """ Return a cached entity
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+        Returns:
+            The entity, or None if it isn't cached or has expired
+        """
+
+        with self._condition:
+            entity = self._lookup((entity_type, str(entity_id)))
+            if entity is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entity
+
+    def _lookup(self, key: Tuple[str, str]) -> Any | None:
+        entry = self._entities.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            if entry is not None:
+                del self._entities[key]
+            return None
+        self._entities.move_to_end(key)
+        return entry[1]
+
+    def claim(self,
+              entity_type: str,
+              entity_id: Any,
+              timeout: float | None = None,
+              waited: bool = False) -> Tuple[Any | None, bool]:
+        """ Return a cached entity, or claim it so the caller fetches it while other callers wait.
+        If another caller has already claimed the entity, wait up to `timeout` seconds for it to be
+        cached or released. A caller that gets neither the entity nor the claim should call claim()
+        again with `waited` set, and one that gets the claim must call release() once it has
+        fetched the entity.
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+            timeout: Seconds to wait for another caller fetching the entity, None to wait until it's done
+            waited: Whether the caller has already waited for the entity in an earlier call
+        Returns:
+            Tuple of the entity, or None if it isn't cached, and whether the caller claimed it
+        """
+
+        key = (entity_type, str(entity_id))
+        with self._condition:
+            entity = self._lookup(key)
+            if entity is None and self._claimed(key):
+                waited = True
+                self._condition.wait_for(lambda: not self._claimed(key) or self._lookup(key) is not None, timeout)
+                entity = self._lookup(key)
+            if entity is not None:
+                self.hits += 1
+                self.coalesced += int(waited)
+                return entity, False
+            if self._claimed(key):
+                return None, False
+            self._claims[key] = time.monotonic() + CLAIM_TIMEOUT
+            self.misses += 1
+            return None, True
+
+    def _claimed(self, key: Tuple[str, str]) -> bool:
+        return self._claims.get(key, 0) > time.monotonic()
+
+    def release(self, entity_type: str, entity_id: Any):
+        """ Release a claim taken with claim(), waking the callers waiting for the entity
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+        """
+
+        with self._condition:
+            self._claims.pop((entity_type, str(entity_id)), None)
+            self._condition.notify_all()
+
+    def set(self, entity_type: str, entity_id: Any, entity: Any):
+        """ Add an entity to the cache, evicting the least recently used entries if the cache is full
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+            entity: The entity to cache
+        """
+
+        key = (entity_type, str(entity_id))
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._condition:
+            self._entities[key] = (expires_at, entity)
+            self._entities.move_to_end(key)
+            while self.max_size is not None and len(self._entities) > self.max_size:
+                self._entities.popitem(last=False)
+                self.evictions += 1
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        """ Return the cache counters
+
+        Returns:
+            Dict with the hits, misses, evictions, coalesced lookups and current size of the cache
+        """
+
+        with self._condition:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'size': len(self._entities)
+            }
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._entities)
@@ -1,6 +1,13 @@
 import calendar
+import inspect
+import itertools
+import json
 import time
-from typing import List, Dict, Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import List, Dict, Any, Iterator, Callable, Mapping, Tuple
 
 import requests
 from gitlab import Gitlab
@@ -10,72 +17,330 @@ from gitlab.exceptions import (
     GitlabLicenseError,
     GitlabAuthenticationError,
     GitlabGetError,
+    GitlabHeadError,
     GitlabListError,
     GitlabSearchError,
     GitlabHttpError
 )
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.cassette import Cassette, RecordingAdapter, ReplayAdapter
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter
+from gitlab_watchman.clients.connection_pool import (
+    DEFAULT_POOL_CONNECTIONS,
+    DEFAULT_POOL_MAXSIZE,
+    PooledHTTPAdapter
+)
+from gitlab_watchman.clients.entity_cache import EntityCache, CLAIM_WAIT
+from gitlab_watchman.clients.http_cache import CachingHTTPAdapter, DiskCache, DEFAULT_CACHE_DIR_SIZE_MB
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.clients.session import GitLabSession
 from gitlab_watchman.exceptions import (
     GitLabWatchmanAuthenticationError,
     GitLabWatchmanGetObjectError,
     GitLabWatchmanNotAuthorisedError
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 ALL_TIME = calendar.timegm(time.gmtime()) + 1576800000
 
+# Functions that can decode the JSON body of search results, selected with --json-decoder
+JSON_DECODERS: Dict[str, Callable[[bytes | str], Any]] = {'json': json.loads}
+if orjson is not None:
+    JSON_DECODERS['orjson'] = orjson.loads  # pylint: disable=no-member
+DEFAULT_JSON_DECODER = 'orjson' if orjson is not None else 'json'
+
+SCOPE_MAP = {
+    'blobs': SearchScope.BLOBS,
+    'commits': SearchScope.COMMITS,
+    'issues': SearchScope.ISSUES,
+    'merge_requests': SearchScope.MERGE_REQUESTS,
+    'wiki_blobs': SearchScope.WIKI_BLOBS,
+    'milestones': SearchScope.MILESTONES,
+    'notes': SearchScope.PROJECT_NOTES,
+    'snippet_titles': SearchScope.GLOBAL_SNIPPET_TITLES,
+}
+
+
+@contextmanager
+def _translate_exceptions(func, args):
+    """ Context manager that maps exceptions raised by the GitLab API to GitLab Watchman exceptions
+    """
+
+    try:
+        yield
+    except GitlabAuthenticationError as e:
+        raise GitLabWatchmanAuthenticationError(e.error_message) from e
+    except (GitlabGetError,
+            GitlabHeadError,
+            GitlabListError,
+            GitlabLicenseError,
+            GitlabSearchError,
+            GitlabHttpError) as e:
+        if e.response_code == 403:
+            raise GitLabWatchmanNotAuthorisedError(e.error_message, func) from e
+        elif e.response_code == 500:
+            pass
+        else:
+            raise GitLabWatchmanGetObjectError(e.error_message, func, args) from e
+    except IndexError:
+        pass
+    except Exception as e:
+        raise e
+
 
 def exception_handler(func):
-    """ Decorator to handle exceptions raised by the GitLab API
+    """ Decorator to handle exceptions raised by the GitLab API. Generator functions
+    have exceptions raised during iteration handled as well
     """
 
     def inner_function(*args, **kwargs):
-        try:
+        with _translate_exceptions(func, args):
             return func(*args, **kwargs)
-        except GitlabAuthenticationError as e:
-            raise GitLabWatchmanAuthenticationError(e.error_message) from e
-        except (GitlabGetError,
-                GitlabListError,
-                GitlabLicenseError,
-                GitlabSearchError,
-                GitlabHttpError) as e:
-            if e.response_code == 403:
-                raise GitLabWatchmanNotAuthorisedError(e.error_message, func) from e
-            elif e.response_code == 500:
-                pass
-            else:
-                raise GitLabWatchmanGetObjectError(e.error_message, func, args) from e
-        except IndexError:
-            pass
-        except Exception as e:
-            raise e
 
+    def inner_generator(*args, **kwargs):
+        with _translate_exceptions(func, args):
+            yield from func(*args, **kwargs)
+
+    if inspect.isgeneratorfunction(func):
+        return inner_generator
     return inner_function
 
 
-class GitLabAPIClient:
+def file_metadata_from_headers(headers: Mapping[str, str]) -> Dict[str, Any]:
+    """ Convert the X-Gitlab-* headers returned by a HEAD request for a repository file
+    to a dict with the same keys as the files API returns
+
+    Args:
+        headers: Response headers, case-insensitive
+    Returns:
+        Dict with the file information
+    """
+
+    size = headers.get('X-Gitlab-Size')
+    return {
+        'file_name': headers.get('X-Gitlab-File-Name'),
+        'file_path': headers.get('X-Gitlab-File-Path'),
+        'size': int(size) if size else None,
+        'encoding': headers.get('X-Gitlab-Encoding'),
+        'content_sha256': headers.get('X-Gitlab-Content-Sha256'),
+        'ref': headers.get('X-Gitlab-Ref'),
+        'blob_id': headers.get('X-Gitlab-Blob-Id'),
+        'commit_id': headers.get('X-Gitlab-Commit-Id'),
+        'last_commit_id': headers.get('X-Gitlab-Last-Commit-Id'),
+    }
+
+
+def select_fields(results: List[Dict[str, Any]], fields: List[str] | None) -> List[Dict[str, Any]]:
+    """ Keep only the given keys of each search result
+
+    Args:
+        results: Search results
+        fields: Keys to keep, None to keep them all
+    Returns:
+        List of the results with only the given keys
+    """
+
+    if not fields:
+        return results
+    return [{field: result.get(field) for field in fields if field in result} for result in results]
+
+
+@dataclass
+class ClientOptions:  # pylint: disable=too-many-instance-attributes
+    """ Dataclass for the settings of a GitLabAPIClient, and the state it shares with other clients
+
+    Attributes:
+        search_concurrency: Maximum number of search result pages to download at the same time
+        pool_maxsize: Connections to the GitLab instance to keep open for reuse, DEFAULT_POOL_MAXSIZE if None
+        pool_connections: Number of hosts to keep connection pools for
+        compress: Whether to ask for gzip compressed responses. Turning it off trades bandwidth
+            for the CPU time spent decompressing
+        timeouts: Connect and read timeouts for each endpoint class, overriding DEFAULT_TIMEOUTS
+        hedge_requests: Whether to send a second copy of GET requests slower than the recent p95 latency
+        json_decoder: Function decoding the JSON body of search results, one of JSON_DECODERS by default
+        cache_dir: Directory to revalidate responses stored on disk with their ETags from, None to not cache them
+        cache_dir_size: Maximum size of the response cache in cache_dir, in megabytes
+        cassette: Cassette to record every exchange in, or to answer every request from, None to use
+            the GitLab instance as normal
+        cassette_mode: One of CASSETTE_MODES, whether to record to or replay from the cassette
+        entity_cache: Cache of projects, groups, commits and users, a new one is made if None
+        api_metrics: Accounting of every request made, a new one is made if None
+        rate_limiter: Token bucket pacing requests to stay under the GitLab API rate limit
+        concurrency_limiter: Adaptive limit on the requests in flight to each endpoint class
+    """
+    search_concurrency: int = 4
+    pool_maxsize: int | None = None
+    pool_connections: int = DEFAULT_POOL_CONNECTIONS
+    compress: bool = True
+    timeouts: Dict[str, Tuple[float, float]] | None = None
+    hedge_requests: bool = False
+    json_decoder: Callable[[bytes | str], Any] | None = None
+    cache_dir: str | None = None
+    cache_dir_size: int = DEFAULT_CACHE_DIR_SIZE_MB
+    cassette: Cassette | None = None
+    cassette_mode: str = 'record'
+    entity_cache: EntityCache | None = None
+    api_metrics: ApiMetrics | None = None
+    rate_limiter: RateLimiter | None = None
+    concurrency_limiter: ConcurrencyLimiter | None = None
+
+
+class GitLabAPIClient:  # pylint: disable=too-many-public-methods
     """ Class to interact with the GitLab API
 
     Attributes:
         base_url: Base URL for the GitLab instance
-        session: Session object to make requests
+        options: ClientOptions this client was created with
+        session: Session object to make requests, with its own connection pool. Each worker
+            process builds its own client, so sessions are never shared across a fork
+        adapter: Transport adapter holding the connection pool, which counts new connections
+        transport: Transport adapter mounted on the session, `adapter` unless recording or replaying a cassette
         gitlab_client: GitLab client object to interact with the API
+        per_page: Number of results to request per page
+        entity_cache: Cache of projects, groups, commits and users shared by everything using this client
+        http_cache: Adapter revalidating responses stored on disk with their ETags, None if not enabled
+        api_metrics: Accounting of every request made by this client, by endpoint and scope
+        rate_limiter: Token bucket pacing requests to stay under the GitLab API rate limit
+        concurrency_limiter: Adaptive limit on the requests in flight to each endpoint class
+        cassette: Cassette the requests of this client are recorded to or replayed from
     """
 
     @exception_handler
     def __init__(self,
                  token: str,
-                 base_url: str):
+                 base_url: str,
+                 options: ClientOptions | None = None):
+        options = options or ClientOptions()
+        self.options = options = replace(
+            options,
+            search_concurrency=max(options.search_concurrency, 1),
+            json_decoder=options.json_decoder or JSON_DECODERS.get(DEFAULT_JSON_DECODER))
         self.base_url = base_url.rstrip('\\')
-        self.session = session = requests.session()
+        self.per_page = 100
+        self.entity_cache = options.entity_cache if options.entity_cache is not None else EntityCache()
+        self.api_metrics = options.api_metrics if options.api_metrics is not None else ApiMetrics()
+        self.session = session = GitLabSession(
+            options.rate_limiter, options.concurrency_limiter, options.timeouts, options.hedge_requests)
         session.headers.update({'Authorization': f'Bearer {token}'})
+        session.hooks['response'].append(self._record_response)
+        if not options.compress:
+            session.headers.update({'Accept-Encoding': 'identity'})
+        adapter_kwargs = {
+            'pool_connections': options.pool_connections,
+            'pool_maxsize': max(options.pool_maxsize or DEFAULT_POOL_MAXSIZE, options.search_concurrency),
+            'on_new_connection': self._record_connection
+        }
+        if options.cache_dir:
+            self.http_cache = self.adapter = CachingHTTPAdapter(
+                DiskCache(options.cache_dir, options.cache_dir_size * 1024 * 1024),
+                on_store=self._record_cache_store,
+                **adapter_kwargs)
+        else:
+            self.http_cache = None
+            self.adapter = PooledHTTPAdapter(**adapter_kwargs)
+        if options.cassette is None:
+            self.transport = self.adapter
+        elif options.cassette_mode == 'record':
+            self.transport = RecordingAdapter(options.cassette, self.adapter)
+        else:
+            self.transport = ReplayAdapter(options.cassette, timed=options.cassette_mode == 'replay-timed')
+        session.mount('https://', self.transport)
+        session.mount('http://', self.transport)
         self.gitlab_client = Gitlab(
             url=self.base_url,
             private_token=token,
             session=self.session,
-            per_page=100,
+            per_page=self.per_page,
             retry_transient_errors=True,
             api_version='4')
         self.gitlab_client.auth()
 
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """ RateLimiter pacing the requests made by this client """
+        return self.session.rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, rate_limiter: RateLimiter):
+        self.session.rate_limiter = rate_limiter
+
+    @property
+    def concurrency_limiter(self) -> ConcurrencyLimiter:
+        """ ConcurrencyLimiter for the requests made by this client """
+        return self.session.concurrency_limiter
+
+    @concurrency_limiter.setter
+    def concurrency_limiter(self, concurrency_limiter: ConcurrencyLimiter):
+        self.session.concurrency_limiter = concurrency_limiter
+
+    @property
+    def cassette(self) -> Cassette | None:
+        """ Cassette the requests of this client are recorded to or replayed from """
+        return getattr(self.transport, 'cassette', None)
+
+    @cassette.setter
+    def cassette(self, cassette: Cassette):
+        self.transport.cassette = cassette
+
+    def _record_response(self, response: requests.Response, *_args, **kwargs):
+        """ Session response hook recording every response, including retried ones, in api_metrics.
+        Streamed bodies aren't read here, so their size is taken from the Content-Length header
+        """
+
+        if kwargs.get('stream'):
+            size = int(response.headers.get('Content-Length', 0))
+        else:
+            size = len(response.content)
+        cached = getattr(response, 'from_cache', False)
+        self.api_metrics.record(
+            response.request.method,
+            response.request.url,
+            response.status_code,
+            response.elapsed.total_seconds(),
+            0 if cached else size,
+            cached=cached)
+
+    def _record_connection(self, scheme: str):
+        """ Adapter callback recording each new connection in api_metrics """
+        self.api_metrics.record_connection(scheme)
+
+    def _record_cache_store(self):
+        """ Adapter callback recording each response added to the on-disk response cache in api_metrics """
+        self.api_metrics.record_cache_store()
+
+    def _get_cached(self,
+                    entity_type: str,
+                    entity_id: Any,
+                    fetch: Callable[[], Any]) -> Any:
+        """ Return an entity from the entity cache, or fetch it and cache it. Lookups of the same
+        entity from other threads, or other processes sharing the cache, wait for this fetch
+        rather than making the same request. The fetch runs here rather than in the cache,
+        so the cache can be a proxy to an EntityCache shared between processes
+
+        Args:
+            entity_type: Type of the entity, e.g. project
+            entity_id: ID of the entity
+            fetch: Function to call to fetch the entity from the GitLab API
+        Returns:
+            The entity
+        """
+
+        entity, claimed = self.entity_cache.claim(entity_type, entity_id, CLAIM_WAIT)
+        while entity is None and not claimed:
+            entity, claimed = self.entity_cache.claim(entity_type, entity_id, CLAIM_WAIT, True)
+        if claimed:
+            try:
+                entity = fetch()
+                if entity is not None:
+                    self.entity_cache.set(entity_type, entity_id, entity)
+            finally:
+                self.entity_cache.release(entity_type, entity_id)
+        return entity
+
     @exception_handler
     def get_user_info(self) -> Dict[str, Any]:
         """ Get information on the authenticated user
@@ -112,7 +377,10 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitlabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.users.list(username=username, active=False, blocked=True)[0].asdict()
+        def _get_user() -> Dict[str, Any]:
+            return self.gitlab_client.users.list(username=username, active=False, blocked=True)[0].asdict()
+
+        return self._get_cached('user', username, _get_user)
 
     @exception_handler
     def get_settings(self) -> Dict[str, Any]:
@@ -183,7 +451,9 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.projects.get(project_id).asdict()
+        return self._get_cached(
+            'project', project_id,
+            lambda: self.gitlab_client.projects.get(project_id).asdict())
 
     @exception_handler
     def get_all_projects(self) -> List[Dict]:
@@ -210,7 +480,7 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        members = self.gitlab_client.projects.get(project_id).members.list(as_list=True, get_all=True)
+        members = self.gitlab_client.projects.get(project_id, lazy=True).members.list(as_list=True, get_all=True)
         return [member.asdict() for member in members]
 
     @exception_handler
@@ -230,9 +500,30 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.projects.get(project_id).files.get(
+        return self.gitlab_client.projects.get(project_id, lazy=True).files.get(
             file_path=path, ref=ref).asdict()
 
+    @exception_handler
+    def get_file_metadata(self,
+                          project_id: str,
+                          path: str,
+                          ref: str) -> Dict[str, Any]:
+        """ Get the metadata of a file stored in a project, without downloading its content.
+        Uses a HEAD request, and reads the metadata from the X-Gitlab-* response headers
+
+        Args:
+            project_id: ID of the project the file is in
+            path: Full path to file
+            ref: The name of branch, tag or commit
+        Returns:
+            Dict with the same file information as get_file, except for the content
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+        return file_metadata_from_headers(
+            self.gitlab_client.projects.get(project_id, lazy=True).files.head(path, ref=ref))
+
     @exception_handler
     def get_group(self, group_id: str) -> Dict[str, Any]:
         """ Get a GitLab group by its ID
@@ -245,7 +536,9 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.groups.get(group_id).asdict()
+        return self._get_cached(
+            'group', group_id,
+            lambda: self.gitlab_client.groups.get(group_id).asdict())
 
     @exception_handler
     def get_all_groups(self) -> List[Dict]:
@@ -272,8 +565,10 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        members = self.gitlab_client.groups.get(group_id).members.list(as_list=True, get_all=True)
-        return [member.asdict() for member in members]
+        return self._get_cached(
+            'group_members', group_id,
+            lambda: [member.asdict() for member in
+                     self.gitlab_client.groups.get(group_id, lazy=True).members.list(as_list=True, get_all=True)])
 
     @exception_handler
     def get_commit(self,
@@ -290,7 +585,9 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.projects.get(project_id).commits.get(commit_id).asdict()
+        return self._get_cached(
+            'commit', f'{project_id}:{commit_id}',
+            lambda: self.gitlab_client.projects.get(project_id, lazy=True).commits.get(commit_id).asdict())
 
     @exception_handler
     def get_wiki_page(self,
@@ -307,12 +604,13 @@ class GitLabAPIClient:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        return self.gitlab_client.projects.get(project_id).wikis.get(slug).asdict()
+        return self.gitlab_client.projects.get(project_id, lazy=True).wikis.get(slug).asdict()
 
     @exception_handler
     def global_search(self,
                       search_term: str = '',
-                      search_scope: str = '') -> List[Dict[str, Any]]:
+                      search_scope: str = '',
+                      fields: List[str] | None = None) -> List[Dict[str, Any]]:
         """ Search using the GitLab advanced search API. Uses search term and scope to
         decide what to search for.
 
@@ -327,26 +625,95 @@ class GitLabAPIClient:
                 - milestones
                 - notes
                 - snippet_titles
+            fields: Keys to keep in each result, None to keep them all
         Returns:
             List containing Dict objects with matches for the search string
         Raises:
             GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
             GitLabWatchmanGetObjectError: If an error occurs while getting the object
         """
-        scope_map = {
-            'blobs': SearchScope.BLOBS,
-            'commits': SearchScope.COMMITS,
-            'issues': SearchScope.ISSUES,
-            'merge_requests': SearchScope.MERGE_REQUESTS,
-            'wiki_blobs': SearchScope.WIKI_BLOBS,
-            'milestones': SearchScope.MILESTONES,
-            'notes': SearchScope.PROJECT_NOTES,
-            'snippet_titles': SearchScope.GLOBAL_SNIPPET_TITLES,
-        }
 
-        return self.gitlab_client.search(
-            search=search_term,
-            scope=scope_map.get(search_scope, SearchScope.BLOBS),
-            all=True,
-            as_list=True,
-            per_page=100)
+        return [result for page in self.global_search_pages(search_term, search_scope, fields) for result in page]
+
+    def _search_page(self,
+                     params: Dict[str, Any],
+                     fields: List[str] | None = None) -> Tuple[List[Dict[str, Any]], Mapping[str, str]]:
+        """ Get one page of search results. The response body is decoded straight into dicts
+        with options.json_decoder, rather than through python-gitlab's list objects. Requests still go
+        through python-gitlab, so they are retried and their errors raised the same way
+
+        Args:
+            params: Query parameters, including the page number
+            fields: Keys to keep in each result, None to keep them all
+        Returns:
+            Tuple of the results on the page, and the response headers
+        Raises:
+            GitlabHttpError: If the request fails
+        """
+
+        response = self.gitlab_client.http_request('get', '/search', query_data=params)
+        results = self.options.json_decoder(response.content) if response.content else []
+        return select_fields(results, fields), response.headers
+
+    @exception_handler
+    def global_search_pages(self,
+                            search_term: str = '',
+                            search_scope: str = '',
+                            fields: List[str] | None = None) -> Iterator[List[Dict[str, Any]]]:
+        """ Search using the GitLab advanced search API, yielding each page of results as
+        soon as it is available. The total number of pages is read from the first response,
+        and the remaining pages are downloaded concurrently, up to `options.search_concurrency` at a time.
+        Pages are always yielded in order.
+
+        Args:
+            search_term: Search string to use
+            search_scope: Scope of what to look for, see global_search for options
+            fields: Keys to keep in each result, None to keep them all. Leaving out large
+                fields the caller doesn't use saves memory, and the cost of passing results
+                to worker processes
+        Returns:
+            Generator of lists containing Dict objects with matches for the search string
+        Raises:
+            GitLabWatchmanNotAuthorisedError: If the user is not authorized to access the resource
+            GitLabWatchmanGetObjectError: If an error occurs while getting the object
+        """
+
+        params = {
+            'search': search_term,
+            'scope': SCOPE_MAP.get(search_scope, SearchScope.BLOBS).value,
+            'per_page': self.per_page
+        }
+        page, headers = self._search_page({**params, 'page': 1}, fields)
+        total_pages = int(headers.get('X-Total-Pages') or 0)
+
+        # GitLab doesn't return the total pages for more than 10,000 results, or the
+        # concurrency may be limited to 1. In both cases pages are read one after another.
+        if total_pages <= 1 or self.options.search_concurrency <= 1:
+            while page:
+                yield page
+                next_page = headers.get('X-Next-Page')
+                if not next_page:
+                    return
+                page, headers = self._search_page({**params, 'page': int(next_page)}, fields)
+            return
+
+        yield page
+
+        def _get_page(page_number: int) -> List[Dict[str, Any]]:
+            return self._search_page({**params, 'page': page_number}, fields)[0]
+
+        remaining_pages = iter(range(2, total_pages + 1))
+        with ThreadPoolExecutor(max_workers=self.options.search_concurrency) as executor:
+            pending = deque(
+                executor.submit(_get_page, page_number)
+                for page_number in itertools.islice(remaining_pages, self.options.search_concurrency))
+            try:
+                while pending:
+                    page = pending.popleft().result()
+                    for page_number in itertools.islice(remaining_pages, 1):
+                        pending.append(executor.submit(_get_page, page_number))
+                    if page:
+                        yield page
+            finally:
+                for future in pending:
+                    future.cancel()
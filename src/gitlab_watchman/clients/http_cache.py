@@ -0,0 +1,246 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from gitlab_watchman.clients.connection_pool import PooledHTTPAdapter
+
+DEFAULT_CACHE_DIR_SIZE_MB = 512
+
+# Paths that aren't worth caching: search results are large and rarely requested twice,
+# and token and metadata information should always be current
+UNCACHED_PATHS = [
+    '/api/v4/search',
+    '/api/v4/personal_access_tokens/self',
+    '/api/v4/metadata',
+]
+# Headers of a 304 response that describe its own empty body rather than the cached one
+BODY_HEADERS = {'content-length', 'content-encoding', 'content-type', 'transfer-encoding'}
+
+
+class DiskCache:
+    """ On-disk store of GitLab API responses and their ETags. Each response is stored as a JSON file
+    named after a hash of the token and URL, so responses for different tokens are kept apart.
+    Once the total size of the cache goes over `max_bytes`, the least recently used responses
+    are removed. Files are replaced atomically, so the cache can be shared by multiple processes.
+
+    Attributes:
+        cache_dir: Directory the cache is stored in
+        max_bytes: Maximum size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_DIR_SIZE_MB * 1024 * 1024):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._cache_files())
+
+    def _cache_files(self) -> List[str]:
+        cache_files = []
+        for root, _, files in os.walk(self.cache_dir):
+            cache_files.extend(os.path.join(root, f) for f in files if f.endswith('.json'))
+        return cache_files
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    @staticmethod
+    def key(request: requests.PreparedRequest) -> str:
+        """ Cache key for a request, made from the token used and the URL
+
+        Args:
+            request: Request to get the key for
+        Returns:
+            Hex digest to use as the cache key
+        """
+
+        token = request.headers.get('Authorization') or request.headers.get('PRIVATE-TOKEN') or ''
+        return hashlib.sha256(f'{token}\n{request.url}'.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """ Get a cached response, marking it as recently used
+
+        Args:
+            key: Cache key of the response
+        Returns:
+            Dict with the ETag, headers and body of the response, or None if it isn't cached
+        """
+
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        entry['body'] = base64.b64decode(entry.get('body', ''))
+        return entry
+
+    def set(self, key: str, etag: str, headers: Dict[str, str], body: bytes):
+        """ Store a response, evicting the least recently used responses if the cache is full
+
+        Args:
+            key: Cache key of the response
+            etag: ETag returned with the response
+            headers: Response headers
+            body: Response body
+        """
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        data = json.dumps({
+            'etag': etag,
+            'headers': headers,
+            'body': base64.b64encode(body).decode()
+        }).encode()
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._size += len(data) - previous_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """ Remove the least recently used responses until the cache is at 90% of its maximum size """
+
+        entries = []
+        for path in self._cache_files():
+            try:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    @property
+    def size(self) -> int:
+        """ Approximate size of the cache in bytes, counting the responses stored by this process """
+        with self._lock:
+            return self._size
+
+    def disk_size(self) -> int:
+        """ Size of the cache in bytes, measured on disk so responses stored by other processes
+        sharing the cache are counted too """
+
+        size = 0
+        for path in self._cache_files():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                continue
+        with self._lock:
+            self._size = size
+        return size
+
+
+class CachingHTTPAdapter(PooledHTTPAdapter):
+    """ Transport adapter that revalidates cached GET responses with If-None-Match. When GitLab
+    answers 304 Not Modified, the cached response is returned instead, so unchanged entities don't
+    have to be downloaded again. Responses served from the cache have `from_cache` set.
+
+    Attributes:
+        cache: DiskCache responses are stored in
+        revalidated: Number of requests answered from the cache after a 304 response
+        stored: Number of responses added to the cache
+        on_store: Function called each time a response is added to the cache
+    """
+
+    def __init__(self, cache: DiskCache, on_store: Callable[[], None] | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.revalidated = 0
+        self.stored = 0
+        self.on_store = on_store
+
+    @staticmethod
+    def _is_cacheable(request: requests.PreparedRequest) -> bool:
+        if request.method != 'GET':
+            return False
+        path = requests.utils.urlparse(request.url).path
+        return not any(path.startswith(uncached) for uncached in UNCACHED_PATHS)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if not self._is_cacheable(request):
+            return super().send(request, **kwargs)
+
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry:
+            request.headers['If-None-Match'] = entry.get('etag')
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self.revalidated += 1
+            return self._build_cached_response(request, response, entry)
+        if response.status_code == 200 and response.headers.get('ETag'):
+            self.cache.set(key, response.headers.get('ETag'), dict(response.headers), response.content)
+            self.stored += 1
+            if self.on_store:
+                self.on_store()
+        return response
+
+    @staticmethod
+    def _build_cached_response(request: requests.PreparedRequest,
+                               not_modified: requests.Response,
+                               entry: Dict[str, Any]) -> requests.Response:
+        """ Build a 200 response from a cached entry, to return in place of a 304 response. The
+        headers of the 304 response are merged over the cached ones, so headers such as ETag, Date
+        and RateLimit-Remaining are current
+
+        Args:
+            request: Request that was sent
+            not_modified: The 304 response returned by GitLab
+            entry: Cached entry for the request
+        Returns:
+            Response with the cached body, and the cached headers updated by the 304 response
+        """
+
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry.get('headers'))
+        for name, value in not_modified.headers.items():
+            if name.lower() not in BODY_HEADERS:
+                response.headers[name] = value
+        response.headers.pop('Content-Encoding', None)
+        response.headers['Content-Length'] = str(len(entry.get('body')))
+        response._content = entry.get('body')  # pylint: disable=protected-access
+        response.url = request.url
+        response.request = request
+        response.elapsed = not_modified.elapsed
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.connection = not_modified.connection
+        response.from_cache = True
+        not_modified.close()
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        """ Return the cache counters
+
+        Returns:
+            Dict with the number of revalidated and stored responses, and the size of the cache in bytes
+        """
+        return {
+            'revalidated': self.revalidated,
+            'stored': self.stored,
+            'size': self.cache.size
+        }
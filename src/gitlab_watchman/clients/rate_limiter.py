@@ -0,0 +1,157 @@
+import email.utils
+import threading
+import time
+from typing import Dict, Mapping, Tuple
+
+# Fraction of the remaining rate limit to use, leaving room for other users of the instance
+RATE_LIMIT_HEADROOM = 0.9
+# Slowest rate requests are paced at, in requests per second, while the rate limit has requests remaining
+MIN_RATE = 0.1
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """ Parse a Retry-After header, which can either be a number of seconds or an HTTP date
+
+    Args:
+        value: Value of the header
+    Returns:
+        Seconds to wait, or None if the header is missing or invalid
+    """
+
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_headers(status_code: int,
+                       headers: Mapping[str, str]) -> Tuple[int | None, float | None, float | None]:
+    """ Read the rate limit headers of a response
+
+    Args:
+        status_code: Status code of the response
+        headers: Response headers, case-insensitive
+    Returns:
+        Tuple of RateLimit-Remaining, RateLimit-Reset and, for 429 responses, the seconds from
+        Retry-After. Each is None if the header is missing or invalid
+    """
+
+    try:
+        remaining = int(headers.get('RateLimit-Remaining'))
+        reset = float(headers.get('RateLimit-Reset'))
+    except (TypeError, ValueError):
+        remaining, reset = None, None
+    retry_after = parse_retry_after(headers.get('Retry-After')) if status_code == 429 else None
+    return remaining, reset, retry_after
+
+
+class RateLimiter:
+    """ Token bucket that paces requests to stay just under the GitLab API rate limit.
+
+    Before each request, call reserve() and sleep for the returned number of seconds. After each
+    response, pass its RateLimit-Remaining, RateLimit-Reset and Retry-After headers to update().
+    The rate is set to spend the remaining requests evenly over the time left until the limit
+    resets, and a 429 response pauses every request until its Retry-After has passed. Until
+    GitLab returns rate limit headers, requests are only limited by `max_rate`.
+
+    Waits are returned rather than slept, so one RateLimiter can be served by a SharedStateManager
+    to pace the requests of every worker process.
+
+    Attributes:
+        max_rate: Maximum requests per second, None for no limit other than GitLab's
+        rate: Current requests per second, None until a limit is known
+        delayed: Number of requests that had to wait
+        delay_seconds: Total time requests waited
+        throttled: Number of 429 responses received
+    """
+
+    def __init__(self, max_rate: float | None = None):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.delayed = 0
+        self.delay_seconds = 0.0
+        self.throttled = 0
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _capacity(self) -> float:
+        # Allow bursts of up to one second's worth of requests
+        return max(self.rate or 0, 1.0)
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self._capacity())
+        self._updated = now
+
+    def reserve(self) -> float:
+        """ Take a token for a request
+
+        Returns:
+            Seconds to wait before making the request
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, 0.0)
+            if self.rate is not None:
+                self._refill(now)
+                self._tokens -= 1
+                delay = max(delay, -self._tokens / self.rate)
+            if delay > 0:
+                self.delayed += 1
+                self.delay_seconds += delay
+            return delay
+
+    def update(self,
+               status_code: int,
+               remaining: int | None = None,
+               reset: float | None = None,
+               retry_after: float | None = None):
+        """ Update the rate from the rate limit headers of a response
+
+        Args:
+            status_code: Status code of the response
+            remaining: Value of the RateLimit-Remaining header
+            reset: Value of the RateLimit-Reset header, the Unix time the limit resets at
+            retry_after: Seconds from the Retry-After header of a 429 response
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if status_code == 429:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, now + (retry_after or 1.0))
+                self._tokens = min(self._tokens, 0.0)
+            if remaining is None or reset is None:
+                return
+            window = max(reset - time.time(), 1.0)
+            if remaining <= 0:
+                self._paused_until = max(self._paused_until, now + window)
+            self._refill(now)
+            rate = max(RATE_LIMIT_HEADROOM * remaining / window, MIN_RATE)
+            self.rate = min(rate, self.max_rate) if self.max_rate else rate
+            self._tokens = min(self._tokens, self._capacity())
+
+    def stats(self) -> Dict[str, float | int | None]:
+        """ Return the rate limiter counters
+
+        Returns:
+            Dict with the current rate, the number of delayed requests, the total time they
+            waited and the number of 429 responses
+        """
+
+        with self._lock:
+            return {
+                'rate': round(self.rate, 2) if self.rate is not None else None,
+                'delayed': self.delayed,
+                'delay_seconds': round(self.delay_seconds, 1),
+                'throttled': self.throttled
+            }
@@ -0,0 +1,238 @@
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Tuple
+
+import requests
+
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter, ENDPOINT_CLASSES, endpoint_class
+from gitlab_watchman.clients.rate_limiter import RateLimiter, rate_limit_headers
+
+# Seconds to wait for a concurrency slot in each call to the limiter
+ACQUIRE_TIMEOUT = 0.05
+
+# Connect and read timeouts in seconds for each endpoint class. Searches are slow on large instances
+DEFAULT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    'search': (10, 120),
+    'projects': (10, 30),
+    'files': (10, 60),
+    'commits': (10, 30),
+    'members': (10, 60),
+    'other': (10, 30),
+}
+
+# Requests are hedged once they take longer than this percentile of recent latencies
+HEDGE_PERCENTILE = 95
+# Number of recent latencies kept for each endpoint class, and the number needed before hedging
+LATENCY_WINDOW_SIZE = 200
+MIN_LATENCY_SAMPLES = 20
+HEDGED_METHODS = ['GET', 'HEAD']
+
+
+def parse_timeout(value: str) -> Tuple[str, Tuple[float, float]]:
+    """ Parse a --timeout option in the form CLASS=CONNECT:READ, e.g. search=10:300
+
+    Args:
+        value: Value of the option
+    Returns:
+        Tuple of the endpoint class and its connect and read timeouts
+    Raises:
+        argparse.ArgumentTypeError: If the value is not valid
+    """
+
+    try:
+        name, timeouts = value.split('=')
+        connect_timeout, read_timeout = (float(timeout) for timeout in timeouts.split(':'))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'Timeout must be in the form CLASS=CONNECT:READ, got: {value}') from e
+    if name not in ENDPOINT_CLASSES:
+        raise argparse.ArgumentTypeError(f'Unknown endpoint class {name}, must be one of: '
+                                         f'{", ".join(ENDPOINT_CLASSES)}')
+    return name, (connect_timeout, read_timeout)
+
+
+def _close_response(future: Future):
+    """ Close the response of a hedged request that lost the race, so its connection goes back to
+    the pool straight away rather than when the response is garbage collected
+
+    Args:
+        future: Future of the request, finished
+    """
+
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class LatencyWindow:
+    """ Recent latencies of successful requests to each endpoint class, used to decide when to hedge """
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self._latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def add(self, name: str, elapsed: float):
+        """ Add the latency of a request
+
+        Args:
+            name: Endpoint class
+            elapsed: Seconds the request took
+        """
+        with self._lock:
+            self._latencies[name].append(elapsed)
+
+    def percentile(self, name: str, percentile: float) -> float | None:
+        """ Return a percentile of the recent latencies for an endpoint class
+
+        Args:
+            name: Endpoint class
+            percentile: Percentile to return, between 0 and 100
+        Returns:
+            The latency in seconds, or None if there aren't enough samples yet
+        """
+        with self._lock:
+            latencies = sorted(self._latencies[name])
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+
+class GitLabSession(requests.Session):
+    """ Session used by GitLabAPIClient, which paces every request it sends with a RateLimiter,
+    and limits the requests in flight to each endpoint class with a ConcurrencyLimiter.
+    Both are updated from every response, including responses python-gitlab goes on to retry.
+
+    Requests without a timeout get the connect and read timeouts for their endpoint class. With
+    `hedge` set, a GET or HEAD request that takes longer than the recent p95 latency of its endpoint
+    class is sent a second time, and whichever response arrives first is used. Hedges are only sent
+    when the endpoint class has a free concurrency slot, so they back off when the instance is busy.
+
+    Attributes:
+        rate_limiter: RateLimiter pacing the requests, can be a proxy to one shared between processes
+        concurrency_limiter: ConcurrencyLimiter for the requests, can be a proxy to one shared
+            between processes
+        timeouts: Connect and read timeouts for each endpoint class
+        hedge: Whether to hedge slow GET and HEAD requests
+    """
+
+    def __init__(self,
+                 rate_limiter: RateLimiter | None = None,
+                 concurrency_limiter: ConcurrencyLimiter | None = None,
+                 timeouts: Dict[str, Tuple[float, float]] | None = None,
+                 hedge: bool = False):
+        super().__init__()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.concurrency_limiter = concurrency_limiter if concurrency_limiter is not None else ConcurrencyLimiter()
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.hedge = hedge
+        self._latencies = LatencyWindow()
+        self._hedge_executor = None
+        self._local = threading.local()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """ Send a request, with the timeouts of its endpoint class if it doesn't set any, once the
+        rate limiter and concurrency limiter allow it. Slow GET and HEAD requests are hedged if enabled
+
+        Args:
+            request: Request to send
+        Returns:
+            The response
+        """
+
+        # Redirects are sent from inside send, while the original request still holds its slot
+        if getattr(self._local, 'in_flight', False):
+            return super().send(request, **kwargs)
+
+        name = endpoint_class(request.url)
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeouts.get(name)
+        hedge_after = None
+        if self.hedge and request.method in HEDGED_METHODS and not kwargs.get('stream'):
+            hedge_after = self._latencies.percentile(name, HEDGE_PERCENTILE)
+        if hedge_after is None:
+            return self._send_limited(name, request, **kwargs)
+        return self._send_hedged(name, request, hedge_after, **kwargs)
+
+    def _send_limited(self,
+                      name: str,
+                      request: requests.PreparedRequest,
+                      slot_taken: bool = False,
+                      **kwargs) -> requests.Response:
+        """ Send a request once it has a concurrency slot and rate limit token
+
+        Args:
+            name: Endpoint class of the request
+            request: Request to send
+            slot_taken: Whether a concurrency slot has already been taken for the request
+        Returns:
+            The response
+        """
+
+        while not slot_taken:
+            slot_taken = self.concurrency_limiter.acquire(name, ACQUIRE_TIMEOUT, os.getpid())
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+        self._local.in_flight = True
+        start = time.monotonic()
+        response = None
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            self._local.in_flight = False
+            elapsed = time.monotonic() - start
+            self.concurrency_limiter.release(
+                name, response.status_code if response is not None else None, elapsed, os.getpid())
+
+        if response.status_code < 400:
+            self._latencies.add(name, elapsed)
+        remaining, reset, retry_after = rate_limit_headers(response.status_code, response.headers)
+        if remaining is not None or response.status_code == 429:
+            self.rate_limiter.update(response.status_code, remaining, reset, retry_after)
+        return response
+
+    def _send_hedged(self,
+                     name: str,
+                     request: requests.PreparedRequest,
+                     hedge_after: float,
+                     **kwargs) -> requests.Response:
+        """ Send a request, sending it again if it takes longer than `hedge_after`, and return
+        whichever response arrives first. The slower request is left to finish in the background,
+        and its response is closed once it arrives
+
+        Args:
+            name: Endpoint class of the request
+            request: Request to send
+            hedge_after: Seconds to wait before hedging
+        Returns:
+            The first response
+        """
+
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(thread_name_prefix='watchman-hedge')
+        primary = self._hedge_executor.submit(self._send_limited, name, request, **kwargs)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done or not self.concurrency_limiter.acquire(name, 0, os.getpid()):
+            return primary.result()
+
+        hedge = self._hedge_executor.submit(self._send_limited, name, request.copy(), slot_taken=True, **kwargs)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.concurrency_limiter.record_hedge(name, future is hedge)
+                    (hedge if future is primary else primary).add_done_callback(_close_response)
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    def close(self):
+        """ Stop the threads sending hedged requests, and close the session's adapters """
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
@@ -0,0 +1,34 @@
+from multiprocessing.managers import BaseManager
+
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.cassette import Cassette
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter
+from gitlab_watchman.clients.entity_cache import EntityCache
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.watchdog import WorkerMonitor
+
+
+class SharedStateManager(BaseManager):
+    """ Manager that serves state shared by all worker processes from a single server process.
+    Start the manager, then create each object with e.g. `manager.EntityCache(ttl, max_size)`
+    and pass the returned proxies to each worker's client, so every worker process reads and
+    updates the same object.
+
+    Every call through a proxy is handled by the manager's server process, so nothing it serves
+    blocks for long: calls that wait for other workers, such as EntityCache.claim() and
+    ConcurrencyLimiter.acquire(), take a short timeout and are called again until they succeed.
+    """
+
+
+SharedStateManager.register('EntityCache', EntityCache, exposed=['get', 'set', 'claim', 'release', 'stats'])
+SharedStateManager.register('ApiMetrics', ApiMetrics,
+                            exposed=['record', 'record_connection', 'record_cache_store', 'connections',
+                                     'response_cache', 'snapshot', 'merge', 'summary'])
+SharedStateManager.register('RateLimiter', RateLimiter, exposed=['reserve', 'update', 'stats'])
+SharedStateManager.register('ConcurrencyLimiter', ConcurrencyLimiter,
+                            exposed=['acquire', 'release', 'release_owner', 'record_hedge', 'stats'])
+SharedStateManager.register('Cassette', Cassette,
+                            exposed=['record', 'play', 'interactions', 'request_counts', 'stats', 'save'])
+SharedStateManager.register('WorkerMonitor', WorkerMonitor,
+                            exposed=['start', 'progress', 'finish', 'status', 'skip', 'record_recycle', 'skipped',
+                                     'stats'])
@@ -58,3 +58,22 @@ class MisconfiguredConfFileError(Exception):
     def __init__(self):
         self.message = f"The file watchman.conf doesn't contain config details for GitLab Watchman"
         super().__init__(self.message)
+
+
+class CassetteMissError(GitLabWatchmanError):
+    """ Exception raised when a request being replayed from a cassette wasn't recorded.
+    """
+
+    def __init__(self, method: str, url: str):
+        self.message = f'No recorded response in the cassette for: {method} {url}'
+        super().__init__(self.message)
+
+
+class ScanBudgetExceededError(GitLabWatchmanError):
+    """ Exception raised when matching a search result against the signatures takes longer
+    than the time allowed for a single item.
+    """
+
+    def __init__(self, budget: float):
+        self.message = f'Matching took longer than the budget of {budget}s'
+        super().__init__(self.message)
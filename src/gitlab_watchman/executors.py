@@ -0,0 +1,174 @@
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Iterable
+
+from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
+
+
+class AsyncResult:
+    """ Result of a task submitted to an AsyncioPool. Mirrors the parts of
+    multiprocessing.pool.AsyncResult used by the search processor """
+
+    def __init__(self, future: concurrent.futures.Future):
+        self._future = future
+
+    def get(self, timeout: float | None = None) -> Any:
+        """ Wait for the task to finish and return its result, raising any
+        exception the task raised
+
+        Args:
+            timeout: Seconds to wait before giving up
+        Returns:
+            Result of the task
+        """
+        return self._future.result(timeout)
+
+    def wait(self, timeout: float | None = None):
+        """ Wait for the task to finish
+
+        Args:
+            timeout: Seconds to wait before giving up
+        """
+        concurrent.futures.wait([self._future], timeout)
+
+    def ready(self) -> bool:
+        """ Whether the task has finished """
+        return self._future.done()
+
+    def cancel(self):
+        """ Cancel the task. A task that is running is cancelled the next time it awaits """
+        self._future.cancel()
+
+
+class AsyncioPool:
+    """ Worker pool running each task as a coroutine on an asyncio event loop in a background thread.
+
+    Up to `workers` tasks run at once, interleaved on the one event loop while they wait on the
+    GitLab API. Provides the same apply_async/close/terminate/join interface as
+    multiprocessing.pool.Pool, for coroutine functions.
+
+    Attributes:
+        workers: Number of tasks run at the same time
+        on_close: Coroutine function awaited on the event loop once the pool has been joined, to
+            close what the tasks shared, e.g. the aiohttp session of their GitLab API client
+    """
+
+    def __init__(self, workers: int, on_close: Callable[[], Awaitable[None]] | None = None):
+        self.workers = workers
+        self.on_close = on_close
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._closed = False
+        self._terminated = False
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name='watchman-event-loop', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _run_task(self, func: Callable[..., Awaitable[Any]], args: Iterable[Any], kwds: Dict[str, Any]) -> Any:
+        async with self._semaphore:
+            return await func(*args, **kwds)
+
+    async def _drain(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if self._terminated:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.on_close is not None:
+            await self.on_close()
+
+    def apply_async(self,
+                    func: Callable[..., Awaitable[Any]],
+                    args: Iterable[Any] = (),
+                    kwds: Dict[str, Any] | None = None) -> AsyncResult:
+        """ Schedule a coroutine function to run on the event loop
+
+        Args:
+            func: Coroutine function to run
+            args: Positional arguments to pass to the function
+            kwds: Keyword arguments to pass to the function
+        Returns:
+            AsyncResult for the task
+        Raises:
+            ValueError: If the pool has been closed
+        """
+        if self._closed:
+            raise ValueError('Pool not running')
+        return AsyncResult(asyncio.run_coroutine_threadsafe(self._run_task(func, args, kwds or {}), self._loop))
+
+    def close(self):
+        """ Stop accepting new tasks. Outstanding tasks are finished by join() """
+        self._closed = True
+
+    def terminate(self):
+        """ Stop accepting new tasks, and cancel outstanding tasks when join() is called rather than
+        waiting for them """
+        self._closed = True
+        self._terminated = True
+
+    def join(self, timeout: float | None = None):
+        """ Wait for outstanding tasks to finish, or cancel them if the pool was terminated, then stop
+        the event loop. A task stuck without awaiting, e.g. on a slow regex, holds up the event loop,
+        so it is left running in the background once `timeout` has passed
+
+        Args:
+            timeout: Seconds to wait for the tasks and the event loop to stop, None to wait indefinitely
+        Raises:
+            ValueError: If the pool is still running
+        """
+        if not self._closed:
+            raise ValueError('Pool is still running')
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result(timeout)
+        except concurrent.futures.TimeoutError:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class AwaitableClient:
+    """ Wraps a GitLabAPIClient so its methods are awaited the same way as those of
+    AsyncGitLabAPIClient, and the scope workers can be written once for every executor.
+    The coroutines return without ever suspending, so they don't need an event loop
+    """
+
+    def __init__(self, gitlab_client: GitLabAPIClient):
+        self.gitlab_client = gitlab_client
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        method = getattr(self.gitlab_client, name)
+
+        @functools.wraps(method)
+        async def _call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return _call
+
+
+def run_to_completion(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """ Run a scope worker coroutine that only awaits an AwaitableClient, without an event loop
+
+    Args:
+        coroutine: Coroutine to run
+    Returns:
+        Value returned by the coroutine
+    Raises:
+        RuntimeError: If the coroutine suspends, waiting on something that needs an event loop
+    """
+
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError('Scope worker suspended outside of an event loop')
@@ -22,7 +22,7 @@ class StdoutLogger:
         self.print_header()
         init()
 
-    # pylint: disable=too-many-branches
+    # pylint: disable=too-many-branches,too-many-statements
     def log(self,
             msg_level: str,
             message: Any,
@@ -77,6 +77,9 @@ class StdoutLogger:
                       f'    ACTIVE: {message.get("active")} \n'\
                       f'    EXPIRY: {message.get("expires_at", "Never")}'
             msg_level = 'WARNING'
+        if notify_type == "api_summary":
+            message = self.format_api_summary(message)
+            msg_level = 'SUMMARY'
         if notify_type == "result":
             if scope == 'blobs':
                 message = 'SCOPE: Blob' \
@@ -86,14 +89,14 @@ class StdoutLogger:
                           f'    FILENAME: {message.get("blob").get("basename")} \n' \
                           f'    URL: {message.get("project").get("web_url")}/-/blob/{message.get("blob").get("ref")}/' \
                           f'{message.get("blob").get("filename")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'merge_requests':
                 message = 'SCOPE: Merge Request' \
                           f'    AUTHOR: {message.get("merge_request").get("author").get("name")} ' \
                           f'    CREATED: {message.get("merge_request").get("created_at")} \n' \
                           f'    URL: {message.get("merge_request").get("web_url")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'commits':
                 message = 'SCOPE: Commit' \
@@ -101,14 +104,14 @@ class StdoutLogger:
                                 f'{message.get("commit").get("author_email")}' \
                           f'    CREATED: {message.get("commit").get("created_at")} \n' \
                           f'    URL: {message.get("commit").get("web_url")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'milestones':
                 message = 'SCOPE: Milestones' \
                           f'    TITLE: {message.get("milestone").get("title")} ' \
                           f'    CREATED: {message.get("milestone").get("created_at")} \n' \
                           f'    URL: {message.get("milestone").get("web_url")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'wiki_blobs':
                 if message.get('project_wiki'):
@@ -131,27 +134,27 @@ class StdoutLogger:
                           f'    FILENAME: {message.get("wiki_blob").get("filename")} \n' \
                           f'    WIKI_TYPE: {wiki_type} \n' \
                           f'    URL: {wiki_path} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'issues':
                 message = 'SCOPE: Issue' \
                           f'    AUTHOR: {message.get("issue").get("author").get("username")} '\
                           f'    CREATED: {message.get("issue").get("created_at")} \n' \
                           f'    URL: {message.get("issue").get("web_url")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'notes':
                 message = 'SCOPE: Note' \
                           f'    AUTHOR: {message.get("note").get("author").get("username")}'\
                           f'    CREATED: {message.get("note").get("created_at")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             elif scope == 'snippet_titles':
                 message = 'SCOPE: Snippet' \
                           f'    AUTHOR: {message.get("snippet").get("author").get("username")} '\
                           f'    CREATED: {message.get("snippet").get("created_at")} \n' \
                           f'    URL: {message.get("snippet").get("web_url")} \n' \
-                          f'    POTENTIAL_SECRET: {message.get("match_string")} \n' \
+                          f'    POTENTIAL_SECRET: {message.get("match_string")}{self._format_location(message)} \n' \
                           f'    -----'
             msg_level = 'RESULT'
         try:
@@ -223,6 +226,12 @@ class StdoutLogger:
                 high_color = Fore.RED
                 key_color = Fore.RED
                 style = Style.NORMAL
+            elif mes_type == "SUMMARY":
+                base_color = Fore.LIGHTBLUE_EX
+                high_color = Fore.LIGHTBLUE_EX
+                key_color = Fore.LIGHTBLUE_EX
+                style = Style.NORMAL
+                mes_type = '+'
             elif mes_type == "RESULT":
                 base_color = Fore.LIGHTGREEN_EX
                 high_color = Fore.LIGHTGREEN_EX
@@ -244,6 +253,72 @@ class StdoutLogger:
                 sys.exit(1)
             print('Formatting error')
 
+    @staticmethod
+    def _format_location(result: Dict[str, Any]) -> str:
+        location = result.get('location')
+        if not location:
+            return ''
+        return f' (line {location.get("line")}, column {location.get("column")})'
+
+    @staticmethod
+    def _format_table(rows: List[List[str]]) -> str:
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        return '\n    ' + '\n    '.join(lines)
+
+    def format_api_summary(self, summary: Dict[str, Any]) -> str:
+        """ Format the API summary as tables: one row per endpoint with the ApiMetrics
+        summary, one row per endpoint class with the state of the ConcurrencyLimiter, and
+        one row per skipped search result if there were any
+
+        Args:
+            summary: Dict with the ApiMetrics summary under api_calls, the ConcurrencyLimiter
+                stats under concurrency, and the skipped search results under skipped_items
+        Returns:
+            The tables as a string
+        """
+
+        rows = [['METHOD', 'ENDPOINT', 'SCOPE', 'CALLS', 'CACHED', 'RETRIES', 'ERRORS', 'KB',
+                 'P50_MS', 'P95_MS', 'P99_MS', 'TOTAL_S']]
+        for endpoint in summary.get('api_calls'):
+            latency = endpoint.get('latency_ms')
+            errors = ','.join(f'{code}x{count}' for code, count in sorted(endpoint.get('errors').items()))
+            rows.append([
+                endpoint.get('method'),
+                endpoint.get('endpoint'),
+                endpoint.get('scope') or '-',
+                str(endpoint.get('calls')),
+                str(endpoint.get('cached')),
+                str(endpoint.get('retries')),
+                errors or '-',
+                str(endpoint.get('bytes') // 1024),
+                str(latency.get('p50')),
+                str(latency.get('p95')),
+                str(latency.get('p99')),
+                f'{latency.get("total") / 1000:.1f}'
+            ])
+        concurrency_rows = [['ENDPOINT_CLASS', 'LIMIT', 'MAX_IN_FLIGHT', 'INCREASES', 'DECREASES', 'HEDGED',
+                             'HEDGE_WINS', 'BASELINE_MS']]
+        for name, state in summary.get('concurrency').items():
+            concurrency_rows.append([
+                name,
+                str(state.get('limit')),
+                str(state.get('max_in_flight')),
+                str(state.get('increases')),
+                str(state.get('decreases')),
+                str(state.get('hedged')),
+                str(state.get('hedge_wins')),
+                str(state.get('baseline_ms'))
+            ])
+        output = (f'API_CALLS: {self._format_table(rows)}\n'
+                  f'    CONCURRENCY: {self._format_table(concurrency_rows)}')
+        if summary.get('skipped_items'):
+            skipped_rows = [['SCOPE', 'ITEM', 'REASON']]
+            for skipped in summary.get('skipped_items'):
+                skipped_rows.append([skipped.get('scope'), skipped.get('item'), skipped.get('reason')])
+            output += f'\n    SKIPPED: {self._format_table(skipped_rows)}'
+        return output
+
     @staticmethod
     def print_header() -> None:
         """ Prints the header for the logger"""
@@ -292,6 +367,8 @@ class JSONLogger(Logger):
             '{"timestamp": "%(asctime)s", "level": "USER", "message": %(message)s}')
         self.token_format = logging.Formatter(
             '{"timestamp": "%(asctime)s", "level": "TOKEN", "message": %(message)s}')
+        self.summary_format = logging.Formatter(
+            '{"timestamp": "%(asctime)s", "level": "SUMMARY", "message": %(message)s}')
         self.logger = logging.getLogger(self.name)
         self.handler = logging.StreamHandler(sys.stdout)
         self.logger.addHandler(self.handler)
@@ -332,6 +409,9 @@ class JSONLogger(Logger):
         elif level.upper() == 'TOKEN':
             self.handler.setFormatter(self.token_format)
             self.logger.info(json.dumps(msg))
+        elif level.upper() == 'SUMMARY':
+            self.handler.setFormatter(self.summary_format)
+            self.logger.info(json.dumps(msg))
         else:
             self.handler.setFormatter(self.info_format)
             self.logger.critical(msg)
@@ -0,0 +1,429 @@
+import bisect
+import contextlib
+import functools
+import re
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+from gitlab_watchman.exceptions import ScanBudgetExceededError
+from gitlab_watchman.models import signature
+
+# The regex parser and its opcodes moved into the re package in Python 3.11
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants  # pylint: disable=deprecated-module
+    import sre_parse  # pylint: disable=deprecated-module
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Regex engines signature patterns can be compiled with, selected with --regex-engine
+REGEX_ENGINES: Dict[str, Callable[[str], Any]] = {'re': re.compile}
+if re2 is not None:
+    REGEX_ENGINES['re2'] = re2.compile
+DEFAULT_REGEX_ENGINE = 're'
+
+# Characters either side of a match kept as its context, from the line the match is on
+CONTEXT_CHARS = 40
+
+# Shortest literal worth using to skip a pattern. Shorter literals are in too much text to rule much out
+MIN_LITERAL_LENGTH = 3
+
+# Opcodes are generated when sre_constants is imported, so they're looked up by name. Those added
+# after Python 3.10 are None on older versions
+_LITERAL, _SUBPATTERN, _BRANCH, _MAX_REPEAT, _MIN_REPEAT, _POSSESSIVE_REPEAT, _ATOMIC_GROUP = (
+    getattr(sre_constants, name, None)
+    for name in ('LITERAL', 'SUBPATTERN', 'BRANCH', 'MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT', 'ATOMIC_GROUP'))
+_REPEATS = {_MAX_REPEAT, _MIN_REPEAT, _POSSESSIVE_REPEAT}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern: str, engine: str = DEFAULT_REGEX_ENGINE) -> Tuple[Any, str]:
+    """ Compile a pattern with a regex engine. Patterns the engine can't compile, such as those using
+    backreferences or lookarounds with RE2, are compiled with re instead. Compiled patterns are cached,
+    so each process only compiles a pattern once
+
+    Args:
+        pattern: Regex pattern
+        engine: Name of the engine to use, one of REGEX_ENGINES
+    Returns:
+        Tuple of the compiled pattern and the name of the engine that compiled it
+    Raises:
+        ValueError: If the engine isn't one of REGEX_ENGINES
+    """
+
+    if engine not in REGEX_ENGINES:
+        raise ValueError(f'Unknown regex engine {engine}, expected one of {", ".join(REGEX_ENGINES)}')
+    if engine != 're':
+        try:
+            return REGEX_ENGINES[engine](pattern), engine
+        except Exception:
+            pass
+    return re.compile(pattern), 're'
+
+
+def engine_report(signatures: List[signature.Signature], engine: str = DEFAULT_REGEX_ENGINE) -> Dict[str, List[str]]:
+    """ Work out which regex engine each signature's patterns run on. Signatures with any pattern
+    the engine can't compile are listed under re
+
+    Args:
+        signatures: Signatures to check
+        engine: Name of the engine patterns are compiled with
+    Returns:
+        Dict of engine name to the IDs of the signatures running on it
+    """
+
+    report = {}
+    for sig in signatures:
+        engines = {compile_pattern(pattern, engine)[1] for pattern in sig.patterns or []}
+        report.setdefault('re' if 're' in engines else engine, []).append(sig.id)
+    return report
+
+
+@functools.lru_cache(maxsize=None)
+def required_literals(pattern: str) -> Tuple[Tuple[str, bool], ...] | None:
+    """ Find literal strings that text must contain at least one of for the pattern to match it,
+    e.g. AKIA for AKIA[0-9A-Z]{16}. Used to skip running the pattern over text that can't match.
+    Case-insensitive literals are returned in lowercase, and only ASCII characters are used for them
+
+    Args:
+        pattern: Regex pattern
+    Returns:
+        Tuple of literal and whether it is case-insensitive, for each alternative literal, or None
+        if the pattern has no required literal of at least MIN_LITERAL_LENGTH characters
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    return _sequence_literals(parsed, bool(parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE))
+
+
+def _sequence_literals(items: sre_parse.SubPattern, ignore_case: bool) -> Tuple[Tuple[str, bool], ...] | None:
+    """ Find the best set of required literals in a sequence of parsed regex items. Runs of literal
+    characters are required as they are, as are the literals of groups and of items repeated at least
+    once. Alternations need a literal from every branch
+
+    Args:
+        items: Parsed regex items
+        ignore_case: Whether the items are matched case-insensitively
+    Returns:
+        Tuple of alternative literals with the longest shortest literal, or None if there are none
+    """
+
+    candidates = []
+    run = []
+
+    def _end_run():
+        if len(run) >= MIN_LITERAL_LENGTH:
+            candidates.append(((''.join(run), ignore_case),))
+        run.clear()
+
+    for op, av in items:
+        if op is _LITERAL and (not ignore_case or av < 128):
+            run.append(chr(av).lower() if ignore_case else chr(av))
+            continue
+        _end_run()
+        if op is _SUBPATTERN:
+            _, add_flags, del_flags, sub_items = av
+            sub_ignore_case = (ignore_case or bool(add_flags & sre_constants.SRE_FLAG_IGNORECASE)) and \
+                not del_flags & sre_constants.SRE_FLAG_IGNORECASE
+            candidates.append(_sequence_literals(sub_items, sub_ignore_case))
+        elif op in _REPEATS and av[0] >= 1:
+            candidates.append(_sequence_literals(av[2], ignore_case))
+        elif op is _ATOMIC_GROUP:
+            candidates.append(_sequence_literals(av, ignore_case))
+        elif op is _BRANCH:
+            branches = [_sequence_literals(branch, ignore_case) for branch in av[1]]
+            if all(branches):
+                candidates.append(tuple(dict.fromkeys(literal for branch in branches for literal in branch)))
+    _end_run()
+
+    candidates = [candidate for candidate in candidates if candidate]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda candidate: (min(len(literal) for literal, _ in candidate), -len(candidate)))
+
+
+@dataclass(slots=True)
+class Match:
+    """ Class that holds a match of a signature pattern in the text of a search result """
+    signature_id: str
+    match_string: str
+    offset: int
+    line: int
+    column: int
+    context: str
+
+    def location(self) -> Dict[str, Any]:
+        """ Return where the match is in the text, for adding to the search result
+
+        Returns:
+            Dict with the byte offset of the match in the UTF-8 encoded text, the line and
+            column it starts on, both counting from 1, and the text around it on that line
+        """
+        return {'offset': self.offset, 'line': self.line, 'column': self.column, 'context': self.context}
+
+
+def first_matches(matches: List[Match]) -> List[Match]:
+    """ Keep the first match of each distinct string found for a signature in a search result.
+    Later matches of the same string would have the same watchman_id, so add nothing
+
+    Args:
+        matches: Matches found in the search result
+    Returns:
+        List of Match objects, one for each signature and match string
+    """
+
+    first = {}
+    for match in matches:
+        first.setdefault((match.signature_id, match.match_string), match)
+    return list(first.values())
+
+
+class LineIndex:
+    """ Positions of every newline in a text, built in one pass, so the line of each match can be
+    found with a binary search rather than by counting the newlines before it
+
+    Byte offsets are counted from the start of the match's line, or from the previous match when
+    it is further along the same line, so matches found in order only encode the text between them
+
+    Attributes:
+        text: Text being indexed
+        newlines: Positions of the newlines, in order
+        line_offsets: Byte offset in the UTF-8 encoded text of the start of each line, empty if the
+            text is ASCII and byte offsets are the same as positions
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.newlines: List[int] = []
+        position = text.find('\n')
+        while position != -1:
+            self.newlines.append(position)
+            position = text.find('\n', position + 1)
+        self.line_offsets: List[int] = []
+        if not text.isascii():
+            line_start = offset = 0
+            self.line_offsets.append(offset)
+            for newline in self.newlines:
+                offset += len(text[line_start:newline + 1].encode('utf-8', 'surrogatepass'))
+                self.line_offsets.append(offset)
+                line_start = newline + 1
+        self._last = (0, 0)
+
+    def locate(self, start: int, end: int) -> Tuple[int, int, int, str]:
+        """ Find where a span of the text is
+
+        Args:
+            start: Position of the first character of the span
+            end: Position after the last character of the span
+        Returns:
+            Tuple of the byte offset of the span in the UTF-8 encoded text, the line and column it
+            starts on, counting from 1, and up to CONTEXT_CHARS characters either side of it on its line
+        """
+
+        line_index = bisect.bisect_left(self.newlines, start)
+        line_start = self.newlines[line_index - 1] + 1 if line_index else 0
+        line_end = self.newlines[line_index] if line_index < len(self.newlines) else len(self.text)
+        if self.line_offsets:
+            position, offset = self._last
+            if not line_start <= position <= start:
+                position, offset = line_start, self.line_offsets[line_index]
+            offset += len(self.text[position:start].encode('utf-8', 'surrogatepass'))
+            self._last = (start, offset)
+        else:
+            offset = start
+        context = self.text[max(line_start, start - CONTEXT_CHARS):min(line_end, end + CONTEXT_CHARS)]
+        return offset, line_index + 1, start - line_start + 1, context.rstrip('\r')
+
+
+@contextlib.contextmanager
+def _time_limit(seconds: float | None) -> Iterator[None]:
+    """ Raise ScanBudgetExceededError if the block runs for longer than the given seconds, even part
+    way through a regex search. Uses a SIGALRM timer, so only applies in the main thread of a
+    process, which is where worker processes run their tasks
+
+    Args:
+        seconds: Seconds the block can run for, None for no limit
+    """
+
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise ScanBudgetExceededError(seconds)
+
+    previous = signal.signal(signal.SIGALRM, _handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class SignatureMatcher:
+    """ Matches text against the patterns of every signature that uses a search query at once,
+    so each search result is only visited one time however many signatures found it.
+
+    Patterns are compiled once when the matcher is created, with the chosen regex engine or with
+    re if the engine can't compile them. A pattern used by more than one signature is only searched
+    for once, and its match is reported for each of them.
+
+    Text is first checked for the required literals of every pattern, using an Aho-Corasick
+    automaton when pyahocorasick is installed or substring checks otherwise. Only the patterns
+    with a literal in the text, and those without any required literal, are run over it.
+
+    Matching an item can be given a time budget. In worker processes a search that runs over the
+    budget is interrupted, while in threads the budget is checked between patterns.
+
+    Attributes:
+        engine: Name of the regex engine patterns are compiled with
+        item_budget: Seconds matching a single item can take, None for no limit
+        patterns: Compiled patterns, keyed by the pattern string
+        engines: Name of the engine that compiled each pattern, keyed by the pattern string
+        signature_ids: IDs of the signatures using each pattern, keyed by the pattern string
+        unfiltered: Patterns with no required literal, which are run over all text
+        literals: Patterns requiring each case-sensitive literal, keyed by the literal
+        folded_literals: Patterns requiring each case-insensitive literal, keyed by the lowercase literal
+    """
+
+    def __init__(self,
+                 signatures: List[signature.Signature],
+                 engine: str = DEFAULT_REGEX_ENGINE,
+                 item_budget: float | None = None):
+        self.engine = engine
+        self.item_budget = item_budget
+        self.patterns: Dict[str, Any] = {}
+        self.engines: Dict[str, str] = {}
+        self.signature_ids: Dict[str, List[str]] = {}
+        for sig in signatures:
+            for pattern in sig.patterns or []:
+                if pattern not in self.patterns:
+                    self.patterns[pattern], self.engines[pattern] = compile_pattern(pattern, engine)
+                    self.signature_ids[pattern] = []
+                if sig.id not in self.signature_ids[pattern]:
+                    self.signature_ids[pattern].append(sig.id)
+
+        self.unfiltered: Set[str] = set()
+        self.literals: Dict[str, List[str]] = {}
+        self.folded_literals: Dict[str, List[str]] = {}
+        for pattern in self.patterns:
+            literals = required_literals(pattern)
+            if literals is None:
+                self.unfiltered.add(pattern)
+                continue
+            for literal, ignore_case in literals:
+                (self.folded_literals if ignore_case else self.literals).setdefault(literal, []).append(pattern)
+        self._automaton = self._build_automaton(self.literals)
+        self._folded_automaton = self._build_automaton(self.folded_literals)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Patterns compiled by other engines can't always be pickled, so they are compiled again
+        # from the cache of the process the matcher is sent to
+        state = self.__dict__.copy()
+        state['patterns'] = list(self.patterns)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.patterns = {pattern: compile_pattern(pattern, self.engine)[0] for pattern in state['patterns']}
+
+    @staticmethod
+    def _build_automaton(literals: Dict[str, List[str]]):
+        """ Build an Aho-Corasick automaton finding the literals, if pyahocorasick is installed """
+
+        if ahocorasick is None or not literals:
+            return None
+        automaton = ahocorasick.Automaton()
+        for literal in literals:
+            automaton.add_word(literal, literal)
+        automaton.make_automaton()
+        return automaton
+
+    @staticmethod
+    def _find_literals(text: str, literals: Dict[str, List[str]], automaton) -> Set[str]:
+        """ Return the literals that are in the text """
+
+        if automaton is not None:
+            return {literal for _, literal in automaton.iter(text)}
+        return {literal for literal in literals if literal in text}
+
+    def candidates(self, text: str) -> Set[str]:
+        """ Return the patterns that could match the text: those with one of their required
+        literals in the text, and those without any required literal
+
+        Args:
+            text: Text to check
+        Returns:
+            Set of pattern strings
+        """
+
+        found = set(self.unfiltered)
+        for literal in self._find_literals(text, self.literals, self._automaton):
+            found.update(self.literals[literal])
+        if self.folded_literals:
+            # Non-ASCII text can have characters that match an ASCII literal case-insensitively,
+            # but don't lowercase to it, so the case-insensitive literals are only checked in ASCII text
+            if text.isascii():
+                for literal in self._find_literals(text.lower(), self.folded_literals, self._folded_automaton):
+                    found.update(self.folded_literals[literal])
+            else:
+                for patterns in self.folded_literals.values():
+                    found.update(patterns)
+        return found
+
+    def matches(self, *texts: str) -> List[Match]:
+        """ Find every match of every pattern in the text of an item, in one pass over the text for
+        each pattern. When the item has more than one field to search, each pattern is matched
+        against the first field it is found in. Empty matches are ignored
+
+        Args:
+            texts: Fields of the item to search, in order of precedence
+        Returns:
+            List of Match objects, for each signature using a pattern that matched
+        Raises:
+            ScanBudgetExceededError: If matching takes longer than the item budget
+        """
+
+        candidates = [self.candidates(text) for text in texts]
+        if not any(candidates):
+            return []
+        found = []
+        line_indexes = {}
+        deadline = time.monotonic() + self.item_budget if self.item_budget else None
+        with _time_limit(self.item_budget):
+            for pattern, regex in self.patterns.items():
+                for field, (text, text_candidates) in enumerate(zip(texts, candidates)):
+                    if pattern not in text_candidates:
+                        continue
+                    locations = []
+                    for match in regex.finditer(text):
+                        if deadline and time.monotonic() > deadline:
+                            raise ScanBudgetExceededError(self.item_budget)
+                        if match.end() == match.start():
+                            continue
+                        if field not in line_indexes:
+                            line_indexes[field] = LineIndex(text)
+                        locations.append((match.group(0), *line_indexes[field].locate(match.start(), match.end())))
+                    if deadline and time.monotonic() > deadline:
+                        raise ScanBudgetExceededError(self.item_budget)
+                    if locations:
+                        found.extend(Match(sig_id, *location)
+                                     for sig_id in self.signature_ids[pattern] for location in locations)
+                        break
+        return found
@@ -0,0 +1,417 @@
+import argparse
+import bisect
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import random
+import string
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List
+
+from gitlab_watchman.testing.dataset import BASE_URL, SAMPLE_SECRETS, MockDataset, generate_dataset, make_file
+
+SCOPES = ['blobs', 'wiki_blobs', 'commits', 'issues', 'merge_requests', 'milestones', 'notes', 'snippet_titles']
+
+# Text is cut from one block of random words generated up front, which is far quicker than
+# generating words for every item when making millions of them
+TEXT_BLOCK_SIZE = 4 * 1024 * 1024
+VOCABULARY_SIZE = 5000
+# The random generator is reseeded every this many results, so any part of a corpus can be
+# generated on its own without generating everything before it
+SEED_INTERVAL = 1000
+
+
+@dataclass
+class CorpusConfig:  # pylint: disable=too-many-instance-attributes
+    """ Shape of a SyntheticCorpus
+
+    Attributes:
+        projects: Number of projects results are spread over
+        project_skew: Exponent of the Zipf distribution of results over projects. 0 spreads them
+            evenly, higher values concentrate them in fewer projects, like real instances
+        secret_density: Fraction of results that contain a secret
+        secrets: Templates of the secrets planted, each `{}` is filled with 16 random characters
+        blob_size: Median size in bytes of blob and wiki blob text. Sizes are log-normally distributed
+        blob_size_sigma: Standard deviation of the logarithm of blob sizes, 0 for every blob to be `blob_size`
+        max_blob_size: Largest size in bytes of blob and wiki blob text
+        text_size: Median size in bytes of the text of commits, issues, merge requests, milestones,
+            notes and snippets
+        mean_age_days: Mean age of results. Ages are exponentially distributed, so most results are recent
+        max_age_days: Oldest a result can be
+        seed: Seed for the random generator, the same seed always generates the same corpus
+    """
+    projects: int = 100
+    project_skew: float = 1.0
+    secret_density: float = 0.01
+    secrets: List[str] = field(default_factory=lambda: list(SAMPLE_SECRETS))
+    blob_size: int = 400
+    blob_size_sigma: float = 1.0
+    max_blob_size: int = 1024 * 1024
+    text_size: int = 200
+    mean_age_days: float = 30.0
+    max_age_days: float = 730.0
+    seed: int = 0
+
+
+class SyntheticCorpus:
+    """ Generator of realistic search results for every scope, at any scale, for load testing the
+    scope workers directly or serving through MockGitLabServer with build_dataset().
+
+    Results are generated lazily, so millions of them can be streamed without holding them in memory.
+    The same config, scope and position always generate the same result. Timestamps are relative to
+    when the corpus was created, so the --timeframe filter of the workers sees the configured ages.
+
+    Attributes:
+        config: Shape of the corpus
+    """
+
+    def __init__(self, config: CorpusConfig | None = None):
+        self.config = config if config is not None else CorpusConfig()
+        self.now = time.time()
+        rng = random.Random(self.config.seed)
+        self._words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+                       for _ in range(VOCABULARY_SIZE)]
+        lines, size = [], 0
+        while size < TEXT_BLOCK_SIZE:
+            line = ' '.join(rng.choices(self._words, k=rng.randint(2, 14)))
+            lines.append(line)
+            size += len(line) + 1
+        self._text = '\n'.join(lines)
+        self._project_weights = list(itertools.accumulate(
+            1 / rank ** self.config.project_skew for rank in range(1, max(self.config.projects, 1) + 1)))
+        self._builders: Dict[str, Callable[[random.Random, int], Dict[str, Any]]] = {
+            'blobs': self._blob,
+            'wiki_blobs': self._wiki_blob,
+            'commits': self._commit,
+            'issues': self._issue,
+            'merge_requests': self._merge_request,
+            'milestones': self._milestone,
+            'notes': self._note,
+            'snippet_titles': self._snippet,
+        }
+
+    def results(self, scope: str, count: int, start: int = 0) -> Iterator[Dict[str, Any]]:
+        """ Generate search results for a scope
+
+        Args:
+            scope: Scope of the results, one of SCOPES
+            count: Number of results
+            start: Position of the first result, to generate a corpus in several parts
+        Returns:
+            Iterator of search results, as returned by the GitLab search API
+        """
+
+        if scope not in self._builders:
+            raise ValueError(f'Unknown scope: {scope}')
+        build = self._builders.get(scope)
+        rng = random.Random()
+        for position in range(start - start % SEED_INTERVAL, start + count):
+            if position % SEED_INTERVAL == 0:
+                rng.seed(f'{self.config.seed}:{scope}:{position}')
+            result = build(rng, position + 1)
+            if position >= start:
+                yield result
+
+    def pages(self, scope: str, count: int, per_page: int = 100) -> Iterator[List[Dict[str, Any]]]:
+        """ Generate search results in pages, the way GitLabAPIClient.global_search_pages returns them
+
+        Args:
+            scope: Scope of the results, one of SCOPES
+            count: Number of results
+            per_page: Number of results in each page
+        Returns:
+            Iterator of pages of search results
+        """
+
+        results = self.results(scope, count)
+        while page := list(itertools.islice(results, per_page)):
+            yield page
+
+    def _project_id(self, rng: random.Random) -> int:
+        return bisect.bisect_left(self._project_weights, rng.random() * self._project_weights[-1]) + 1
+
+    def timestamp(self, rng: random.Random, after: float | None = None) -> str:
+        """ Generate a timestamp an exponentially distributed age ago, capped at `max_age_days`
+
+        Args:
+            rng: Random generator to use
+            after: Unix time the timestamp must come after, to generate one evenly between it and now instead
+        Returns:
+            ISO 8601 timestamp, as used by the GitLab API
+        """
+
+        if after is None:
+            age = min(rng.expovariate(1 / self.config.mean_age_days), self.config.max_age_days) * 86400
+            moment = self.now - age
+        else:
+            moment = rng.uniform(after, self.now)
+        return datetime.datetime.fromtimestamp(moment, datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+    @staticmethod
+    def _epoch(timestamp: str) -> float:
+        return datetime.datetime.fromisoformat(timestamp).timestamp()
+
+    def _content(self, rng: random.Random, median_size: int, sigma: float, max_size: int, plant: bool = True) -> str:
+        """ Cut text of a log-normally distributed size from the text block, planting a secret
+        on one of its lines for `secret_density` of the results, unless `plant` is False """
+
+        size = rng.lognormvariate(math.log(max(median_size, 1)), sigma)
+        size = int(min(max(size, 1), max_size, len(self._text)))
+        start = rng.randrange(len(self._text) - size + 1)
+        text = self._text[start:start + size]
+        if plant and rng.random() < self.config.secret_density and self.config.secrets:
+            secret = rng.choice(self.config.secrets).format(
+                ''.join(rng.choices(string.ascii_uppercase + string.digits, k=16)))
+            position = text.find('\n', rng.randrange(len(text)))
+            position = len(text) if position < 0 else position
+            text = f'{text[:position]} {secret}{text[position:]}'
+        return text
+
+    def _text_field(self, rng: random.Random) -> str:
+        return self._content(rng, self.config.text_size, 0.5, self.config.max_blob_size)
+
+    def _title(self, rng: random.Random) -> str:
+        return self._content(rng, self.config.text_size, 0.5, self.config.max_blob_size, False).split('\n', 1)[0]
+
+    def _blob_content(self, rng: random.Random) -> str:
+        return self._content(rng, self.config.blob_size, self.config.blob_size_sigma, self.config.max_blob_size)
+
+    def _author(self, rng: random.Random) -> Dict[str, Any]:
+        user_id = rng.randrange(100)
+        username = self._words[user_id]
+        return {'id': user_id + 1, 'name': username.title(), 'username': username,
+                'state': 'active', 'web_url': f'{BASE_URL}/{username}'}
+
+    def _path(self, rng: random.Random, position: int, extension: str) -> str:
+        return f'{rng.choice(self._words)}/{rng.choice(self._words)}_{position}.{extension}'
+
+    def _blob(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        path = self._path(rng, position, rng.choice(['py', 'rb', 'js', 'go', 'yml', 'json', 'env', 'md']))
+        return {
+            'basename': path.rsplit('.', 1)[0],
+            'data': self._blob_content(rng),
+            'path': path,
+            'filename': path,
+            'id': None,
+            'ref': 'main',
+            'startline': rng.randint(1, 500),
+            'project_id': self._project_id(rng),
+        }
+
+    def _wiki_blob(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        path = f'{rng.choice(self._words)}_{position}.md'
+        return {
+            'basename': path[:-3],
+            'data': self._blob_content(rng),
+            'path': path,
+            'filename': path,
+            'id': None,
+            'ref': 'main',
+            'startline': 1,
+            'project_id': self._project_id(rng),
+            'group_id': None,
+        }
+
+    def _commit(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        commit_id = hashlib.sha1(f'{self.config.seed}:commit:{position}'.encode()).hexdigest()
+        project_id = self._project_id(rng)
+        message = self._text_field(rng)
+        committed_date = self.timestamp(rng)
+        return {
+            'id': commit_id,
+            'short_id': commit_id[:8],
+            'title': message.split('\n', 1)[0],
+            'message': message,
+            'author_name': 'Watchman',
+            'author_email': 'watchman@example.com',
+            'authored_date': committed_date,
+            'committer_name': 'Watchman',
+            'committer_email': 'watchman@example.com',
+            'committed_date': committed_date,
+            'created_at': committed_date,
+            'web_url': f'{BASE_URL}/project{project_id}/-/commit/{commit_id}',
+            'status': None,
+            'project_id': project_id,
+        }
+
+    def _issuable(self, rng: random.Random, position: int, path: str) -> Dict[str, Any]:
+        """ Fields issues, merge requests and milestones have in common """
+
+        project_id = self._project_id(rng)
+        created_at = self.timestamp(rng)
+        return {
+            'id': position,
+            'iid': position,
+            'project_id': project_id,
+            'title': self._title(rng),
+            'description': self._text_field(rng),
+            'created_at': created_at,
+            'updated_at': self.timestamp(rng, self._epoch(created_at)),
+            'web_url': f'{BASE_URL}/project{project_id}/-/{path}/{position}',
+        }
+
+    def _issue(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        return {
+            **self._issuable(rng, position, 'issues'),
+            'state': 'opened',
+            'closed_by': None,
+            'closed_at': None,
+            'author': self._author(rng),
+            'type': 'ISSUE',
+            'confidential': False,
+        }
+
+    def _merge_request(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        merge_request = {
+            **self._issuable(rng, position, 'merge_requests'),
+            'state': 'opened',
+            'merged_by': None,
+            'merged_at': None,
+            'target_branch': 'main',
+            'source_branch': rng.choice(self._words),
+            'author': self._author(rng),
+            'merge_status': 'can_be_merged',
+        }
+        merge_request['source_project_id'] = merge_request['target_project_id'] = merge_request['project_id']
+        return merge_request
+
+    def _milestone(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        return {
+            **self._issuable(rng, position, 'milestones'),
+            'state': 'active',
+            'due_date': None,
+            'start_date': None,
+            'expired': False,
+        }
+
+    def _note(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        created_at = self.timestamp(rng)
+        noteable_iid = rng.randint(1, 1000)
+        return {
+            'id': position,
+            'type': None,
+            'body': self._text_field(rng),
+            'attachment': None,
+            'author': self._author(rng),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'system': False,
+            'noteable_id': noteable_iid,
+            'noteable_type': 'Issue',
+            'commit_id': None,
+            'resolvable': False,
+            'confidential': False,
+            'noteable_iid': noteable_iid,
+            'project_id': self._project_id(rng),
+        }
+
+    def _snippet(self, rng: random.Random, position: int) -> Dict[str, Any]:
+        created_at = self.timestamp(rng)
+        file_name = self._path(rng, position, 'py').rsplit('/', 1)[-1]
+        return {
+            'id': position,
+            'title': self._title(rng),
+            'description': self._text_field(rng),
+            'visibility': 'private',
+            'author': self._author(rng),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'web_url': f'{BASE_URL}/-/snippets/{position}',
+            'file_name': file_name,
+            'files': [{'path': file_name, 'raw_url': f'{BASE_URL}/-/snippets/{position}/raw/main/{file_name}'}],
+        }
+
+
+def build_dataset(corpus: SyntheticCorpus, counts: Dict[str, int]) -> MockDataset:
+    """ Build a MockDataset holding a corpus, for MockGitLabServer to serve. Blobs are stored as files,
+    each with a commit at the blob's timestamp, so the blob worker can look up their metadata
+
+    Args:
+        corpus: Corpus to generate results from
+        counts: Number of results to generate for each scope
+    Returns:
+        MockDataset with the users, groups and projects the results belong to, and the results
+    """
+
+    dataset = generate_dataset(projects=corpus.config.projects, files_per_project=0, lines_per_file=1,
+                               secret_rate=0, seed=corpus.config.seed)
+    dataset.wikis = {}
+    dataset.issues, dataset.merge_requests, dataset.milestones, dataset.notes, dataset.snippets = [], [], [], [], []
+    rng = random.Random(corpus.config.seed)
+    for scope, count in counts.items():
+        for result in corpus.results(scope, count):
+            project_id = result.get('project_id')
+            if scope == 'blobs':
+                commit_id = hashlib.sha1(f'{project_id}:{result.get("path")}'.encode()).hexdigest()
+                committed_date = corpus.timestamp(rng)
+                dataset.commits[project_id][commit_id] = {
+                    'id': commit_id, 'short_id': commit_id[:8], 'title': 'Add file', 'message': 'Add file',
+                    'committed_date': committed_date, 'created_at': committed_date, 'project_id': project_id}
+                dataset.files[project_id][result.get('path')] = make_file(
+                    project_id, result.get('path'), result.get('data'), commit_id)
+            elif scope == 'wiki_blobs':
+                slug = result.get('basename')
+                dataset.wikis.setdefault(project_id, {})[slug] = {
+                    'slug': slug, 'title': slug, 'format': 'markdown', 'content': result.get('data'),
+                    'project_id': project_id}
+            elif scope == 'commits':
+                dataset.commits[project_id][result.get('id')] = result
+            elif scope == 'snippet_titles':
+                dataset.snippets.append(result)
+            else:
+                getattr(dataset, scope).append(result)
+    return dataset
+
+
+def main():
+    """ Write a synthetic corpus of search results to a JSON Lines file """
+
+    parser = argparse.ArgumentParser(description='Generate synthetic GitLab search results for scale tests')
+    parser.add_argument('--scope', choices=SCOPES, default='blobs', help='Scope of the results. Default: blobs')
+    parser.add_argument('--count', type=int, default=10000, help='Number of results. Default: 10000')
+    parser.add_argument('--output', '-o', help='File to write to, gzipped if it ends with .gz. Default: stdout')
+    parser.add_argument('--projects', type=int, default=CorpusConfig.projects,
+                        help=f'Number of projects results are spread over. Default: {CorpusConfig.projects}')
+    parser.add_argument('--project-skew', type=float, default=CorpusConfig.project_skew,
+                        help='Zipf exponent of results over projects, 0 for an even spread. '
+                             f'Default: {CorpusConfig.project_skew}')
+    parser.add_argument('--secret-density', type=float, default=CorpusConfig.secret_density,
+                        help=f'Fraction of results containing a secret. Default: {CorpusConfig.secret_density}')
+    parser.add_argument('--blob-size', type=int, default=CorpusConfig.blob_size,
+                        help=f'Median size of blob text in bytes. Default: {CorpusConfig.blob_size}')
+    parser.add_argument('--max-blob-size', type=int, default=CorpusConfig.max_blob_size,
+                        help=f'Largest size of blob text in bytes. Default: {CorpusConfig.max_blob_size}')
+    parser.add_argument('--mean-age-days', type=float, default=CorpusConfig.mean_age_days,
+                        help=f'Mean age of results in days. Default: {CorpusConfig.mean_age_days}')
+    parser.add_argument('--seed', type=int, default=CorpusConfig.seed, help='Seed for the generator. Default: 0')
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(CorpusConfig(
+        projects=args.projects,
+        project_skew=args.project_skew,
+        secret_density=args.secret_density,
+        blob_size=args.blob_size,
+        max_blob_size=args.max_blob_size,
+        mean_age_days=args.mean_age_days,
+        seed=args.seed))
+    if args.output and args.output.endswith('.gz'):
+        output = gzip.open(args.output, 'wt', encoding='utf-8')
+    elif args.output:
+        output = open(args.output, 'w', encoding='utf-8')  # pylint: disable=consider-using-with
+    else:
+        output = sys.stdout
+    try:
+        for result in corpus.results(args.scope, args.count):
+            output.write(json.dumps(result) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+from gitlab_watchman.clients.api_metrics import endpoint_template
+from gitlab_watchman.clients.concurrency import endpoint_class
+from gitlab_watchman.testing.corpus import CorpusConfig, SCOPES, SyntheticCorpus, build_dataset
+from gitlab_watchman.testing.dataset import BASE_URL, MockDataset, file_response, generate_dataset
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+@dataclass
+class MockGitLabConfig:
+    """ Behaviour of a MockGitLabServer
+
+    Attributes:
+        token: Personal access token the server accepts, in a PRIVATE-TOKEN or Authorization: Bearer header,
+            None to accept requests without a token
+        latency: Seconds each request takes before it is answered
+        jitter: Up to this many seconds are added to the latency of each request, at random
+        endpoint_latency: Latency of each endpoint class, e.g. search, overriding `latency`
+        rate_limit: Number of requests allowed in each rate limit window, 0 for no limit
+        rate_limit_window: Length of the rate limit window in seconds
+        error_rate: Fraction of requests answered with one of `error_codes`, at random
+        error_codes: Status codes of injected errors
+        seed: Seed for the random latency jitter and error injection
+    """
+    token: str | None = 'glpat-watchman-mock'
+    latency: float = 0.0
+    jitter: float = 0.0
+    endpoint_latency: Dict[str, float] = field(default_factory=dict)
+    rate_limit: int = 0
+    rate_limit_window: float = 60.0
+    error_rate: float = 0.0
+    error_codes: List[int] = field(default_factory=lambda: [500, 502, 503])
+    seed: int | None = None
+
+
+@dataclass
+class MockRequest:
+    """ Request passed to the handler of a MockGitLabServer
+
+    Attributes:
+        method: HTTP method
+        path: URL path, without the query string
+        query: Query parameters, with the first value of each
+        headers: Request headers
+    """
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Message
+
+
+# Function answering every request to a MockGitLabServer in place of its dataset. Returns the
+# status code, the body, which is sent as JSON unless it is None, and any extra headers
+MockHandler = Callable[[MockRequest], Tuple[int, Any, Dict[str, Any]]]
+
+
+class _HTTPError(Exception):
+    """ Error response for the handler to send, with its status code and extra headers """
+
+    def __init__(self, status_code: int, message: str, headers: Dict[str, Any] | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.headers = headers or {}
+
+
+class _MockGitLabHandler(BaseHTTPRequestHandler):
+    """ Answers requests to a MockGitLabServer, which is available as `self.server.mock` """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockGitLab'
+    # Headers and body are written separately, which Nagle's algorithm would delay on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        """ Answer a GET request from the mock dataset """
+        self._handle()
+
+    # pylint: disable=invalid-name
+    def do_HEAD(self):
+        """ Answer a HEAD request with the status and headers, without a body """
+        self._handle()
+
+    def _handle(self):
+        mock: MockGitLabServer = self.server.mock
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        mock.record(self.command, self.path)
+        mock.wait(self.path)
+
+        status_code, headers, body = 200, {}, None
+        try:
+            headers.update(mock.check_rate_limit())
+            if mock.config.token is not None \
+                    and self.headers.get('PRIVATE-TOKEN') != mock.config.token \
+                    and self.headers.get('Authorization') != f'Bearer {mock.config.token}':
+                raise _HTTPError(401, '401 Unauthorized')
+            mock.inject_error()
+            if mock.handler is not None:
+                status_code, result, result_headers = mock.handler(
+                    MockRequest(self.command, parsed.path, query, self.headers))
+                headers.update(result_headers)
+            else:
+                result, result_headers = mock.route(self.command, parsed.path, query)
+                headers.update(result_headers)
+                if isinstance(result, list):
+                    result, page_headers = self._paginate(result, query)
+                    headers.update(page_headers)
+            if result is not None:
+                body = json.dumps(result).replace(BASE_URL, f'http://{self.headers.get("Host")}').encode()
+                headers['Content-Type'] = 'application/json'
+            if body is not None and status_code == 200:
+                headers['ETag'] = f'W/"{hashlib.md5(body).hexdigest()}"'
+                if self.headers.get('If-None-Match') == headers['ETag']:
+                    status_code, body = 304, None
+        except _HTTPError as e:
+            status_code, body = e.status_code, json.dumps({'message': e.message}).encode()
+            headers.update(e.headers)
+            headers['Content-Type'] = 'application/json'
+
+        try:
+            self.send_response(status_code)
+            for name, value in headers.items():
+                self.send_header(name, str(value))
+            self.send_header('Content-Length', str(len(body) if body and self.command != 'HEAD' else 0))
+            self.end_headers()
+            if body and self.command != 'HEAD':
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _paginate(self, results: List[Any], query: Dict[str, str]) -> Tuple[List[Any], Dict[str, Any]]:
+        """ Return one page of results, with the pagination headers GitLab sends """
+
+        try:
+            page = max(int(query.get('page', 1)), 1)
+            per_page = min(max(int(query.get('per_page', DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
+        except ValueError as e:
+            raise _HTTPError(400, '400 Bad request - page is invalid') from e
+        total_pages = max(math.ceil(len(results) / per_page), 1)
+        headers = {
+            'X-Page': page,
+            'X-Per-Page': per_page,
+            'X-Total': len(results),
+            'X-Total-Pages': total_pages,
+            'X-Next-Page': page + 1 if page < total_pages else '',
+            'X-Prev-Page': page - 1 if page > 1 else '',
+        }
+        base_url = f'http://{self.headers.get("Host")}{urlparse(self.path).path}'
+        links = {'first': 1, 'last': total_pages}
+        if page < total_pages:
+            links['next'] = page + 1
+        if page > 1:
+            links['prev'] = page - 1
+        headers['Link'] = ', '.join(
+            f'<{base_url}?{urlencode({**query, "page": number, "per_page": per_page})}>; rel="{rel}"'
+            for rel, number in links.items())
+        return results[(page - 1) * per_page:page * per_page], headers
+
+
+class MockGitLabServer:  # pylint: disable=too-many-instance-attributes
+    """ Local stand-in for a GitLab instance, serving the endpoints GitLabAPIClient uses from a
+    MockDataset, for end-to-end and load testing without a real instance. Latency, jitter, rate
+    limiting and error injection are set with a MockGitLabConfig.
+
+    Every request is recorded, and request_counts() gives the number made to each endpoint.
+
+    Tests of how a client deals with particular responses can pass a `handler` to answer every
+    request instead of the dataset. Latency, rate limiting, error injection, ETags and the token
+    check still apply to its responses.
+
+    Attributes:
+        dataset: Data the server serves
+        config: Latency, rate limit and error injection settings
+        handler: MockHandler answering every request in place of the dataset
+        requests: Method and path of every request received, in order
+    """
+
+    def __init__(self,
+                 dataset: MockDataset | None = None,
+                 config: MockGitLabConfig | None = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 *,
+                 handler: MockHandler | None = None):
+        self.dataset = dataset if dataset is not None else generate_dataset()
+        self.config = config if config is not None else MockGitLabConfig()
+        self.handler = handler
+        self.requests: List[Tuple[str, str]] = []
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_count = 0
+
+    @property
+    def url(self) -> str:
+        """ URL of the running server, to pass to GitLabAPIClient """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockGitLabServer':
+        """ Start serving requests in a background thread """
+
+        self._server = ThreadingHTTPServer(self._address, _MockGitLabHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        # Polled often, so stop() returns quickly and tests can start a server each
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                        name='mock-gitlab', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the server """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'MockGitLabServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def record(self, method: str, path: str):
+        """ Record a request """
+        with self._lock:
+            self.requests.append((method, path))
+
+    def request_counts(self) -> Dict[str, int]:
+        """ Return the number of requests made to each endpoint
+
+        Returns:
+            Dict of method and endpoint template, e.g. GET /projects/:id, to the number of requests
+        """
+
+        with self._lock:
+            return dict(Counter(f'{method} {endpoint_template(path)[0]}' for method, path in self.requests))
+
+    def reset(self):
+        """ Forget recorded requests, and start a new rate limit window """
+
+        with self._lock:
+            self.requests = []
+            self._window_start = time.time()
+            self._window_count = 0
+
+    def wait(self, path: str):
+        """ Sleep for the configured latency of a request """
+
+        latency = self.config.endpoint_latency.get(endpoint_class(path), self.config.latency)
+        if self.config.jitter:
+            with self._lock:
+                latency += self._random.uniform(0, self.config.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def check_rate_limit(self) -> Dict[str, Any]:
+        """ Count a request against the rate limit, which uses fixed windows like GitLab's
+
+        Returns:
+            The RateLimit-* headers to send
+        Raises:
+            _HTTPError: With status 429 if the rate limit has been used up
+        """
+
+        if not self.config.rate_limit:
+            return {}
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.config.rate_limit_window:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            reset = self._window_start + self.config.rate_limit_window
+            headers = {
+                'RateLimit-Limit': self.config.rate_limit,
+                'RateLimit-Remaining': max(self.config.rate_limit - self._window_count, 0),
+                'RateLimit-Reset': int(math.ceil(reset)),
+            }
+            if self._window_count > self.config.rate_limit:
+                raise _HTTPError(429, 'Retry later', {**headers, 'Retry-After': max(int(math.ceil(reset - now)), 1)})
+        return headers
+
+    def inject_error(self):
+        """ Fail a fraction of requests, as set by the error rate
+
+        Raises:
+            _HTTPError: With one of the configured error codes
+        """
+
+        if not self.config.error_rate:
+            return
+        with self._lock:
+            failed = self._random.random() < self.config.error_rate
+            status_code = self._random.choice(self.config.error_codes)
+        if failed:
+            raise _HTTPError(status_code, f'{status_code} Injected error')
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    def route(self, method: str, path: str, query: Dict[str, str]) -> Tuple[Any, Dict[str, Any]]:
+        """ Find the response for a request
+
+        Args:
+            method: HTTP method, GET or HEAD
+            path: URL path of the request
+            query: Query parameters
+        Returns:
+            Tuple of the response body, a list is paginated, and any extra headers
+        Raises:
+            _HTTPError: If the endpoint or entity doesn't exist
+        """
+
+        if not path.startswith('/api/v4/'):
+            raise _HTTPError(404, '404 Not Found')
+        segments = [unquote(segment) for segment in path[len('/api/v4/'):].strip('/').split('/')]
+        dataset = self.dataset
+        resource, args = segments[0], segments[1:]
+
+        if resource == 'user' and not args:
+            return dataset.users[0], {}
+        if resource == 'metadata' and not args:
+            return {'version': '17.0.0', 'revision': 'mock', 'kas': {'enabled': False}, 'enterprise': False}, {}
+        if resource == 'personal_access_tokens' and args == ['self']:
+            return {'id': 1, 'name': 'watchman', 'revoked': False, 'created_at': '2024-01-01T00:00:00.000Z',
+                    'scopes': ['api', 'read_api'], 'user_id': dataset.users[0]['id'], 'active': True,
+                    'expires_at': None}, {}
+        if resource == 'search' and not args:
+            if not query.get('search'):
+                raise _HTTPError(400, '400 Bad request - search is missing')
+            return dataset.search(query.get('scope', 'blobs'), query.get('search')), {}
+        if resource == 'users':
+            if not args:
+                username = query.get('username')
+                return [user for user in dataset.users if username in (None, user['username'])], {}
+            user = next((u for u in dataset.users if str(u['id']) == args[0]), None)
+            if user is None or len(args) > 1:
+                raise _HTTPError(404, '404 User Not Found')
+            return user, {}
+        if resource == 'groups':
+            if not args:
+                return dataset.groups, {}
+            group = dataset.group(args[0])
+            if group is None:
+                raise _HTTPError(404, '404 Group Not Found')
+            if len(args) == 1:
+                return group, {}
+            if args[1:] in (['members'], ['members', 'all']):
+                return dataset.members.get(f'groups/{group["id"]}', []), {}
+        if resource == 'projects':
+            if not args:
+                return dataset.projects, {}
+            project = dataset.project(args[0])
+            if project is None:
+                raise _HTTPError(404, '404 Project Not Found')
+            return self._route_project(method, project, args[1:], query)
+        raise _HTTPError(404, '404 Not Found')
+
+    def _route_project(self,
+                       method: str,
+                       project: Dict[str, Any],
+                       args: List[str],
+                       query: Dict[str, str]) -> Tuple[Any, Dict[str, Any]]:
+        project_id = project['id']
+        if not args:
+            return project, {}
+        if args in (['members'], ['members', 'all']):
+            return self.dataset.members.get(f'projects/{project_id}', []), {}
+        if args[:2] == ['repository', 'files'] and len(args) == 3:
+            file_dict = self.dataset.files.get(project_id, {}).get(args[2])
+            if file_dict is None or query.get('ref', file_dict['ref']) != file_dict['ref']:
+                raise _HTTPError(404, '404 File Not Found')
+            if method == 'HEAD':
+                return None, {f'X-Gitlab-{name.title().replace("_", "-")}': value
+                              for name, value in file_response(file_dict).items() if name != 'content'}
+            return file_response(file_dict), {}
+        if args[:2] == ['repository', 'commits'] and len(args) == 3:
+            commit = self.dataset.commits.get(project_id, {}).get(args[2])
+            if commit is None:
+                raise _HTTPError(404, '404 Commit Not Found')
+            return commit, {}
+        if args[0] == 'wikis' and len(args) == 2:
+            page = self.dataset.wikis.get(project_id, {}).get(args[1])
+            if page is None:
+                raise _HTTPError(404, '404 Wiki Page Not Found')
+            return {key: value for key, value in page.items() if key != 'project_id'}, {}
+        raise _HTTPError(404, '404 Not Found')
+
+
+def _parse_corpus_count(value: str) -> Tuple[str, int]:
+    try:
+        scope, count = value.split('=')
+        if scope in SCOPES:
+            return scope, int(count)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f'Corpus size must be SCOPE=COUNT with a scope from {", ".join(SCOPES)}, '
+                                     f'got: {value}')
+
+
+def main():
+    """ Run a mock GitLab server until interrupted """
+
+    parser = argparse.ArgumentParser(description='Mock GitLab server for testing GitLab Watchman')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on. Default: 8080')
+    parser.add_argument('--token', default=MockGitLabConfig.token, help='Personal access token to accept')
+    parser.add_argument('--projects', type=int, default=10, help='Number of projects to generate. Default: 10')
+    parser.add_argument('--files-per-project', type=int, default=10,
+                        help='Number of files in each project. Default: 10')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated data. Default: 0')
+    parser.add_argument('--corpus', dest='corpus', action='append', type=_parse_corpus_count, default=[],
+                        metavar='SCOPE=COUNT',
+                        help='Serve a synthetic corpus with this many results for a scope instead of the small '
+                             'default dataset. Can be given more than once, e.g. --corpus blobs=100000')
+    parser.add_argument('--secret-density', type=float, default=CorpusConfig.secret_density,
+                        help='Fraction of corpus results containing a secret. '
+                             f'Default: {CorpusConfig.secret_density}')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds each request takes. Default: 0')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many seconds are added to each request at random. Default: 0')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='Requests allowed in each rate limit window, 0 for no limit. Default: 0')
+    parser.add_argument('--rate-limit-window', type=float, default=60.0,
+                        help='Length of the rate limit window in seconds. Default: 60')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 5xx error. Default: 0')
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = SyntheticCorpus(CorpusConfig(projects=args.projects, secret_density=args.secret_density,
+                                              seed=args.seed))
+        dataset = build_dataset(corpus, dict(args.corpus))
+    else:
+        dataset = generate_dataset(projects=args.projects, files_per_project=args.files_per_project, seed=args.seed)
+    config = MockGitLabConfig(
+        token=args.token,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        rate_limit_window=args.rate_limit_window,
+        error_rate=args.error_rate,
+        seed=args.seed)
+    server = MockGitLabServer(dataset, config, args.host, args.port).start()
+    # The token is left out, so it doesn't end up in terminal scrollback or CI logs
+    print(f'Mock GitLab serving {len(dataset.projects)} projects at {server.url}, accepting the --token value')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
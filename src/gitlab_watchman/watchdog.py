@@ -0,0 +1,222 @@
+import multiprocessing.pool
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List
+
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter
+
+# Seconds matching a single search result against the signatures can take before it is skipped
+DEFAULT_ITEM_BUDGET = 10.0
+# Seconds a worker can go without starting a new search result before it is treated as stuck
+DEFAULT_STALL_TIMEOUT = 600.0
+# Seconds between checks on the progress of the task being waited for
+WATCHDOG_INTERVAL = 1.0
+
+
+def item_key(scope: str, item: Dict[str, Any]) -> str:
+    """ Identify a search result in the list of skipped items
+
+    Args:
+        scope: What sort of GitLab object the result is
+        item: Search result
+    Returns:
+        Project ID and path for blobs and wiki blobs, otherwise the ID of the object
+    """
+
+    if scope in ('blobs', 'wiki_blobs'):
+        return f'{item.get("project_id") or item.get("group_id")}:{item.get("path")}'
+    return str(item.get('id'))
+
+
+class WorkerMonitor:
+    """ Tracks the progress of each task running on the worker pool, so tasks whose worker has
+    stopped making progress can be found, and keeps the list of search results that were skipped
+    and why.
+
+    Workers report when they start a task and each time they move on to the next search result.
+    Served by a SharedStateManager, every timestamp is taken by the same process.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, Dict[str, Any]] = {}
+        self._skipped: List[Dict[str, str]] = []
+        self.recycled = 0
+        self._lock = threading.Lock()
+
+    def start(self, task_id: int, worker: int):
+        """ Record that a worker has started a task
+
+        Args:
+            task_id: ID of the task
+            worker: Process ID, or thread ID, of the worker running the task
+        """
+        with self._lock:
+            self._tasks[task_id] = {'worker': worker, 'index': 0, 'progress': time.monotonic()}
+
+    def progress(self, task_id: int, index: int):
+        """ Record that a task has moved on to the next search result
+
+        Args:
+            task_id: ID of the task
+            index: Position of the search result in the task's list
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task['index'] = index
+                task['progress'] = time.monotonic()
+
+    def finish(self, task_id: int):
+        """ Stop tracking a task that has finished, or has been given up on
+
+        Args:
+            task_id: ID of the task
+        """
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def status(self, task_id: int) -> Dict[str, Any] | None:
+        """ Return the progress of a task
+
+        Args:
+            task_id: ID of the task
+        Returns:
+            Dict with the worker running the task, the position of the search result it is on
+            and the seconds since it started it, or None if the task isn't running
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            return {'worker': task['worker'], 'index': task['index'], 'idle': time.monotonic() - task['progress']}
+
+    def skip(self, scope: str, item: str, reason: str):
+        """ Record a search result that was skipped
+
+        Args:
+            scope: What sort of GitLab object the result is
+            item: Key of the result, from item_key
+            reason: Why it was skipped
+        """
+        with self._lock:
+            self._skipped.append({'scope': scope, 'item': item, 'reason': reason})
+
+    def record_recycle(self):
+        """ Count a worker that was stopped for making no progress """
+        with self._lock:
+            self.recycled += 1
+
+    def skipped(self) -> List[Dict[str, str]]:
+        """ Return the search results that were skipped, with their scope and the reason """
+        with self._lock:
+            return list(self._skipped)
+
+    def stats(self) -> Dict[str, int]:
+        """ Return the number of running tasks, skipped search results and recycled workers """
+        with self._lock:
+            return {'running': len(self._tasks), 'skipped': len(self._skipped), 'recycled': self.recycled}
+
+
+def track_progress(items: List[Dict[str, Any]], monitor: WorkerMonitor | None, task_id: int | None) -> Iterator[Dict]:
+    """ Iterate through the search results of a task, reporting to the worker monitor as each
+    one is started
+
+    Args:
+        items: Search results the task is processing
+        monitor: WorkerMonitor, or a proxy to one, the task reports its progress to
+        task_id: ID of the task
+    Returns:
+        Iterator of search results
+    """
+
+    for index, item in enumerate(items):
+        if monitor is not None:
+            monitor.progress(task_id, index)
+        yield item
+
+
+def skip_items(monitor: WorkerMonitor | None, scope: str, items: List[Dict[str, Any]], reason: str):
+    """ Record search results as skipped with the worker monitor, if there is one
+
+    Args:
+        monitor: WorkerMonitor, or a proxy to one, to record the results with
+        scope: What sort of GitLab object the results are
+        items: Search results that were skipped
+        reason: Why they were skipped
+    """
+
+    if monitor is None:
+        return
+    for item in items:
+        monitor.skip(scope, item_key(scope, item), reason)
+
+
+@dataclass
+class PoolTask:
+    """ Dataclass for a chunk of search results handed to the worker pool """
+    task_id: int
+    scope: str
+    search_list: List[Dict[str, Any]]
+    async_result: multiprocessing.pool.AsyncResult
+
+
+def wait_for_task(task: PoolTask, monitor: WorkerMonitor, stall_timeout: float | None) -> Dict[str, Any] | None:
+    """ Wait for a pool task to finish. While waiting, the progress of the task is checked
+    every WATCHDOG_INTERVAL
+
+    Args:
+        task: Task to wait for
+        monitor: WorkerMonitor the task reports its progress to
+        stall_timeout: Seconds the task's worker can go without moving on to a new search result,
+            None to wait however long the task takes
+    Returns:
+        None once the task has finished, or the status of the task from the monitor if its worker
+        stopped making progress
+    """
+
+    while True:
+        task.async_result.wait(WATCHDOG_INTERVAL if stall_timeout else None)
+        if task.async_result.ready():
+            return None
+        status = monitor.status(task.task_id)
+        if status is not None and status.get('idle') >= stall_timeout:
+            return status
+
+
+def abandon_task(task: PoolTask,
+                 monitor: WorkerMonitor,
+                 status: Dict[str, Any],
+                 stall_timeout: float,
+                 stop_worker: bool,
+                 *,
+                 concurrency_limiter: ConcurrencyLimiter | None = None) -> str:
+    """ Give up on a task whose worker stopped making progress, recording the search results it
+    hadn't finished as skipped. A worker process is killed, and the pool starts a new one in its
+    place. Worker threads can't be stopped, so their tasks are only abandoned
+
+    Args:
+        task: Task to give up on
+        monitor: WorkerMonitor the task reports its progress to
+        status: Status of the task from the monitor
+        stall_timeout: Seconds the worker went without making progress
+        stop_worker: Whether to kill the worker process running the task
+        concurrency_limiter: ConcurrencyLimiter shared by the worker processes, to release the
+            slots of requests the killed worker had in flight
+    Returns:
+        Message describing what was given up on, to log as a warning
+    """
+
+    reason = f'Worker made no progress for {stall_timeout}s'
+    skipped = task.search_list[status.get('index'):]
+    skip_items(monitor, task.scope, skipped, reason)
+    monitor.finish(task.task_id)
+    monitor.record_recycle()
+    if stop_worker:
+        os.kill(status.get('worker'), getattr(signal, 'SIGKILL', signal.SIGTERM))
+        if concurrency_limiter is not None:
+            concurrency_limiter.release_owner(status.get('worker'))
+        return f'{reason}, worker process {status.get("worker")} stopped and {len(skipped)} {task.scope} skipped'
+    return f'{reason}, its task was abandoned and {len(skipped)} {task.scope} skipped'
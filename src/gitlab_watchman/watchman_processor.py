@@ -1,18 +1,32 @@
+# pylint: disable=too-many-lines
+import argparse
 import calendar
+import functools
 import multiprocessing
-import re
+import multiprocessing.pool
+import os
 import time
 import traceback
 import hashlib
+from collections import deque
 from multiprocessing import Queue
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Iterable, Optional, Tuple, Any
 
 from requests.exceptions import SSLError
 
-from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
-from gitlab_watchman.exceptions import GitLabWatchmanAuthenticationError
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.async_gitlab_client import AsyncGitLabAPIClient
+from gitlab_watchman.clients.cassette import Cassette
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter, DEFAULT_MAX_LIMIT
+from gitlab_watchman.clients.entity_cache import EntityCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
+from gitlab_watchman.clients.gitlab_client import ClientOptions, GitLabAPIClient
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.clients.shared_state import SharedStateManager
+from gitlab_watchman.exceptions import GitLabWatchmanAuthenticationError, ScanBudgetExceededError
+from gitlab_watchman.executors import AsyncioPool, AwaitableClient, run_to_completion
 from gitlab_watchman.loggers import JSONLogger, StdoutLogger, init_logger
+from gitlab_watchman.matcher import DEFAULT_REGEX_ENGINE, SignatureMatcher, first_matches
 from gitlab_watchman.models import (
     signature,
     note,
@@ -28,6 +42,18 @@ from gitlab_watchman.models import (
     project,
     group
 )
+from gitlab_watchman.watchdog import (
+    DEFAULT_ITEM_BUDGET,
+    DEFAULT_STALL_TIMEOUT,
+    WATCHDOG_INTERVAL,
+    PoolTask,
+    WorkerMonitor,
+    abandon_task,
+    item_key,
+    skip_items,
+    track_progress,
+    wait_for_task
+)
 from gitlab_watchman.utils import (
     convert_to_epoch,
     deduplicate_results,
@@ -35,25 +61,161 @@ from gitlab_watchman.utils import (
 )
 
 ALL_TIME = calendar.timegm(time.gmtime()) + 1576800000
+DEFAULT_IO_WORKERS = 32
+EXECUTOR_TYPES = ['process', 'thread', 'async']
+
+# Fields of each search result read by the scope workers and the models they create.
+# Everything else is dropped when the results are decoded, before they are sent to the workers
+SEARCH_FIELDS = {
+    'blobs': ['id', 'basename', 'data', 'path', 'filename', 'ref', 'project_id'],
+    'wiki_blobs': ['id', 'basename', 'data', 'path', 'filename', 'ref', 'project_id', 'group_id'],
+    'commits': ['id', 'title', 'message', 'author_name', 'author_email', 'authored_date', 'committer_name',
+                'committer_email', 'committed_date', 'created_at', 'web_url', 'status', 'project_id'],
+    'issues': ['id', 'iid', 'project_id', 'title', 'description', 'state', 'created_at', 'updated_at',
+               'closed_by', 'closed_at', 'author', 'type', 'confidential', 'web_url'],
+    'milestones': ['id', 'iid', 'project_id', 'title', 'description', 'state', 'created_at', 'updated_at',
+                   'due_date', 'start_date', 'expired', 'web_url'],
+    'merge_requests': ['id', 'iid', 'project_id', 'title', 'description', 'state', 'created_at', 'updated_at',
+                       'merged_by', 'merged_at', 'target_branch', 'source_branch', 'author', 'source_project_id',
+                       'target_project_id', 'merge_status', 'web_url'],
+    'notes': ['id', 'type', 'body', 'attachment', 'author', 'created_at', 'updated_at', 'system', 'noteable_id',
+              'noteable_type', 'commit_id', 'resolvable', 'resolved_by', 'resolved_at', 'confidential',
+              'noteable_iid', 'command_changes'],
+    'snippet_titles': ['id', 'title', 'description', 'visibility', 'author', 'created_at', 'updated_at',
+                       'web_url', 'file_name', 'files'],
+}
 
 
 @dataclass
-class WorkerArgs:
+class WorkerArgs:  # pylint: disable=too-many-instance-attributes
     """ Dataclass for multiprocessing arguments """
-    gitlab_client: GitLabAPIClient
+    gitlab_client: AwaitableClient | AsyncGitLabAPIClient
     search_result_list: List[Dict]
-    regex: re.Pattern[str]
+    matcher: SignatureMatcher
     timeframe: int
-    results_list: List[Dict]
+    results_list: List[Tuple[str, Dict]]
     verbose: bool
     log_queue: Optional[Queue] = None
     log_handler: Optional[JSONLogger | StdoutLogger] = None
+    scope: Optional[str] = None
+    task_id: Optional[int] = None
+    monitor: Optional[WorkerMonitor] = None
+
+
+@dataclass
+class PoolOptions:
+    """ Dataclass for the settings of the worker pool, and the GitLab API clients of its workers
+
+    Attributes:
+        executor: One of EXECUTOR_TYPES
+        workers: Number of workers, defaults to one less than the CPU count for
+            the process executor and DEFAULT_IO_WORKERS otherwise
+        max_tasks_per_child: Number of tasks a worker process completes before it is replaced,
+            None or 0 to keep workers for the whole run. Only used by the process executor
+        cache_ttl: Seconds entities stay in the workers' entity cache
+        cache_size: Maximum number of entities in the workers' entity cache
+        max_request_rate: Maximum requests per second for all workers together, None to only
+            pace requests by the rate limit GitLab reports
+        max_concurrency: Highest number of requests all workers together can have in flight
+            to each endpoint class
+        item_budget: Seconds matching a single search result can take before it is skipped,
+            None for no limit
+        stall_timeout: Seconds a worker can go without moving on to a new search result before
+            its task is given up on, None to wait for every task however long it takes
+        client: Settings for the workers' GitLab API clients. pool_maxsize defaults to
+            DEFAULT_POOL_MAXSIZE for worker processes, and the number of workers for the thread
+            and async executors, which share one client. Worker processes share a copy of the
+            cassette served by the SharedStateManager, which the parent's client is switched to.
+            The async executor's AsyncGitLabAPIClient doesn't support cassettes
+    """
+    executor: str = 'process'
+    workers: int | None = None
+    max_tasks_per_child: int | None = 100
+    cache_ttl: float | None = DEFAULT_TTL
+    cache_size: int | None = DEFAULT_MAX_SIZE
+    max_request_rate: float | None = None
+    max_concurrency: int = DEFAULT_MAX_LIMIT
+    item_budget: float | None = DEFAULT_ITEM_BUDGET
+    stall_timeout: float | None = DEFAULT_STALL_TIMEOUT
+    client: ClientOptions = field(default_factory=ClientOptions)
+
+
+@dataclass
+class WorkerPool:  # pylint: disable=too-many-instance-attributes
+    """ Dataclass holding the long-lived worker pool shared by every search """
+    pool: multiprocessing.pool.Pool | multiprocessing.pool.ThreadPool | AsyncioPool
+    executor: str
+    workers: int
+    log_queue: Optional[Queue] = None
+    log_process: Optional[multiprocessing.Process] = None
+    log_handler: Optional[JSONLogger | StdoutLogger] = None
+    entity_cache: Optional[EntityCache] = None
+    api_metrics: Optional[ApiMetrics] = None
+    rate_limiter: Optional[RateLimiter] = None
+    concurrency_limiter: Optional[ConcurrencyLimiter] = None
+    state_manager: Optional[SharedStateManager] = None
+    cassette: Optional[Cassette] = None
+    monitor: Optional[WorkerMonitor] = None
+    item_budget: Optional[float] = None
+    stall_timeout: Optional[float] = None
+    task_count: int = 0
+
+
+# State for pool workers. Populated by _init_worker in each worker process when using the process
+# executor, or once in the parent process when using the thread or async executors
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def parse_max_tasks_per_child(value: str) -> int:
+    """ Parse a --max-tasks-per-child option, which is 0 to never replace worker processes
+
+    Args:
+        value: Value of the option
+    Returns:
+        Number of tasks, 0 or more
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a whole number of 0 or more
+    """
+
+    try:
+        max_tasks_per_child = int(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'Max tasks per child must be a whole number, got: {value}') from e
+    if max_tasks_per_child < 0:
+        raise argparse.ArgumentTypeError(f'Max tasks per child must be 0 or more, got: {value}')
+    return max_tasks_per_child
+
+
+def limits_warning(options: PoolOptions, regex_engines: Iterable[str]) -> str | None:
+    """ Warn when the item budget and stall timeout can't stop a slow regex search. Only worker
+    processes can interrupt a search with SIGALRM, and be killed once they stall. Threads and the
+    event loop can't be, and a backtracking re search holds the GIL until it finishes
+
+    Args:
+        options: Settings the worker pool was created with
+        regex_engines: Regex engines the signature patterns run on
+    Returns:
+        Warning to log, or None if the limits apply in full
+    """
+
+    if options.executor == 'process' or 're' not in regex_engines:
+        return None
+    if not options.item_budget and not options.stall_timeout:
+        return None
+    return (f'The {options.executor} executor can\'t interrupt a regex search: --item-budget is only checked '
+            'between patterns, and --stall-timeout can\'t skip a pattern that backtracks, which holds up every '
+            'worker until it finishes. Use --executor process, or --regex-engine re2 for the patterns it compiles')
 
 
 def initiate_gitlab_connection(token: str,
-                               url: str) -> GitLabAPIClient:
+                               url: str,
+                               options: ClientOptions | None = None) -> GitLabAPIClient:
     """ Create a GitLab API client object
 
+    Args:
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        options: Settings and shared state for the client, the defaults are used if not given
     Returns:
         GitLab API client object
     Raises:
@@ -61,13 +223,29 @@ def initiate_gitlab_connection(token: str,
     """
 
     try:
-        return GitLabAPIClient(token, url)
+        return GitLabAPIClient(token, url, options)
     except SSLError as e:
         raise GitLabWatchmanAuthenticationError('SSL Error: Please check your GitLab URL and try again') from e
     except Exception as e:
         raise e
 
 
+def initiate_async_gitlab_connection(token: str,
+                                     url: str,
+                                     options: ClientOptions | None = None) -> AsyncGitLabAPIClient:
+    """ Create an asyncio GitLab API client object, for the async executor
+
+    Args:
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        options: Settings and shared state for the client, the defaults are used if not given
+    Returns:
+        Asyncio GitLab API client object
+    """
+
+    return AsyncGitLabAPIClient(token, url, options)
+
+
 def find_group_owners(group_members: List[Dict]) -> List[Dict]:
     """ Return all users who are both active and group Owners
 
@@ -107,127 +285,521 @@ def log_listener(log_queue: Queue, logging_type: str, debug: bool):
         log_handler.log(level, message)
 
 
+def plan_searches(signatures: List[signature.Signature],
+                  scopes: List[str]) -> Dict[str, Dict[str, List[signature.Signature]]]:
+    """ Build a search plan so that each (search_string, scope) query is only sent to the
+    GitLab API once per run, no matter how many signatures or patterns use it
+
+    Args:
+        signatures: List of Signature objects to plan searches for
+        scopes: Scopes being searched in this run
+    Returns:
+        Dict keyed by scope, each containing a dict of unique search strings mapped to the
+        signatures that use them
+    """
+
+    plan = {}
+    for scope in scopes:
+        queries = {}
+        for sig in signatures:
+            if not sig.scope or scope not in sig.scope:
+                continue
+            for query in sig.search_strings or []:
+                query_signatures = queries.setdefault(query, [])
+                if sig not in query_signatures:
+                    query_signatures.append(sig)
+        if queries:
+            plan[scope] = queries
+    return plan
+
+
+def create_worker_pool(token: str,
+                       url: str,
+                       logging_type: str,
+                       log_handler: JSONLogger | StdoutLogger,
+                       debug: bool,
+                       *,
+                       options: PoolOptions | None = None,
+                       gitlab_client: GitLabAPIClient | None = None) -> WorkerPool:
+    """ Create the worker pool used for every search in this run.
+
+    With the process executor, each worker process builds its own GitLab API client once when
+    it starts, and is replaced after completing `max_tasks_per_child` tasks. The thread executor
+    runs the workers in this process, sharing `gitlab_client` along with its connection pool and
+    cache. The async executor runs the workers as coroutines on one event loop, sharing an
+    AsyncGitLabAPIClient with one connection pool, and the entity cache of `gitlab_client`.
+    Worker processes share one entity cache, ApiMetrics, RateLimiter and ConcurrencyLimiter,
+    served by a SharedStateManager. `gitlab_client` is switched to the same ApiMetrics,
+    RateLimiter and ConcurrencyLimiter. Workers report their progress to a WorkerMonitor, so
+    searches can give up on tasks that stall.
+
+    Args:
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        logging_type: Type of logging to use
+        log_handler: Logger object
+        debug: Whether to use debug level logging or not
+        options: Settings for the pool and the GitLab API clients of its workers, the defaults
+            are used if not given
+        gitlab_client: GitLab API client to share between workers when using the thread
+            executor, or to share its entity cache, ApiMetrics and RateLimiter with the
+            async executor's client
+    Returns:
+        WorkerPool object
+    Raises:
+        ValueError: If the executor type is unknown, or max_tasks_per_child is negative
+    """
+
+    options = options or PoolOptions()
+    if options.executor not in EXECUTOR_TYPES:
+        raise ValueError(f'Unknown executor type: {options.executor}')
+    if options.max_tasks_per_child is not None and options.max_tasks_per_child < 0:
+        raise ValueError(f'Max tasks per child must be 0 or more, got: {options.max_tasks_per_child}')
+    workers = options.workers
+    if not workers:
+        workers = max(multiprocessing.cpu_count() - 1, 1) if options.executor == 'process' else DEFAULT_IO_WORKERS
+    worker_pool = WorkerPool(pool=None, executor=options.executor, workers=max(workers, 1),
+                             item_budget=options.item_budget, stall_timeout=options.stall_timeout)
+
+    if options.executor == 'process':
+        if logging_type == 'json':
+            worker_pool.log_queue = Queue()
+            worker_pool.log_process = multiprocessing.Process(
+                target=log_listener, args=(worker_pool.log_queue, logging_type, debug), daemon=True)
+            worker_pool.log_process.start()
+        else:
+            worker_pool.log_handler = log_handler
+        _start_worker_processes(worker_pool, token, url, options, gitlab_client)
+    elif options.executor == 'thread':
+        worker_pool.log_handler = log_handler
+        _start_worker_threads(worker_pool, token, url, options, gitlab_client)
+    else:
+        worker_pool.log_handler = log_handler
+        _start_async_workers(worker_pool, token, url, options, gitlab_client)
+    return worker_pool
+
+
+def _start_worker_processes(worker_pool: WorkerPool,
+                            token: str,
+                            url: str,
+                            options: PoolOptions,
+                            gitlab_client: GitLabAPIClient | None):
+    """ Start the state manager serving the state shared by worker processes, then the pool of
+    worker processes
+
+    Args:
+        worker_pool: WorkerPool to start the processes for
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        options: Settings for the pool and the GitLab API clients of its workers
+        gitlab_client: GitLab API client to switch to the shared state
+    """
+
+    worker_pool.state_manager = SharedStateManager()
+    worker_pool.state_manager.start()
+    # pylint: disable=no-member
+    worker_pool.entity_cache = worker_pool.state_manager.EntityCache(options.cache_ttl, options.cache_size)
+    worker_pool.api_metrics = worker_pool.state_manager.ApiMetrics()
+    worker_pool.rate_limiter = worker_pool.state_manager.RateLimiter(options.max_request_rate)
+    worker_pool.concurrency_limiter = worker_pool.state_manager.ConcurrencyLimiter(
+        max_limit=options.max_concurrency)
+    worker_pool.monitor = worker_pool.state_manager.WorkerMonitor()
+    if gitlab_client:
+        worker_pool.api_metrics.merge(gitlab_client.api_metrics.snapshot())
+        gitlab_client.api_metrics = worker_pool.api_metrics
+        gitlab_client.rate_limiter = worker_pool.rate_limiter
+        gitlab_client.concurrency_limiter = worker_pool.concurrency_limiter
+    if options.client.cassette is not None:
+        worker_pool.cassette = worker_pool.state_manager.Cassette(options.client.cassette.interactions())
+        if gitlab_client:
+            gitlab_client.cassette = worker_pool.cassette
+    worker_options = replace(
+        options.client,
+        entity_cache=worker_pool.entity_cache,
+        api_metrics=worker_pool.api_metrics,
+        rate_limiter=worker_pool.rate_limiter,
+        concurrency_limiter=worker_pool.concurrency_limiter,
+        cassette=worker_pool.cassette)
+    # The pool outlives this function, and is shut down by close_worker_pool
+    worker_pool.pool = multiprocessing.Pool(  # pylint: disable=consider-using-with
+        processes=worker_pool.workers,
+        initializer=functools.partial(_init_worker, token, url, worker_options, log_queue=worker_pool.log_queue,
+                                      log_handler=worker_pool.log_handler, monitor=worker_pool.monitor),
+        maxtasksperchild=options.max_tasks_per_child or None)
+
+
+def _start_worker_threads(worker_pool: WorkerPool,
+                          token: str,
+                          url: str,
+                          options: PoolOptions,
+                          gitlab_client: GitLabAPIClient | None):
+    """ Start the pool of worker threads, sharing one GitLab API client
+
+    Args:
+        worker_pool: WorkerPool to start the threads for
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        options: Settings for the pool and the GitLab API client of its workers
+        gitlab_client: GitLab API client for the workers to share, one is created if not given
+    """
+
+    _WORKER_STATE['gitlab_client'] = gitlab_client or initiate_gitlab_connection(
+        token,
+        url,
+        replace(
+            options.client,
+            pool_maxsize=options.client.pool_maxsize or worker_pool.workers,
+            entity_cache=EntityCache(options.cache_ttl, options.cache_size),
+            rate_limiter=RateLimiter(options.max_request_rate),
+            concurrency_limiter=ConcurrencyLimiter(max_limit=options.max_concurrency)))
+    worker_pool.cassette = _WORKER_STATE['gitlab_client'].cassette
+    worker_pool.entity_cache = _WORKER_STATE['gitlab_client'].entity_cache
+    worker_pool.api_metrics = _WORKER_STATE['gitlab_client'].api_metrics
+    worker_pool.rate_limiter = _WORKER_STATE['gitlab_client'].rate_limiter
+    worker_pool.concurrency_limiter = _WORKER_STATE['gitlab_client'].concurrency_limiter
+    worker_pool.monitor = WorkerMonitor()
+    _WORKER_STATE['log_queue'] = None
+    _WORKER_STATE['log_handler'] = worker_pool.log_handler
+    _WORKER_STATE['monitor'] = worker_pool.monitor
+    worker_pool.pool = multiprocessing.pool.ThreadPool(processes=worker_pool.workers)
+
+
+def _start_async_workers(worker_pool: WorkerPool,
+                         token: str,
+                         url: str,
+                         options: PoolOptions,
+                         gitlab_client: GitLabAPIClient | None):
+    """ Start the event loop running the workers as coroutines, sharing one AsyncGitLabAPIClient
+
+    Args:
+        worker_pool: WorkerPool to start the event loop for
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        options: Settings for the pool and the GitLab API client of its workers
+        gitlab_client: GitLab API client whose entity cache, ApiMetrics, RateLimiter and
+            ConcurrencyLimiter are used, new ones are created if not given
+    """
+
+    async_client = initiate_async_gitlab_connection(
+        token,
+        url,
+        replace(
+            options.client,
+            pool_maxsize=options.client.pool_maxsize or worker_pool.workers,
+            entity_cache=gitlab_client.entity_cache if gitlab_client else EntityCache(
+                options.cache_ttl, options.cache_size),
+            api_metrics=gitlab_client.api_metrics if gitlab_client else None,
+            rate_limiter=gitlab_client.rate_limiter if gitlab_client else RateLimiter(options.max_request_rate)))
+    _WORKER_STATE['gitlab_client'] = async_client
+    worker_pool.entity_cache = async_client.entity_cache
+    worker_pool.api_metrics = async_client.api_metrics
+    worker_pool.rate_limiter = async_client.rate_limiter
+    worker_pool.concurrency_limiter = gitlab_client.concurrency_limiter if gitlab_client else ConcurrencyLimiter(
+        max_limit=options.max_concurrency)
+    worker_pool.monitor = WorkerMonitor()
+    _WORKER_STATE['log_queue'] = None
+    _WORKER_STATE['log_handler'] = worker_pool.log_handler
+    _WORKER_STATE['monitor'] = worker_pool.monitor
+    worker_pool.pool = AsyncioPool(worker_pool.workers, on_close=async_client.close)
+
+
+def close_worker_pool(worker_pool: WorkerPool):
+    """ Wait for the worker pool to finish any outstanding work, then shut it
+    and the log listener down. If any task was given up on, the pool is terminated instead
+
+    Args:
+        worker_pool: WorkerPool object
+    """
+
+    if worker_pool.monitor is not None and worker_pool.monitor.stats().get('recycled'):
+        worker_pool.pool.terminate()
+        # Worker threads running abandoned tasks can't be stopped, so they aren't waited for.
+        # Abandoned coroutines are cancelled, unless one is holding up the event loop
+        if worker_pool.executor == 'process':
+            worker_pool.pool.join()
+        elif worker_pool.executor == 'async':
+            worker_pool.pool.join(WATCHDOG_INTERVAL)
+    else:
+        worker_pool.pool.close()
+        worker_pool.pool.join()
+    if worker_pool.state_manager:
+        worker_pool.state_manager.shutdown()
+    if worker_pool.log_queue:
+        worker_pool.log_queue.put(None)
+        worker_pool.log_process.join()
+
+
+def _init_worker(token: str,
+                 url: str,
+                 client_options: ClientOptions,
+                 *,
+                 log_queue: Optional[Queue],
+                 log_handler: Optional[JSONLogger | StdoutLogger],
+                 monitor: Optional[WorkerMonitor]):
+    """ Initializer run once in each worker process when it starts
+
+    Args:
+        token: GitLab personal access token
+        url: URL of the GitLab instance
+        client_options: Settings for the GitLab API client, including the proxies
+            to the entity cache, ApiMetrics, RateLimiter and ConcurrencyLimiter shared by all
+            worker processes
+        log_queue: Queue to send log records to when using JSON logging
+        log_handler: Logger object to use when using stdout logging
+        monitor: Proxy to the WorkerMonitor shared by all worker processes
+    """
+
+    _WORKER_STATE['gitlab_client'] = initiate_gitlab_connection(token, url, client_options)
+    _WORKER_STATE['log_queue'] = log_queue
+    _WORKER_STATE['log_handler'] = log_handler
+    _WORKER_STATE['monitor'] = monitor
+
+
 def search(gitlab: GitLabAPIClient,
-           logging_type: str,
-           log_handler: JSONLogger | StdoutLogger,
-           debug: bool,
-           sig: signature.Signature,
+           worker_pool: WorkerPool,
+           queries: Dict[str, List[signature.Signature]],
            scope: str,
            verbose: bool,
-           timeframe: int = ALL_TIME) -> List[Dict] | None:
-    """ Use the appropriate search function to search GitLab based on the contents
-    of the signature file
+           *,
+           timeframe: int = ALL_TIME,
+           regex_engine: str = DEFAULT_REGEX_ENGINE) -> Dict[str, List[Dict]]:
+    """ Run each planned search query against the GitLab API once, and fan the results out
+    to every signature and pattern that uses the query
 
     Args:
         gitlab: GitLab API object
-        logging_type: Type of logging to use
-        log_handler: Logger object
-        debug: Whether to use debug level logging or not
-        sig: Signature object
+        worker_pool: WorkerPool to process the search results with
+        queries: Unique search strings mapped to the signatures that use them
         scope: What sort of GitLab objects to search
         verbose: Whether to use verbose logging
         timeframe: Timeframe in seconds
+        regex_engine: Name of the regex engine to compile signature patterns with
     Returns:
-        List of search results from GitLab API or None
-
+        Dict of deduplicated search results keyed by signature ID
     """
-    results = []
-
-    if logging_type == 'json':
-        log_queue = Queue()
-        log_process = multiprocessing.Process(target=log_listener, args=(log_queue, logging_type, debug))
-        log_process.start()
-
-    for query in sig.search_strings:
-        for pattern in sig.patterns:
-            regex = re.compile(pattern)
-            search_results = gitlab.global_search(query, search_scope=scope)
-            query_formatted = query.replace('"', '')
-            if search_results:
-                if logging_type == 'json':
-                    log_queue.put(('INFO', f'{len(search_results)} {scope} '
-                                           f'found matching search term: {query_formatted}'))
-                else:
-                    log_handler.log('INFO', f'{len(search_results)} {scope} '
-                                            f'found matching search term: {query_formatted}')
-
-                result = multiprocessing.Manager().list()
-
-                chunks = multiprocessing.cpu_count() - 1
-                list_of_chunks = split_to_chunks(search_results, chunks)
-
-                processes = []
-
-                target_func_dict = {
-                    'blobs': _blob_worker,
-                    'wiki_blobs': _wiki_blob_worker,
-                    'commits': _commit_worker,
-                    'snippet_titles': _snippet_worker,
-                    'issues': _issue_worker,
-                    'milestones': _milestone_worker,
-                    'merge_requests': _merge_request_worker,
-                    'notes': _note_worker,
-                }
-                target_func = target_func_dict.get(scope, _blob_worker)
-
-                for search_list in list_of_chunks:
-                    multipro_args = WorkerArgs(
-                        gitlab_client=gitlab,
-                        search_result_list=search_list,
-                        regex=regex,
-                        timeframe=timeframe,
-                        results_list=result,
-                        verbose=verbose
-                    )
-                    if logging_type == 'json':
-                        multipro_args.log_queue = log_queue
-                    else:
-                        multipro_args.log_handler = log_handler
-                    p = multiprocessing.Process(target=target_func, args=(multipro_args,))
-                    processes.append(p)
-                    p.start()
-
-                for process in processes:
-                    process.join()
-
-                results.append(list(result))
-            else:
-                if logging_type == 'json':
-                    log_queue.put(('INFO', f'No {scope} found matching search term: {query_formatted}'))
-                else:
-                    log_handler.log('INFO', f'No {scope} found matching search term: {query_formatted}')
-    if results:
-        results = deduplicate_results([item for sublist in results for item in sublist])
-        if logging_type == 'json':
-            log_queue.put(('INFO', f'{len(results)} total matches found after filtering'))
-            log_queue.put(None)
-            log_process.join()
+    results = {}
+
+    for query, query_signatures in queries.items():
+        query_formatted = query.replace('"', '')
+        result_count = _search_query(
+            gitlab, worker_pool, query, scope, results,
+            matcher=SignatureMatcher(query_signatures, regex_engine, worker_pool.item_budget),
+            timeframe=timeframe,
+            verbose=verbose)
+
+        if result_count:
+            _pool_log(worker_pool, 'INFO', f'{result_count} {scope} found matching search term: {query_formatted}')
         else:
-            log_handler.log('INFO', f'{len(results)} total matches found after filtering')
-        return results
+            _pool_log(worker_pool, 'INFO', f'No {scope} found matching search term: {query_formatted}')
+
+    results = {sig_id: deduplicate_results(sig_results) for sig_id, sig_results in results.items()}
+    total_matches = sum(len(sig_results) for sig_results in results.values())
+    if total_matches:
+        _pool_log(worker_pool, 'INFO', f'{total_matches} total matches found after filtering')
     else:
-        if logging_type == 'json':
-            log_queue.put(('INFO', 'No matches found after filtering'))
-            log_queue.put(None)
-            log_process.join()
-        else:
-            log_handler.log('INFO', 'No matches found after filtering')
+        _pool_log(worker_pool, 'INFO', 'No matches found after filtering')
+    return results
+
+
+def _search_query(gitlab: GitLabAPIClient,
+                  worker_pool: WorkerPool,
+                  query: str,
+                  scope: str,
+                  results: Dict[str, List[Dict]],
+                  *,
+                  matcher: SignatureMatcher,
+                  timeframe: int,
+                  verbose: bool) -> int:
+    """ Run one search query against the GitLab API, handing each page of search results to the
+    worker pool as it is downloaded, and add the matches found to the results
+
+    Args:
+        gitlab: GitLab API object
+        worker_pool: WorkerPool to process the search results with
+        query: Search string
+        scope: What sort of GitLab objects to search
+        results: Dict of results keyed by signature ID to add the matches to
+        matcher: SignatureMatcher for the signatures that use the search query
+        timeframe: Timeframe in seconds
+        verbose: Whether to use verbose logging
+    Returns:
+        Number of search results returned for the query
+    """
+
+    # Pages are handed to the pool as they are downloaded, so matching starts straight away.
+    # Only a few chunks are allowed to be in flight at once, so memory use stays bounded.
+    pending = deque()
+    result_count = 0
+    for page in gitlab.global_search_pages(query, search_scope=scope, fields=SEARCH_FIELDS.get(scope)):
+        result_count += len(page)
+        for search_list in split_to_chunks(page, worker_pool.workers):
+            if not search_list:
+                continue
+            if len(pending) >= worker_pool.workers * 2:
+                _collect_results(worker_pool, pending.popleft(), results)
+            worker_pool.task_count += 1
+            pending.append(PoolTask(worker_pool.task_count, scope, search_list, worker_pool.pool.apply_async(
+                _scope_worker if worker_pool.executor == 'async' else _run_scope_worker,
+                (scope, search_list, matcher),
+                {'timeframe': timeframe, 'verbose': verbose, 'task_id': worker_pool.task_count})))
+    while pending:
+        _collect_results(worker_pool, pending.popleft(), results)
+    return result_count
+
+
+def _pool_log(worker_pool: WorkerPool, level: str, message: str):
+    """ Log a message from the parent process, through the log listener if worker processes are
+    logging to one
+
+    Args:
+        worker_pool: WorkerPool object
+        level: Log level
+        message: Message to log
+    """
+
+    if worker_pool.log_queue:
+        worker_pool.log_queue.put((level, message))
+    else:
+        worker_pool.log_handler.log(level, message)
+
+
+def _collect_results(worker_pool: WorkerPool, task: PoolTask, results: Dict[str, List[Dict]]):
+    """ Wait for a pool task to finish and add its matches to the results. A task whose worker
+    stops making progress is given up on, and its unfinished search results are skipped
+
+    Args:
+        worker_pool: WorkerPool running the task
+        task: Task to wait for
+        results: Dict of results keyed by signature ID to add the matches to
+    """
+
+    status = wait_for_task(task, worker_pool.monitor, worker_pool.stall_timeout)
+    if status is not None:
+        _pool_log(worker_pool, 'WARNING', abandon_task(
+            task, worker_pool.monitor, status, worker_pool.stall_timeout, worker_pool.executor == 'process',
+            concurrency_limiter=worker_pool.concurrency_limiter))
+        if worker_pool.executor == 'async':
+            task.async_result.cancel()
+        return
+
+    for sig_id, match in task.async_result.get():
+        results.setdefault(sig_id, []).append(match)
+
+
+def _run_scope_worker(scope: str,
+                      search_list: List[Dict],
+                      matcher: SignatureMatcher,
+                      *,
+                      timeframe: int,
+                      verbose: bool,
+                      task_id: int | None = None) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Runs the worker for the scope over a chunk of search results with
+    the worker's GitLabAPIClient, for the process and thread executors
+
+    Args:
+        scope: What sort of GitLab objects are being searched
+        search_list: Chunk of search results to process
+        matcher: SignatureMatcher for the signatures that use the search query
+        timeframe: Timeframe in seconds
+        verbose: Whether to use verbose logging
+        task_id: ID the task's progress is reported to the worker monitor under
+    Returns:
+        List of tuples containing the signature ID and the match found for it
+    """
+
+    return run_to_completion(_scope_worker(
+        scope, search_list, matcher, timeframe=timeframe, verbose=verbose, task_id=task_id,
+        gitlab_client=AwaitableClient(_WORKER_STATE.get('gitlab_client'))))
+
 
+async def _scope_worker(scope: str,
+                        search_list: List[Dict],
+                        matcher: SignatureMatcher,
+                        *,
+                        timeframe: int,
+                        verbose: bool,
+                        task_id: int | None = None,
+                        gitlab_client: AwaitableClient | AsyncGitLabAPIClient | None = None) -> List[Tuple[str, Dict]]:
+    """ Runs the worker for the scope over a chunk of search results, matching each result against
+    every signature that uses the search query. Run as a task of the async executor directly
 
-def _populate_project_owners(gitlab: GitLabAPIClient,
-                             project_object: project.Project) -> project.Project:
+    Args:
+        scope: What sort of GitLab objects are being searched
+        search_list: Chunk of search results to process
+        matcher: SignatureMatcher for the signatures that use the search query
+        timeframe: Timeframe in seconds
+        verbose: Whether to use verbose logging
+        task_id: ID the task's progress is reported to the worker monitor under
+        gitlab_client: GitLab API client to look up entities with, the worker's AsyncGitLabAPIClient
+            if not given
+    Returns:
+        List of tuples containing the signature ID and the match found for it
+    """
+
+    target_func_dict = {
+        'blobs': _blob_worker,
+        'wiki_blobs': _wiki_blob_worker,
+        'commits': _commit_worker,
+        'snippet_titles': _snippet_worker,
+        'issues': _issue_worker,
+        'milestones': _milestone_worker,
+        'merge_requests': _merge_request_worker,
+        'notes': _note_worker,
+    }
+    target_func = target_func_dict.get(scope, _blob_worker)
+
+    monitor = _WORKER_STATE.get('monitor') if task_id is not None else None
+    if monitor is not None:
+        monitor.start(task_id, os.getpid())
+    try:
+        return await target_func(WorkerArgs(
+            gitlab_client=gitlab_client or _WORKER_STATE.get('gitlab_client'),
+            search_result_list=search_list,
+            matcher=matcher,
+            timeframe=timeframe,
+            results_list=[],
+            verbose=verbose,
+            log_queue=_WORKER_STATE.get('log_queue'),
+            log_handler=_WORKER_STATE.get('log_handler'),
+            scope=scope,
+            task_id=task_id,
+            monitor=monitor))
+    finally:
+        if monitor is not None:
+            monitor.finish(task_id)
+
+
+def _skip_item(args: WorkerArgs, item: Dict, error: ScanBudgetExceededError):
+    """ Record a search result that took too long to match, and log it
+
+    Args:
+        args: Multiprocessing arguments
+        item: Search result that was skipped
+        error: Exception raised when the budget ran out
+    """
+
+    skip_items(args.monitor, args.scope, [item], str(error))
+    message = f'Skipped {args.scope} {item_key(args.scope, item)}: {error}'
+    if args.log_handler:
+        args.log_handler.log('WARNING', message)
+    else:
+        args.log_queue.put(('WARNING', message))
+
+
+async def _populate_project_owners(gitlab: AwaitableClient | AsyncGitLabAPIClient,
+                                   project_object: project.Project) -> project.Project:
     """ Populates a given project with either the user who owns it if the namespace kind == user,
     or members of the group who are owners if the namespace kind == group
 
     Args:
-        gitlab: GitLab API object
+        gitlab: GitLab API client of the worker
         project_object: Project to populate the owners of
     Returns:
         Project object with owners populated
     """
 
     if project_object.namespace.kind == 'group':
-        group_members = gitlab.get_group_members(project_object.namespace.id)
+        group_members = await gitlab.get_group_members(project_object.namespace.id)
         owners = find_group_owners(group_members)
         if owners:
             owner_list = []
@@ -236,7 +808,7 @@ def _populate_project_owners(gitlab: GitLabAPIClient,
             project_object.namespace.members = owners
             project_object.namespace.owner = None
     elif project_object.namespace.kind == 'user':
-        namespace_user = gitlab.get_user_by_username(project_object.namespace.full_path)
+        namespace_user = await gitlab.get_user_by_username(project_object.namespace.full_path)
         if namespace_user:
             project_object.namespace.owner = user.create_from_dict(namespace_user)
             project_object.namespace.members = None
@@ -244,108 +816,120 @@ def _populate_project_owners(gitlab: GitLabAPIClient,
     return project_object
 
 
-def _blob_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of blobs to find matches against the regex
+async def _blob_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of blobs to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
-                                    GitLab client, search list, regex pattern,
+                                    GitLab client, search list, signature matcher,
                                     timeframe, results list, verbosity flag, and log handler.
     Returns:
         Multiprocessing list to be combined by the parent process
     """
 
     now = calendar.timegm(time.gmtime())
-    for blob_dict in args.search_result_list:
+    for blob_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             blob_object = blob.create_from_dict(blob_dict)
-            project_object = project.create_from_dict(args.gitlab_client.get_project(blob_object.project_id))
+            matches = args.matcher.matches(str(blob_object.data))
+            if not matches:
+                continue
+            project_object = project.create_from_dict(await args.gitlab_client.get_project(blob_object.project_id))
             file_object = file.create_from_dict(
-                args.gitlab_client.get_file(blob_object.project_id, blob_object.path, blob_object.ref))
+                await args.gitlab_client.get_file_metadata(blob_object.project_id, blob_object.path, blob_object.ref))
             if file_object:
                 commit_object = commit.create_from_dict(
-                    args.gitlab_client.get_commit(blob_object.project_id, file_object.commit_id))
-                if convert_to_epoch(commit_object.committed_date) > (now - args.timeframe) and args.regex.search(
-                        str(blob_object.data)):
-                    match_string = args.regex.search(str(blob_object.data)).group(0)
+                    await args.gitlab_client.get_commit(blob_object.project_id, file_object.commit_id))
+                if convert_to_epoch(commit_object.committed_date) > (now - args.timeframe):
                     if not args.verbose:
                         setattr(blob_object, 'data', None)
-                    watchman_id = hashlib.md5(f'{match_string}.{file_object.file_path}'.encode()).hexdigest()
-                    args.results_list.append({
-                        'match_string': match_string,
-                        'blob': blob_object,
-                        'commit': commit_object,
-                        'project': _populate_project_owners(args.gitlab_client, project_object),
-                        'file': file_object,
-                        'watchman_id': watchman_id
-                    })
+                    project_object = await _populate_project_owners(args.gitlab_client, project_object)
+                    for found in first_matches(matches):
+                        watchman_id = hashlib.md5(f'{found.match_string}.{file_object.file_path}'.encode()).hexdigest()
+                        args.results_list.append((found.signature_id, {
+                            'match_string': found.match_string,
+                            'location': found.location(),
+                            'blob': blob_object,
+                            'commit': commit_object,
+                            'project': project_object,
+                            'file': file_object,
+                            'watchman_id': watchman_id
+                        }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, blob_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _wiki_blob_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of wiki_blobs to find matches against the regex.
+async def _wiki_blob_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of wiki_blobs to find matches against the signatures.
 
     Args:
         args: Multiprocessing arguments containing the
-                                    GitLab client, search list, regex pattern,
+                                    GitLab client, search list, signature matcher,
                                     timeframe, results list, verbosity flag, and log handler.
     Returns:
-        List[Dict]: Multiprocessing list to be combined by the parent process.
+        List[Tuple[str, Dict]]: Multiprocessing list to be combined by the parent process.
     """
 
-    for wb_dict in args.search_result_list:
+    for wb_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             wikiblob_object = wiki_blob.create_from_dict(wb_dict)
+            matches = args.matcher.matches(str(wikiblob_object.data))
+            if not matches:
+                continue
             project_wiki = False
             group_wiki = False
             if wb_dict.get('project_id'):
-                project_object = project.create_from_dict(args.gitlab_client.get_project(wb_dict.get('project_id')))
+                project_object = await _populate_project_owners(
+                    args.gitlab_client,
+                    project.create_from_dict(await args.gitlab_client.get_project(wb_dict.get('project_id'))))
                 project_wiki = True
             if wb_dict.get('group_id'):
-                group_object = group.create_from_dict(args.gitlab_client.get_group(wb_dict.get('group_id')))
+                group_object = group.create_from_dict(await args.gitlab_client.get_group(wb_dict.get('group_id')))
                 group_wiki = True
 
-            if args.regex.search(
-                    str(wikiblob_object.data)):
-                match_string = args.regex.search(str(wikiblob_object.data)).group(0)
-                if not args.verbose:
-                    setattr(wikiblob_object, 'data', None)
-                watchman_id = hashlib.md5(f'{match_string}.{wikiblob_object.path}'.encode()).hexdigest()
+            if not args.verbose:
+                setattr(wikiblob_object, 'data', None)
+            for found in first_matches(matches):
+                watchman_id = hashlib.md5(f'{found.match_string}.{wikiblob_object.path}'.encode()).hexdigest()
                 results_dict = {
-                    'match_string': match_string,
+                    'match_string': found.match_string,
+                    'location': found.location(),
                     'wiki_blob': wikiblob_object,
                     'group_wiki': group_wiki,
                     'project_wiki': project_wiki,
                     'watchman_id': watchman_id
                 }
                 if project_wiki:
-                    results_dict['project'] = _populate_project_owners(args.gitlab_client, project_object)
+                    results_dict['project'] = project_object
                 if group_wiki:
                     results_dict['group'] = group_object
-                args.results_list.append(results_dict)
+                args.results_list.append((found.signature_id, results_dict))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, wb_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _commit_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of commits to find matches against the regex
+async def _commit_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of commits to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
-                                    GitLab client, search list, regex pattern,
+                                    GitLab client, search list, signature matcher,
                                     timeframe, results list, verbosity flag, and log handler.
     Returns:
         List of JSON formatted results if any are found
@@ -353,70 +937,84 @@ def _commit_worker(args: WorkerArgs) -> List[Dict]:
 
     now = calendar.timegm(time.gmtime())
 
-    for commit_dict in args.search_result_list:
+    for commit_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             commit_object = commit.create_from_dict(commit_dict)
-            if convert_to_epoch(commit_object.committed_date) > (now - args.timeframe) and \
-                    args.regex.search(str(commit_object.message)):
-                project_object = project.create_from_dict(args.gitlab_client.get_project(commit_object.project_id))
-                match_string = args.regex.search(str(commit_object.message)).group(0)
-                watchman_id = hashlib.md5(f'{match_string}.{commit_object.id}'.encode()).hexdigest()
-                args.results_list.append({
-                    'match_string': match_string,
-                    'commit': commit_object,
-                    'project': _populate_project_owners(args.gitlab_client, project_object),
-                    'watchman_id': watchman_id
-                })
+            if convert_to_epoch(commit_object.committed_date) <= (now - args.timeframe):
+                continue
+            matches = args.matcher.matches(str(commit_object.message))
+            if matches:
+                project_object = await _populate_project_owners(
+                    args.gitlab_client,
+                    project.create_from_dict(await args.gitlab_client.get_project(commit_object.project_id)))
+                for found in first_matches(matches):
+                    watchman_id = hashlib.md5(f'{found.match_string}.{commit_object.id}'.encode()).hexdigest()
+                    args.results_list.append((found.signature_id, {
+                        'match_string': found.match_string,
+                        'location': found.location(),
+                        'commit': commit_object,
+                        'project': project_object,
+                        'watchman_id': watchman_id
+                    }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, commit_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _issue_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of issues to find matches against the regex
+async def _issue_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of issues to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
-                                    GitLab client, search list, regex pattern,
+                                    GitLab client, search list, signature matcher,
                                     timeframe, results list, verbosity flag, and log handler.
     Returns:
         Multiprocessing list to be combined by the parent process
     """
 
     now = calendar.timegm(time.gmtime())
-    for issue_dict in args.search_result_list:
+    for issue_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             issue_object = issue.create_from_dict(issue_dict)
-            if convert_to_epoch(issue_object.updated_at) > (now - args.timeframe) and \
-                    args.regex.search(str(issue_object.description)):
-                match_string = args.regex.search(str(issue_object.description)).group(0)
+            if convert_to_epoch(issue_object.updated_at) <= (now - args.timeframe):
+                continue
+            matches = args.matcher.matches(str(issue_object.description))
+            if matches:
                 if not args.verbose:
                     setattr(issue_object, 'description', None)
-                project_object = project.create_from_dict(args.gitlab_client.get_project(issue_object.project_id))
-                watchman_id = hashlib.md5(f'{match_string}.{issue_object.id}'.encode()).hexdigest()
-                args.results_list.append({
-                    'match_string': match_string,
-                    'issue': issue_object,
-                    'project': _populate_project_owners(args.gitlab_client, project_object),
-                    'watchman_id': watchman_id
-                })
+                project_object = await _populate_project_owners(
+                    args.gitlab_client,
+                    project.create_from_dict(await args.gitlab_client.get_project(issue_object.project_id)))
+                for found in first_matches(matches):
+                    watchman_id = hashlib.md5(f'{found.match_string}.{issue_object.id}'.encode()).hexdigest()
+                    args.results_list.append((found.signature_id, {
+                        'match_string': found.match_string,
+                        'location': found.location(),
+                        'issue': issue_object,
+                        'project': project_object,
+                        'watchman_id': watchman_id
+                    }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, issue_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _milestone_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of milestones to find matches against the regex
+async def _milestone_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of milestones to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
@@ -425,139 +1023,158 @@ def _milestone_worker(args: WorkerArgs) -> List[Dict]:
     """
 
     now = calendar.timegm(time.gmtime())
-    for milestone_dict in args.search_result_list:
+    for milestone_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             milestone_object = milestone.create_from_dict(milestone_dict)
-            if convert_to_epoch(milestone_object.updated_at) > (now - args.timeframe) and \
-                    args.regex.search(str(milestone_object.description)):
-                project_object = project.create_from_dict(args.gitlab_client.get_project(milestone_object.project_id))
-                match_string = args.regex.search(str(milestone_object.description)).group(0)
+            if convert_to_epoch(milestone_object.updated_at) <= (now - args.timeframe):
+                continue
+            matches = args.matcher.matches(str(milestone_object.description))
+            if matches:
+                project_object = await _populate_project_owners(
+                    args.gitlab_client,
+                    project.create_from_dict(await args.gitlab_client.get_project(milestone_object.project_id)))
                 if not args.verbose:
                     setattr(milestone_object, 'description', None)
-                watchman_id = hashlib.md5(f'{match_string}.{milestone_object.id}'.encode()).hexdigest()
-                args.results_list.append({
-                    'match_string': match_string,
-                    'milestone': milestone_object,
-                    'project': _populate_project_owners(args.gitlab_client, project_object),
-                    'watchman_id': watchman_id
-                })
+                for found in first_matches(matches):
+                    watchman_id = hashlib.md5(f'{found.match_string}.{milestone_object.id}'.encode()).hexdigest()
+                    args.results_list.append((found.signature_id, {
+                        'match_string': found.match_string,
+                        'location': found.location(),
+                        'milestone': milestone_object,
+                        'project': project_object,
+                        'watchman_id': watchman_id
+                    }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, milestone_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _merge_request_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of merge requests to find matches against the regex
+async def _merge_request_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of merge requests to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
-                                    GitLab client, search list, regex pattern,
+                                    GitLab client, search list, signature matcher,
                                     timeframe, results list, verbosity flag, and log handler.
     Returns:
         Multiprocessing list to be combined by the parent process
     """
 
     now = calendar.timegm(time.gmtime())
-    for mr_dict in args.search_result_list:
+    for mr_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             mr_object = merge_request.create_from_dict(mr_dict)
-            if convert_to_epoch(mr_object.updated_at) > (now - args.timeframe) and \
-                    args.regex.search(str(mr_object.description)):
-                project_object = project.create_from_dict(args.gitlab_client.get_project(mr_object.project_id))
-                match_string = args.regex.search(str(mr_object.description)).group(0)
+            if convert_to_epoch(mr_object.updated_at) <= (now - args.timeframe):
+                continue
+            matches = args.matcher.matches(str(mr_object.description))
+            if matches:
+                project_object = await _populate_project_owners(
+                    args.gitlab_client,
+                    project.create_from_dict(await args.gitlab_client.get_project(mr_object.project_id)))
                 if not args.verbose:
                     setattr(mr_object, 'description', None)
-                watchman_id = hashlib.md5(f'{match_string}.{mr_object.id}'.encode()).hexdigest()
-                args.results_list.append({
-                    'match_string': match_string,
-                    'merge_request': mr_object,
-                    'project': _populate_project_owners(args.gitlab_client, project_object),
-                    'watchman_id': watchman_id
-                })
+                for found in first_matches(matches):
+                    watchman_id = hashlib.md5(f'{found.match_string}.{mr_object.id}'.encode()).hexdigest()
+                    args.results_list.append((found.signature_id, {
+                        'match_string': found.match_string,
+                        'location': found.location(),
+                        'merge_request': mr_object,
+                        'project': project_object,
+                        'watchman_id': watchman_id
+                    }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, mr_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _note_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of notes to find matches against the regex
+async def _note_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of notes to find matches against the signatures
 
     Args:
         args: Multiprocessing arguments containing the
-                GitLab client, search list, regex pattern,
+                GitLab client, search list, signature matcher,
                 timeframe, results list, verbosity flag, and log handler.
     Returns:
         Multiprocessing list to be combined by the parent process
     """
 
     now = calendar.timegm(time.gmtime())
-    try:
-        for note_dict in args.search_result_list:
+    for note_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
+        try:
             note_object = note.create_from_dict(note_dict)
-            if convert_to_epoch(note_object.created_at) > (now - args.timeframe) and \
-                    args.regex.search(str(note_object.body)):
-                match_string = args.regex.search(str(note_object.body)).group(0)
-                watchman_id = hashlib.md5(f'{match_string}.{note_object.id}'.encode()).hexdigest()
-                args.results_list.append({
+            if convert_to_epoch(note_object.created_at) <= (now - args.timeframe):
+                continue
+            for found in first_matches(args.matcher.matches(str(note_object.body))):
+                watchman_id = hashlib.md5(f'{found.match_string}.{note_object.id}'.encode()).hexdigest()
+                args.results_list.append((found.signature_id, {
                     'note': note_object,
-                    'match_string': match_string,
+                    'match_string': found.match_string,
+                    'location': found.location(),
                     'watchman_id': watchman_id
-                })
-    except Exception as e:
-        if args.log_handler:
-            args.log_handler.log('WARNING', e)
-            args.log_handler.log('DEBUG', traceback.format_exc())
-        else:
-            args.log_queue.put('WARNING', e)
-            args.log_queue.put('DEBUG', traceback.format_exc())
+                }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, note_dict, e)
+        except Exception as e:
+            if args.log_handler:
+                args.log_handler.log('WARNING', e)
+                args.log_handler.log('DEBUG', traceback.format_exc())
+            else:
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
 
 
-def _snippet_worker(args: WorkerArgs) -> List[Dict]:
-    """ MULTIPROCESSING WORKER - Iterates through a list of snippets to find matches against the regex
+async def _snippet_worker(args: WorkerArgs) -> List[Tuple[str, Dict]]:
+    """ MULTIPROCESSING WORKER - Iterates through a list of snippets to find matches against the signatures.
+    Matches in the title take precedence over matches in the description
 
     Args:
         args: Multiprocessing arguments containing the
-                GitLab client, search list, regex pattern,
+                GitLab client, search list, signature matcher,
                 timeframe, results list, verbosity flag, and log handler.
     Returns:
         Multiprocessing list to be combined by the parent process
     """
 
     now = calendar.timegm(time.gmtime())
-    for snippet_dict in args.search_result_list:
+    for snippet_dict in track_progress(args.search_result_list, args.monitor, args.task_id):
         try:
             snippet_object = snippet.create_from_dict(snippet_dict)
-            if convert_to_epoch(snippet_object.created_at) > (now - args.timeframe) and \
-                    (args.regex.search(str(snippet_object.title)) or
-                     args.regex.search(str(snippet_object.description))):
-                if args.regex.search(str(snippet_object.title)):
-                    match_string = args.regex.search(str(snippet_object.title)).group(0)
-                else:
-                    match_string = args.regex.search(str(snippet_object.description)).group(0)
+            if convert_to_epoch(snippet_object.created_at) <= (now - args.timeframe):
+                continue
+            matches = args.matcher.matches(str(snippet_object.title), str(snippet_object.description))
+            if matches:
                 if not args.verbose:
                     setattr(snippet_object, 'description', None)
-                watchman_id = hashlib.md5(f'{match_string}.{snippet_object.id}'.encode()).hexdigest()
-                args.results_list.append({
-                    'snippet': snippet_object,
-                    'match_string': match_string,
-                    'watchman_id': watchman_id
-                })
+                for found in first_matches(matches):
+                    watchman_id = hashlib.md5(f'{found.match_string}.{snippet_object.id}'.encode()).hexdigest()
+                    args.results_list.append((found.signature_id, {
+                        'snippet': snippet_object,
+                        'match_string': found.match_string,
+                        'location': found.location(),
+                        'watchman_id': watchman_id
+                    }))
+        except ScanBudgetExceededError as e:
+            _skip_item(args, snippet_dict, e)
         except Exception as e:
             if args.log_handler:
                 args.log_handler.log('WARNING', e)
                 args.log_handler.log('DEBUG', traceback.format_exc())
             else:
-                args.log_queue.put('WARNING', e)
-                args.log_queue.put('DEBUG', traceback.format_exc())
+                args.log_queue.put(('WARNING', e))
+                args.log_queue.put(('DEBUG', traceback.format_exc()))
     return args.results_list
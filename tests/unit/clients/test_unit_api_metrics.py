@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from gitlab_watchman.clients.api_metrics import ApiMetrics, endpoint_template
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://gitlab.example.com/api/v4/projects/42', ('/projects/:id', '')),
+    ('https://gitlab.example.com/api/v4/projects/group%2Fproject/members', ('/projects/:id/members', '')),
+    ('https://gitlab.example.com/api/v4/projects/42/repository/files/src%2Fapp.py?ref=main',
+     ('/projects/:id/repository/files/:id', '')),
+    ('https://gitlab.example.com/api/v4/projects/42/repository/commits/abc123',
+     ('/projects/:id/repository/commits/:id', '')),
+    ('https://gitlab.example.com/api/v4/projects/42/wikis/home', ('/projects/:id/wikis/:slug', '')),
+    ('https://gitlab.example.com/api/v4/groups/4/members?page=2', ('/groups/:id/members', '')),
+    ('https://gitlab.example.com/api/v4/search?scope=blobs&search=AKIA&page=3', ('/search', 'blobs')),
+    ('https://gitlab.example.com/api/v4/users?username=joe', ('/users', '')),
+])
+def test_endpoint_template(url: str, expected: tuple):
+    assert endpoint_template(url) == expected
+
+
+def test_summary():
+    metrics = ApiMetrics()
+    for i in range(100):
+        metrics.record('GET', f'https://gitlab.example.com/api/v4/projects/{i}', 200, (i + 1) / 1000, 1000)
+    metrics.record('GET', 'https://gitlab.example.com/api/v4/projects/1', 404, 0.01, 30)
+    metrics.record('GET', 'https://gitlab.example.com/api/v4/search?scope=blobs', 429, 0.002, 0)
+    metrics.record('GET', 'https://gitlab.example.com/api/v4/search?scope=blobs', 200, 0.5, 5000)
+    metrics.record('GET', 'https://gitlab.example.com/api/v4/projects/1', 200, 0.002, 0, cached=True)
+
+    summary = metrics.summary()
+
+    # Test endpoints are ordered by the total time spent on them
+    assert [(s.get('endpoint'), s.get('scope')) for s in summary] == [('/projects/:id', ''), ('/search', 'blobs')]
+
+    # Test calls, bytes, cached responses, retries and errors are counted
+    projects, search = summary
+    assert (projects.get('calls'), projects.get('bytes'), projects.get('cached')) == (102, 100030, 1)
+    assert projects.get('errors') == {'404': 1}
+    assert (search.get('retries'), search.get('errors')) == (1, {'429': 1})
+
+    # Test percentiles are accurate to within the histogram bucket size
+    assert projects.get('latency_ms').get('p50') == pytest.approx(50, rel=0.05)
+    assert projects.get('latency_ms').get('p99') == pytest.approx(99, rel=0.05)
+    assert projects.get('latency_ms').get('max') == pytest.approx(100, rel=0.05)
+
+
+def test_merge():
+    worker_metrics = [ApiMetrics(), ApiMetrics()]
+    for worker, metrics in enumerate(worker_metrics):
+        metrics.record('GET', 'https://gitlab.example.com/api/v4/projects/1', 200, 0.01 * (worker + 1), 100)
+        metrics.record('HEAD', 'https://gitlab.example.com/api/v4/projects/1/repository/files/a.py', 503, 0.01, 0)
+        metrics.record_connection('https')
+        metrics.record('GET', 'https://gitlab.example.com/api/v4/groups/4', 200, 0.01, 0, cached=True)
+        metrics.record_cache_store()
+
+    # Test snapshots from several processes combine into one summary
+    combined = ApiMetrics()
+    for metrics in worker_metrics:
+        combined.merge(metrics.snapshot())
+    summary = {(s.get('method'), s.get('endpoint')): s for s in combined.summary()}
+    assert summary.get(('GET', '/projects/:id')).get('calls') == 2
+    assert summary.get(('GET', '/projects/:id')).get('latency_ms').get('total') == pytest.approx(30)
+    assert summary.get(('HEAD', '/projects/:id/repository/files/:id')).get('errors') == {'503': 2}
+    assert summary.get(('HEAD', '/projects/:id/repository/files/:id')).get('retries') == 2
+    assert combined.connections() == {'opened': 2, 'tls_handshakes': 2}
+
+    # Test response cache counters from every worker are added together
+    assert combined.response_cache() == {'revalidated': 2, 'stored': 2}
+
+    # Test a snapshot still merges after a round trip through JSON
+    restored = ApiMetrics()
+    restored.merge(json.loads(json.dumps(worker_metrics[0].snapshot())))
+    restored.merge(worker_metrics[1].snapshot())
+    assert restored.summary() == combined.summary()
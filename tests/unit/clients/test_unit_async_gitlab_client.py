@@ -0,0 +1,198 @@
+import asyncio
+from typing import Callable, Dict, Any, List, Tuple
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.async_gitlab_client import AsyncGitLabAPIClient
+from gitlab_watchman.clients.entity_cache import EntityCache
+from gitlab_watchman.clients.gitlab_client import ClientOptions
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.exceptions import (
+    GitLabWatchmanAuthenticationError,
+    GitLabWatchmanGetObjectError,
+    GitLabWatchmanNotAuthorisedError
+)
+from gitlab_watchman.testing.mock_server import MockGitLabConfig, MockGitLabServer, MockRequest
+
+SEARCH_RESULTS = [{'id': i, 'project_id': 1, 'data': f'AKIA{i:016d}'} for i in range(250)]
+GROUP_MEMBERS = [{'id': i, 'username': f'user{i}', 'state': 'active', 'access_level': 50} for i in range(120)]
+
+
+def _page(items: List[Dict[str, Any]],
+          query: Dict[str, str],
+          total_pages: bool = True) -> Tuple[int, Any, Dict[str, Any]]:
+    per_page = int(query.get('per_page', '20'))
+    page = int(query.get('page', '1'))
+    pages = max(-(-len(items) // per_page), 1)
+    headers = {'X-Page': str(page), 'X-Next-Page': str(page + 1) if page < pages else ''}
+    if total_pages:
+        headers['X-Total-Pages'] = str(pages)
+    return 200, items[(page - 1) * per_page:page * per_page], headers
+
+
+class MockGitLabHandler:
+    """ Answers requests to the GitLab API endpoints used by AsyncGitLabAPIClient, recording the
+    path of every request """
+    responses = {
+        '/projects/1': (200, {'id': 1, 'name': 'Project'}, {}),
+        '/projects/403': (403, {'message': '403 Forbidden'}, {}),
+        '/projects/500': (500, {'message': '500 Internal Server Error'}, {}),
+        '/projects/1/repository/commits/abc123': (
+            200, {'id': 'abc123', 'committed_date': '2024-01-01T00:00:00.000+00:00'}, {}),
+        '/projects/1/wikis/docs%2Fhome': (200, {'slug': 'docs/home', 'content': 'Wiki'}, {}),
+        '/groups/4': (200, {'id': 4, 'name': 'Group'}, {}),
+    }
+    # Responses to the first request to each path, after which the request succeeds
+    first_responses = {
+        '/projects/429': (429, {'message': 'Retry later'}, {'Retry-After': '0'}),
+        '/projects/503': (503, {'message': 'Unavailable'}, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}),
+    }
+    retried_responses = {
+        '/projects/429': (200, {'id': 429, 'name': 'Throttled Project'}, {}),
+        '/projects/503': (200, {'id': 503, 'name': 'Unavailable Project'}, {}),
+    }
+    files = {
+        'src%2Fapp.py': (200, {'file_path': 'src/app.py', 'commit_id': 'abc123'}, {}),
+        'vendor%2Fbundle.js': (200, {'content': 'A' * 1000}, {
+            'X-Gitlab-File-Path': 'vendor/bundle.js',
+            'X-Gitlab-Size': '750',
+            'X-Gitlab-Commit-Id': 'abc123'
+        }),
+    }
+
+    def __init__(self):
+        self.requests: List[str] = []
+        self.retried = set()
+
+    # pylint: disable=too-many-return-statements
+    def __call__(self, request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        path = request.path.removeprefix('/api/v4')
+        query = request.query
+        self.requests.append(request.path)
+
+        if path in self.first_responses:
+            if path in self.retried:
+                return self.retried_responses.get(path)
+            self.retried.add(path)
+            return self.first_responses.get(path)
+        if path in self.responses:
+            return self.responses.get(path)
+        file_path = path.removeprefix('/projects/1/repository/files/')
+        if file_path in self.files and query.get('ref') == 'main':
+            return self.files.get(file_path)
+        if path == '/groups/4/members':
+            return _page(GROUP_MEMBERS, query, total_pages=False)
+        if path == '/users':
+            return 200, [{'id': 1, 'username': 'joe'}] if query.get('username') == 'joe' else [], {}
+        if path == '/search' and query.get('scope') == 'blobs' and query.get('search') == 'AKIA':
+            return _page(SEARCH_RESULTS, query)
+        return 404, {'message': '404 Not Found'}, {}
+
+
+@pytest.fixture
+def gitlab_handler() -> MockGitLabHandler:
+    return MockGitLabHandler()
+
+
+@pytest.fixture
+def mock_gitlab_url(mock_gitlab_handler_server: Callable[..., MockGitLabServer],
+                    gitlab_handler: MockGitLabHandler) -> str:
+    return f'{mock_gitlab_handler_server(gitlab_handler, MockGitLabConfig(token="token")).url}/'
+
+
+def _run(url: str, coroutine_func, token: str = 'token'):
+    async def _main():
+        async with AsyncGitLabAPIClient(token, url) as client:
+            return await coroutine_func(client)
+
+    return asyncio.run(_main())
+
+
+def test_get_entities(mock_gitlab_url: str):
+    # Test each method returns the decoded JSON response
+    assert _run(mock_gitlab_url, lambda c: c.get_project(1)) == {'id': 1, 'name': 'Project'}
+    assert _run(mock_gitlab_url, lambda c: c.get_group(4)) == {'id': 4, 'name': 'Group'}
+    assert _run(mock_gitlab_url, lambda c: c.get_file(1, 'src/app.py', 'main')).get('commit_id') == 'abc123'
+    assert _run(mock_gitlab_url, lambda c: c.get_commit(1, 'abc123')).get('id') == 'abc123'
+
+    # Test file metadata is read from the headers of a HEAD request
+    metadata = _run(mock_gitlab_url, lambda c: c.get_file_metadata(1, 'vendor/bundle.js', 'main'))
+    assert (metadata.get('file_path'), metadata.get('size'), metadata.get('commit_id')) == \
+           ('vendor/bundle.js', 750, 'abc123')
+
+    assert _run(mock_gitlab_url, lambda c: c.get_wiki_page(1, 'docs/home')).get('content') == 'Wiki'
+    assert _run(mock_gitlab_url, lambda c: c.get_user_by_username('joe')) == {'id': 1, 'username': 'joe'}
+
+    # Test a username that doesn't exist returns None, the same as GitLabAPIClient
+    assert _run(mock_gitlab_url, lambda c: c.get_user_by_username('ghost')) is None
+
+
+def test_paginated_requests(mock_gitlab_url: str):
+    # Test all pages of search results are returned in order
+    results = _run(mock_gitlab_url, lambda c: c.global_search('AKIA', 'blobs'))
+    assert results == SEARCH_RESULTS
+
+    # Test pages are followed when GitLab doesn't return the total page count
+    members = _run(mock_gitlab_url, lambda c: c.get_group_members(4))
+    assert members == GROUP_MEMBERS
+
+
+def test_concurrent_requests_share_cache(mock_gitlab_url: str, gitlab_handler: MockGitLabHandler):
+    async def _get_projects(client: AsyncGitLabAPIClient):
+        await client.get_project(1)
+        return await asyncio.gather(*(client.get_project(1) for _ in range(20)))
+
+    # Test concurrent requests share the session, and cached entities aren't requested again
+    gitlab_handler.requests.clear()
+    projects = _run(mock_gitlab_url, _get_projects)
+    assert projects == [{'id': 1, 'name': 'Project'}] * 20
+    assert gitlab_handler.requests == ['/api/v4/projects/1']
+
+    async def _get_groups(client: AsyncGitLabAPIClient):
+        return await asyncio.gather(*(client.get_group(4) for _ in range(20)))
+
+    # Test concurrent lookups of an entity that isn't cached yet share one request
+    gitlab_handler.requests.clear()
+    groups = _run(mock_gitlab_url, _get_groups)
+    assert groups == [{'id': 4, 'name': 'Group'}] * 20
+    assert gitlab_handler.requests == ['/api/v4/groups/4']
+
+
+def test_exception_mapping(mock_gitlab_url: str):
+    # Test errors are mapped to GitLab Watchman exceptions the same way as GitLabAPIClient
+    with pytest.raises(GitLabWatchmanAuthenticationError):
+        _run(mock_gitlab_url, lambda c: c.get_project(1), token='invalid')
+    with pytest.raises(GitLabWatchmanNotAuthorisedError):
+        _run(mock_gitlab_url, lambda c: c.get_project(403))
+    with pytest.raises(GitLabWatchmanGetObjectError):
+        _run(mock_gitlab_url, lambda c: c.get_project(404))
+    assert _run(mock_gitlab_url, lambda c: c.get_project(500)) is None
+
+    # Test transient errors are retried
+    assert _run(mock_gitlab_url, lambda c: c.get_project(429)) == {'id': 429, 'name': 'Throttled Project'}
+
+    # Test a Retry-After header given as an HTTP date is understood
+    assert _run(mock_gitlab_url, lambda c: c.get_project(503)) == {'id': 503, 'name': 'Unavailable Project'}
+
+
+def test_shared_state_from_options(mock_gitlab_url: str):
+    options = ClientOptions(entity_cache=EntityCache(), api_metrics=ApiMetrics(), rate_limiter=RateLimiter())
+
+    async def _main():
+        async with AsyncGitLabAPIClient('token', mock_gitlab_url, options) as client:
+            await client.get_project(1)
+            await client.get_project(429)
+
+    asyncio.run(_main())
+
+    # Test entities are cached in the entity cache passed in, e.g. one shared with the parent's client
+    assert options.entity_cache.get('project', 1) == {'id': 1, 'name': 'Project'}
+
+    # Test every response, including retried ones, is counted and updates the rate limiter
+    api_summary = {summary.get('endpoint'): summary for summary in options.api_metrics.summary()}
+    assert api_summary.get('/projects/:id').get('calls') == 3
+    assert api_summary.get('/projects/:id').get('errors') == {'429': 1}
+    assert options.rate_limiter.stats().get('throttled') == 1
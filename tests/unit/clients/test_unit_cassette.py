@@ -0,0 +1,103 @@
+import os
+import time
+from typing import Callable
+
+import pytest
+
+from gitlab_watchman.clients.cassette import Cassette, request_key
+from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
+from gitlab_watchman.exceptions import CassetteMissError
+from gitlab_watchman.testing.mock_server import MockGitLabServer
+
+
+def _scan(client: GitLabAPIClient):
+    project = client.get_project('1')
+    return {
+        'user': client.get_user_info(),
+        'project': project,
+        'members': client.get_project_members('1'),
+        'projects': client.get_all_projects(),
+        'search': client.global_search('a', 'blobs'),
+    }
+
+
+def test_request_key():
+    assert request_key('GET', 'https://gitlab.example.com/api/v4/projects/1') == 'GET /api/v4/projects/1'
+    assert request_key('GET', 'http://127.0.0.1:8080/api/v4/search?scope=blobs&search=a') == \
+           'GET /api/v4/search?scope=blobs&search=a'
+
+
+def test_record_and_replay(tmp_path,
+                           mock_gitlab_server: MockGitLabServer,
+                           recording_client: GitLabAPIClient,
+                           replay_client: Callable[..., GitLabAPIClient]):
+    recorded = _scan(recording_client)
+    path = str(tmp_path / 'scan.jsonl.gz')
+    recording_client.cassette.save(path)
+    recorded_counts = recording_client.cassette.request_counts()
+    assert sum(recorded_counts.values()) == len(mock_gitlab_server.requests)
+    assert os.path.getsize(path) > 0
+    url = mock_gitlab_server.url
+    mock_gitlab_server.stop()
+
+    # Test a replay makes the same requests and gets the same results, without the server
+    client = replay_client(path, url)
+    assert _scan(client) == recorded
+    assert client.cassette.request_counts() == recorded_counts
+    assert client.cassette.stats().get('misses') == 0
+
+
+def test_replay_miss(tmp_path,
+                     recording_client: GitLabAPIClient,
+                     replay_client: Callable[..., GitLabAPIClient]):
+    path = str(tmp_path / 'scan.jsonl.gz')
+    recording_client.cassette.save(path)
+
+    client = replay_client(path, recording_client.base_url)
+    with pytest.raises(CassetteMissError):
+        client.get_metadata()
+    assert client.cassette.stats().get('misses') == 1
+
+
+def test_replay_timing(tmp_path, replay_client: Callable[..., GitLabAPIClient]):
+    cassette = Cassette()
+    cassette.record('GET', 'http://gitlab.invalid/api/v4/user', 200, {'Content-Type': 'application/json'},
+                    b'{"id": 1, "username": "watchman"}', elapsed=0.01)
+    cassette.record('GET', 'http://gitlab.invalid/api/v4/metadata', 200, {'Content-Type': 'application/json'},
+                    b'{"version": "17.0.0"}', elapsed=0.3)
+    path = str(tmp_path / 'timed.jsonl.gz')
+    cassette.save(path)
+
+    # Test timed replays take as long as the recorded requests, and full speed replays don't
+    client = replay_client(path, timed=True)
+    start = time.monotonic()
+    assert client.get_metadata() == {'version': '17.0.0'}
+    assert time.monotonic() - start >= 0.3
+
+    client = replay_client(path)
+    start = time.monotonic()
+    assert client.get_metadata() == {'version': '17.0.0'}
+    assert time.monotonic() - start < 0.3
+
+
+def test_repeated_requests():
+    cassette = Cassette()
+    for version in ['1', '2']:
+        cassette.record('GET', 'https://gitlab.example.com/api/v4/metadata', 200, {}, version.encode(), elapsed=0.01)
+
+    # Test repeated requests are answered in the order they were recorded, then with the last response
+    assert [cassette.play('GET', 'http://localhost/api/v4/metadata').get('body') for _ in range(3)] == \
+           [b'1', b'2', b'2']
+    assert cassette.request_counts() == {'GET /metadata': 5}
+
+
+def test_binary_bodies(tmp_path):
+    cassette = Cassette()
+    cassette.record('GET', 'https://gitlab.example.com/api/v4/projects/1/avatar', 200,
+                    {'Content-Encoding': 'gzip', 'Content-Type': 'image/png'}, b'\x89PNG\xff', elapsed=0.01)
+    path = str(tmp_path / 'binary.jsonl.gz')
+    cassette.save(path)
+
+    interaction = Cassette.load(path).play('GET', 'https://gitlab.example.com/api/v4/projects/1/avatar')
+    assert interaction.get('body') == b'\x89PNG\xff'
+    assert interaction.get('headers') == {'Content-Type': 'image/png'}
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+import pytest
+
+from gitlab_watchman.clients import concurrency
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter, endpoint_class
+from gitlab_watchman.clients.session import GitLabSession
+from gitlab_watchman.testing.mock_server import MockGitLabServer, MockRequest
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://gitlab.example.com/api/v4/search?scope=blobs&search=AKIA', 'search'),
+    ('https://gitlab.example.com/api/v4/projects/42', 'projects'),
+    ('https://gitlab.example.com/api/v4/projects/42/repository/files/src%2Fapp.py?ref=main', 'files'),
+    ('https://gitlab.example.com/api/v4/projects/42/repository/commits/abc123', 'commits'),
+    ('https://gitlab.example.com/api/v4/projects/42/members', 'members'),
+    ('https://gitlab.example.com/api/v4/groups/4/members', 'members'),
+    ('https://gitlab.example.com/api/v4/users?username=joe', 'other'),
+])
+def test_endpoint_class(url: str, expected: str):
+    assert endpoint_class(url) == expected
+
+
+def test_acquire_waits_at_limit():
+    limiter = ConcurrencyLimiter(initial_limit=2)
+
+    # Test no more slots are handed out than the limit, for each endpoint class separately
+    assert limiter.acquire('projects', 0.01)
+    assert limiter.acquire('projects', 0.01)
+    assert not limiter.acquire('projects', 0.01)
+    assert limiter.acquire('files', 0.01)
+
+    # Test a released slot can be taken again
+    limiter.release('projects', 200, 0.1)
+    assert limiter.acquire('projects', 0.01)
+    assert limiter.stats().get('projects').get('max_in_flight') == 2
+
+
+def test_release_owner():
+    limiter = ConcurrencyLimiter(initial_limit=3, max_limit=3)
+    assert limiter.acquire('projects', 0.01, owner=1)
+    assert limiter.acquire('files', 0.01, owner=1)
+    assert limiter.acquire('projects', 0.01, owner=1)
+    assert limiter.acquire('projects', 0.01, owner=2)
+    assert not limiter.acquire('projects', 0.01)
+
+    # Test the slots of an owner that stopped without releasing them are freed, in every endpoint class
+    assert limiter.release_owner(1) == 3
+    assert limiter.acquire('projects', 0.01)
+    assert limiter.acquire('projects', 0.01)
+    assert not limiter.acquire('projects', 0.01)
+
+    # Test slots that were already released for their owner aren't released again
+    limiter.release('projects', 200, 0.1, owner=1)
+    assert not limiter.acquire('projects', 0.01)
+    assert limiter.release_owner(1) == 0
+    limiter.release('projects', 200, 0.1, owner=2)
+    assert limiter.acquire('projects', 0.01)
+
+
+def _round(limiter: ConcurrencyLimiter, status_code: int = 200, elapsed: float = 0.1):
+    """ Fill every slot of the projects class, then release them all """
+    slots = int(limiter.stats().get('projects', {}).get('limit', limiter.initial_limit))
+    for _ in range(slots):
+        assert limiter.acquire('projects', 0.01)
+    for _ in range(slots):
+        limiter.release('projects', status_code, elapsed)
+
+
+def test_additive_increase():
+    limiter = ConcurrencyLimiter(initial_limit=2, max_limit=4)
+
+    # Test the limit grows by about one for each round of requests that fills it
+    _round(limiter)
+    assert limiter.stats().get('projects').get('limit') == pytest.approx(3, abs=0.2)
+
+    # Test the limit doesn't grow while the class isn't using all of its slots
+    for _ in range(20):
+        limiter.acquire('projects', 0.01)
+        limiter.release('projects', 200, 0.1)
+    assert limiter.stats().get('projects').get('limit') < 3.2
+
+    # Test the limit never goes above the maximum
+    for _ in range(10):
+        _round(limiter)
+    assert limiter.stats().get('projects').get('limit') == 4
+
+
+def test_multiplicative_decrease(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(concurrency.time, 'monotonic', lambda: now[0])
+    limiter = ConcurrencyLimiter(initial_limit=8)
+    _round(limiter, elapsed=0.1)
+    limit = limiter.stats().get('projects').get('limit')
+
+    # Test a throttled response halves the limit, but a burst of errors only counts once
+    now[0] += 1
+    limiter.acquire('projects', 0.01)
+    limiter.acquire('projects', 0.01)
+    limiter.release('projects', 429, 0.1)
+    limiter.release('projects', 503, 0.1)
+    assert limiter.stats().get('projects').get('limit') == pytest.approx(limit / 2, abs=0.1)
+
+    # Test a response much slower than the baseline reduces the limit by 10%
+    now[0] += 1
+    limit = limiter.stats().get('projects').get('limit')
+    limiter.acquire('projects', 0.01)
+    limiter.release('projects', 200, 1.0)
+    assert limiter.stats().get('projects').get('limit') == pytest.approx(limit * 0.9, abs=0.1)
+    assert limiter.stats().get('projects').get('decreases') == 2
+
+    # Test the limit never goes below one
+    for _ in range(10):
+        now[0] += 1
+        limiter.acquire('projects', 0.01)
+        limiter.release('projects', 500, 0.1)
+    assert limiter.stats().get('projects').get('limit') == 1
+
+
+def test_session_limits_requests_in_flight(mock_gitlab_handler_server: Callable[..., MockGitLabServer]):
+    in_flight = {'current': 0, 'max': 0}
+    lock = threading.Lock()
+
+    def _slow_handler(_request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        with lock:
+            in_flight['current'] += 1
+            in_flight['max'] = max(in_flight.get('max'), in_flight.get('current'))
+        time.sleep(0.02)
+        with lock:
+            in_flight['current'] -= 1
+        return 200, None, {}
+
+    session = GitLabSession(concurrency_limiter=ConcurrencyLimiter(initial_limit=2, max_limit=2))
+    url = f'{mock_gitlab_handler_server(_slow_handler).url}/api/v4/projects/1'
+
+    # Test the session never has more requests in flight than the limit, however many threads use it
+    with ThreadPoolExecutor(8) as executor:
+        responses = list(executor.map(lambda _: session.get(url), range(16)))
+    assert [response.status_code for response in responses] == [200] * 16
+    assert in_flight.get('max') == 2
+    assert session.concurrency_limiter.stats().get('projects').get('max_in_flight') == 2
@@ -0,0 +1,51 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import pytest
+import requests
+
+from gitlab_watchman.clients.connection_pool import PooledHTTPAdapter
+from gitlab_watchman.testing.mock_server import MockGitLabServer
+
+
+@pytest.fixture
+def mock_gitlab_url(mock_gitlab_handler_server: Callable[..., MockGitLabServer]) -> str:
+    """ Mock GitLab server answering every request with an empty object, over kept-alive connections """
+    return mock_gitlab_handler_server(lambda request: (200, {}, {})).url
+
+
+def _session(adapter: PooledHTTPAdapter) -> requests.Session:
+    session = requests.Session()
+    session.mount('http://', adapter)
+    return session
+
+
+def test_connections_reused(mock_gitlab_url: str):
+    opened = []
+    adapter = PooledHTTPAdapter(on_new_connection=opened.append)
+    session = _session(adapter)
+
+    # Test one connection is opened and then reused for requests made one after another
+    for i in range(10):
+        assert session.get(f'{mock_gitlab_url}/api/v4/projects/{i}').status_code == 200
+    assert adapter.connections_opened == 1
+    assert adapter.tls_handshakes == 0
+    assert opened == ['http']
+
+    # Test pooled connections are opened with TCP keep-alive enabled
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in adapter.poolmanager.connection_pool_kw.get('socket_options')
+
+
+def test_pool_maxsize(mock_gitlab_url: str):
+    adapter = PooledHTTPAdapter(pool_maxsize=4)
+    session = _session(adapter)
+
+    # Test concurrent requests open no more connections than they need, and reuse them after
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: session.get(f'{mock_gitlab_url}/api/v4/projects/{i}'), range(40)))
+    assert 1 <= adapter.connections_opened <= 4
+    opened = adapter.connections_opened
+    for i in range(10):
+        session.get(f'{mock_gitlab_url}/api/v4/projects/{i}')
+    assert adapter.connections_opened == opened
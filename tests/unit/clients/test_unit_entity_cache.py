@@ -0,0 +1,126 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from gitlab_watchman.clients import entity_cache
+from gitlab_watchman.clients.entity_cache import EntityCache
+from gitlab_watchman.clients.shared_state import SharedStateManager
+
+
+def test_get_and_set():
+    cache = EntityCache()
+
+    # Test an entity is found under its ID whether it is given as an int or a string
+    assert cache.get('project', 1) is None
+    cache.set('project', 1, {'id': 1, 'name': 'project'})
+    assert cache.get('project', '1') == {'id': 1, 'name': 'project'}
+    assert len(cache) == 1
+
+    # Test entities of different types with the same ID are cached separately
+    cache.set('group', 1, {'id': 1, 'name': 'group'})
+    assert cache.get('project', 1) == {'id': 1, 'name': 'project'}
+    assert cache.get('group', 1) == {'id': 1, 'name': 'group'}
+    assert len(cache) == 2
+
+
+def test_shared_between_threads():
+    cache = EntityCache()
+
+    def _lookup(i: int):
+        entity = cache.get('project', i % 4)
+        if entity is None:
+            entity = {'id': i % 4}
+            cache.set('project', i % 4, entity)
+        return entity
+
+    # Test the cache can be shared between threads
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(_lookup, range(100)))
+    assert results == [{'id': i % 4} for i in range(100)]
+    assert len(cache) == 4
+
+
+def test_claim(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(entity_cache.time, 'monotonic', lambda: now[0])
+    cache = EntityCache()
+
+    # Test only the first caller claims an entity, and the others wait for it
+    assert cache.claim('project', 1) == (None, True)
+    assert cache.claim('project', 1, timeout=0) == (None, False)
+
+    # Test a released claim that didn't cache the entity can be claimed again
+    cache.release('project', 1)
+    assert cache.claim('project', 1, timeout=0) == (None, True)
+    cache.set('project', 1, {'id': 1})
+    assert cache.claim('project', 1, timeout=0, waited=True) == ({'id': 1}, False)
+    assert cache.stats().get('coalesced') == 1
+
+    # Test a claim expires, so a caller that never releases it doesn't block the others
+    assert cache.claim('project', 2) == (None, True)
+    now[0] += entity_cache.CLAIM_TIMEOUT + 1
+    assert cache.claim('project', 2, timeout=0) == (None, True)
+
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(entity_cache.time, 'monotonic', lambda: now[0])
+    cache = EntityCache(ttl=60)
+
+    cache.set('project', 1, {'id': 1})
+    now[0] += 59
+    assert cache.get('project', 1) == {'id': 1}
+
+    # Test entries expire once they are older than the TTL
+    now[0] += 2
+    assert cache.get('project', 1) is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = EntityCache(max_size=2)
+    cache.set('project', 1, {'id': 1})
+    cache.set('project', 2, {'id': 2})
+
+    # Test the least recently used entry is evicted when the cache is full
+    assert cache.get('project', 1) == {'id': 1}
+    cache.set('project', 3, {'id': 3})
+    assert cache.get('project', 2) is None
+    assert cache.get('project', 1) == {'id': 1}
+    assert cache.get('project', 3) == {'id': 3}
+    assert cache.stats().get('evictions') == 1
+
+
+def test_stats():
+    cache = EntityCache()
+    assert cache.claim('project', 1) == (None, True)
+    cache.set('project', 1, {'id': 1})
+    cache.release('project', 1)
+    cache.claim('project', 1)
+    cache.get('project', 1)
+    cache.get('group', 4)
+
+    # Test hits and misses are counted
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'evictions': 0, 'coalesced': 0, 'size': 1}
+
+
+def _set_from_process(cache: EntityCache, project_id: int):
+    cache.set('project', project_id, {'id': project_id})
+
+
+def test_shared_between_processes():
+    manager = SharedStateManager()
+    manager.start()
+    try:
+        # pylint: disable=no-member
+        cache = manager.EntityCache(60, 100)
+
+        # Test entities cached by one process are visible to other processes
+        processes = [multiprocessing.Process(target=_set_from_process, args=(cache, i)) for i in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert [cache.get('project', i) for i in range(3)] == [{'id': 0}, {'id': 1}, {'id': 2}]
+        assert cache.stats() == {'hits': 3, 'misses': 0, 'evictions': 0, 'coalesced': 0, 'size': 3}
+    finally:
+        manager.shutdown()
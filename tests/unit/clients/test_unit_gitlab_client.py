@@ -0,0 +1,311 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Any, Tuple
+
+import pytest
+from gitlab import Gitlab
+from gitlab.exceptions import GitlabSearchError
+
+from gitlab_watchman.clients.gitlab_client import (
+    ClientOptions,
+    GitLabAPIClient,
+    JSON_DECODERS,
+    exception_handler
+)
+from gitlab_watchman.exceptions import GitLabWatchmanNotAuthorisedError, GitLabWatchmanGetObjectError
+from gitlab_watchman.testing.mock_server import MockGitLabServer, MockRequest
+
+
+class MockResponse:
+    """ Stand-in for the requests.Response returned by python-gitlab's http_request """
+    __test__ = False
+
+    def __init__(self, content: bytes, headers: Dict[str, str]):
+        self.content = content
+        self.headers = headers
+
+
+class MockGitlab:
+    """ Stand-in for the python-gitlab client, serving pages of search results """
+    __test__ = False
+
+    def __init__(self, items: List[Dict[str, Any]], per_page: int = 2, return_total_pages: bool = True):
+        self.items = items
+        self.per_page = per_page
+        self.return_total_pages = return_total_pages
+        self.requested_pages = []
+        self._lock = threading.Lock()
+
+    def http_request(self, verb: str, path: str, query_data: Dict[str, Any] | None = None, **kwargs) -> MockResponse:
+        assert (verb, path) == ('get', '/search')
+        page = query_data.get('page')
+        if page > 1:
+            # Later pages finish in reverse order, to check they are still yielded in order
+            time.sleep(0.01 * (10 - page))
+        with self._lock:
+            self.requested_pages.append(page)
+        total_pages = -(-len(self.items) // self.per_page)
+        headers = {'X-Next-Page': str(page + 1) if page < total_pages else ''}
+        if self.return_total_pages:
+            headers['X-Total-Pages'] = str(total_pages)
+        return MockResponse(
+            json.dumps(self.items[(page - 1) * self.per_page:page * self.per_page]).encode(), headers)
+
+
+def _mock_client(gitlab_client: Any, search_concurrency: int = 1) -> GitLabAPIClient:
+    client = object.__new__(GitLabAPIClient)
+    client.per_page = 2
+    client.options = ClientOptions(search_concurrency=search_concurrency, json_decoder=json.loads)
+    client.gitlab_client = gitlab_client
+    return client
+
+
+def test_global_search_pages_streams_pages():
+    items = [{'id': i} for i in range(5)]
+    mock_gitlab = MockGitlab(items)
+    client = _mock_client(mock_gitlab)
+
+    pages = client.global_search_pages('AKIA', 'blobs')
+
+    # Test only the first page is requested before the caller asks for more
+    assert next(pages) == [{'id': 0}, {'id': 1}]
+    assert mock_gitlab.requested_pages == [1]
+
+    # Test the remaining pages are yielded in order, including a partial final page
+    assert list(pages) == [[{'id': 2}, {'id': 3}], [{'id': 4}]]
+    assert mock_gitlab.requested_pages == [1, 2, 3]
+
+
+def test_global_search_pages_no_results():
+    client = _mock_client(MockGitlab([]))
+    assert list(client.global_search_pages('AKIA', 'blobs')) == []
+
+    client = _mock_client(MockGitlab([]), search_concurrency=4)
+    assert list(client.global_search_pages('AKIA', 'blobs')) == []
+
+
+def test_global_search_pages_prefetch():
+    items = [{'id': i} for i in range(11)]
+    mock_gitlab = MockGitlab(items)
+    client = _mock_client(mock_gitlab, search_concurrency=3)
+
+    # Test all pages are returned in order when later pages are downloaded concurrently
+    pages = list(client.global_search_pages('AKIA', 'blobs'))
+    assert pages == [items[i:i + 2] for i in range(0, 11, 2)]
+
+    # Test every remaining page is requested exactly once by page number
+    assert sorted(mock_gitlab.requested_pages) == [1, 2, 3, 4, 5, 6]
+
+
+def test_global_search_pages_prefetch_without_total_pages():
+    # Test pages are read one after another when GitLab doesn't return a total page count
+    items = [{'id': i} for i in range(5)]
+    mock_gitlab = MockGitlab(items, return_total_pages=False)
+    client = _mock_client(mock_gitlab, search_concurrency=3)
+
+    assert list(client.global_search_pages('AKIA', 'blobs')) == [items[0:2], items[2:4], items[4:]]
+    assert mock_gitlab.requested_pages == [1, 2, 3]
+
+
+def test_global_search_pages_fields():
+    items = [{'id': i, 'data': 'AKIA', 'project_id': 1, 'highlight': ['AKIA']} for i in range(3)]
+    client = _mock_client(MockGitlab(items))
+
+    # Test only the requested fields are kept in each result
+    assert list(client.global_search_pages('AKIA', 'blobs', fields=['id', 'data', 'ref'])) == [
+        [{'id': 0, 'data': 'AKIA'}, {'id': 1, 'data': 'AKIA'}], [{'id': 2, 'data': 'AKIA'}]]
+    assert client.global_search('AKIA', 'blobs') == items
+
+
+@pytest.mark.parametrize('decoder', JSON_DECODERS)
+def test_json_decoders(decoder: str):
+    client = _mock_client(MockGitlab([{'id': 1, 'data': 'AKIA\u00e9'}]))
+    client.options.json_decoder = JSON_DECODERS.get(decoder)
+
+    # Test every available decoder returns the same plain dicts
+    assert client.global_search('AKIA', 'blobs') == [{'id': 1, 'data': 'AKIA\u00e9'}]
+
+
+def test_exception_handler_generator():
+    @exception_handler
+    def forbidden_pages():
+        yield [{'id': 1}]
+        raise GitlabSearchError('403 Forbidden', response_code=403)
+
+    @exception_handler
+    def server_error_pages():
+        yield [{'id': 1}]
+        raise GitlabSearchError('500 Internal Server Error', response_code=500)
+
+    # Test exceptions raised part way through iteration are mapped to GitLab Watchman exceptions
+    pages = forbidden_pages()
+    assert next(pages) == [{'id': 1}]
+    with pytest.raises(GitLabWatchmanNotAuthorisedError):
+        next(pages)
+
+    # Test server errors end the iteration, the same as they return None for regular functions
+    assert list(server_error_pages()) == [[{'id': 1}]]
+
+
+def _file_handler(request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+    """ Answers requests to the GitLab repository files API for one large file """
+
+    if request.path != '/api/v4/projects/1/repository/files/vendor%2Fbundle.js' or request.query.get('ref') != 'main':
+        return 404, {'message': '404 File Not Found'}, {}
+    return 200, {'content': 'A' * 100000}, {
+        'X-Gitlab-File-Name': 'bundle.js',
+        'X-Gitlab-File-Path': 'vendor/bundle.js',
+        'X-Gitlab-Size': '75000',
+        'X-Gitlab-Encoding': 'base64',
+        'X-Gitlab-Ref': 'main',
+        'X-Gitlab-Blob-Id': '79f7bbd25901e8334750839545a9bd021f0e4c83',
+        'X-Gitlab-Commit-Id': 'd5a3ff139356ce33e37e73add446f16869741b50',
+        'X-Gitlab-Last-Commit-Id': '570e7b2abdd848b95f2f578043fc23bd6f6fd24d',
+    }
+
+
+def test_get_file_metadata(mock_gitlab_handler_server: Callable[..., MockGitLabServer]):
+    server = mock_gitlab_handler_server(_file_handler)
+    client = _mock_client(Gitlab(server.url, private_token='token'))
+
+    # Test file metadata is read from the response headers of a single HEAD request
+    metadata = client.get_file_metadata(1, 'vendor/bundle.js', 'main')
+    assert metadata == {
+        'file_name': 'bundle.js',
+        'file_path': 'vendor/bundle.js',
+        'size': 75000,
+        'encoding': 'base64',
+        'content_sha256': None,
+        'ref': 'main',
+        'blob_id': '79f7bbd25901e8334750839545a9bd021f0e4c83',
+        'commit_id': 'd5a3ff139356ce33e37e73add446f16869741b50',
+        'last_commit_id': '570e7b2abdd848b95f2f578043fc23bd6f6fd24d',
+    }
+    assert server.requests == [('HEAD', '/api/v4/projects/1/repository/files/vendor%2Fbundle.js?ref=main')]
+
+    # Test missing files are mapped to GitLab Watchman exceptions
+    with pytest.raises(GitLabWatchmanGetObjectError):
+        client.get_file_metadata(1, 'missing.js', 'main')
+
+
+class MockGitLabAPIHandler:
+    """ Answers requests for a few GitLab API entities, recording the method and path of every request """
+    responses = {
+        '/api/v4/user': {'id': 1, 'username': 'watchman'},
+        '/api/v4/projects/1': {'id': 1, 'name': 'Project'},
+        '/api/v4/projects/1/members': [{'id': 2, 'username': 'owner', 'access_level': 50}],
+        '/api/v4/projects/1/repository/files/src%2Fapp.py': {'file_path': 'src/app.py', 'commit_id': 'abc123'},
+        '/api/v4/projects/1/repository/commits/abc123': {'id': 'abc123'},
+        '/api/v4/projects/1/wikis/home': {'slug': 'home', 'content': 'Wiki'},
+        '/api/v4/groups/4': {'id': 4, 'name': 'Group'},
+        '/api/v4/groups/4/members': [{'id': 2, 'username': 'owner', 'access_level': 50}],
+        '/api/v4/users': [{'id': 2, 'username': 'owner'}],
+    }
+
+    def __init__(self):
+        self.requests: List[Tuple[str, str]] = []
+        self.delay = 0.0
+
+    def __call__(self, request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        self.requests.append((request.method, request.path))
+        time.sleep(self.delay)
+        if request.path not in self.responses:
+            return 404, {'message': '404 Not Found'}, {}
+        return 200, self.responses.get(request.path), {}
+
+
+@pytest.fixture
+def api_handler() -> MockGitLabAPIHandler:
+    return MockGitLabAPIHandler()
+
+
+@pytest.fixture
+def accounting_client(mock_gitlab_handler_server: Callable[..., MockGitLabServer],
+                      api_handler: MockGitLabAPIHandler) -> GitLabAPIClient:
+    """ GitLabAPIClient connected to MockGitLabAPIHandler, for asserting the exact requests each method makes """
+    return GitLabAPIClient('token', mock_gitlab_handler_server(api_handler).url)
+
+
+@pytest.mark.parametrize('method, args, expected_requests', [
+    ('get_project', (1,), ['/api/v4/projects/1']),
+    ('get_project_members', (1,), ['/api/v4/projects/1/members']),
+    ('get_file', (1, 'src/app.py', 'main'), ['/api/v4/projects/1/repository/files/src%2Fapp.py']),
+    ('get_commit', (1, 'abc123'), ['/api/v4/projects/1/repository/commits/abc123']),
+    ('get_wiki_page', (1, 'home'), ['/api/v4/projects/1/wikis/home']),
+    ('get_group', (4,), ['/api/v4/groups/4']),
+    ('get_group_members', (4,), ['/api/v4/groups/4/members']),
+    ('get_user_by_username', ('owner',), ['/api/v4/users']),
+])
+def test_request_accounting(accounting_client: GitLabAPIClient,
+                            api_handler: MockGitLabAPIHandler,
+                            method: str,
+                            args: Tuple[Any],
+                            expected_requests: List[str]):
+    # Test each method makes exactly the requests it needs, and no lookups of parent objects
+    api_handler.requests.clear()
+    assert getattr(accounting_client, method)(*args)
+    assert api_handler.requests == [('GET', path) for path in expected_requests]
+
+    # Test cached entities aren't requested again
+    if method not in ['get_project_members', 'get_file', 'get_wiki_page']:
+        getattr(accounting_client, method)(*args)
+        assert len(api_handler.requests) == len(expected_requests)
+
+
+@pytest.mark.parametrize('method, entity_id, path', [
+    ('get_project', 1, '/api/v4/projects/1'),
+    ('get_group', 4, '/api/v4/groups/4'),
+])
+def test_concurrent_lookups_coalesced(accounting_client: GitLabAPIClient,
+                                      api_handler: MockGitLabAPIHandler,
+                                      method: str,
+                                      entity_id: int,
+                                      path: str):
+    api_handler.requests.clear()
+    api_handler.delay = 0.1
+
+    # Test threads looking up the same entity at the same time share one request
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        entities = list(executor.map(lambda _: getattr(accounting_client, method)(entity_id), range(8)))
+    assert entities == [MockGitLabAPIHandler.responses.get(path)] * 8
+    assert api_handler.requests == [('GET', path)]
+    assert accounting_client.entity_cache.stats().get('coalesced') == 7
+    assert accounting_client.entity_cache.stats().get('misses') == 1
+
+
+def test_failed_lookups_not_cached(accounting_client: GitLabAPIClient, api_handler: MockGitLabAPIHandler):
+    api_handler.requests.clear()
+
+    # Test an entity that couldn't be fetched isn't cached, and its claim is released so it is requested again
+    for _ in range(2):
+        with pytest.raises(GitLabWatchmanGetObjectError):
+            accounting_client.get_project(404)
+    assert api_handler.requests == [('GET', '/api/v4/projects/404')] * 2
+    assert len(accounting_client.entity_cache) == 0
+
+
+def test_session_options(accounting_client: GitLabAPIClient):
+    # Test new connections are counted, and responses are compressed unless turned off
+    assert accounting_client.api_metrics.connections().get('opened') >= 1
+    assert 'gzip' in accounting_client.session.headers.get('Accept-Encoding')
+    client = GitLabAPIClient('token', accounting_client.base_url, ClientOptions(compress=False, pool_maxsize=4))
+    assert client.session.headers.get('Accept-Encoding') == 'identity'
+    assert client.adapter.connections_opened == client.api_metrics.connections().get('opened') == 1
+
+
+def test_api_metrics_records_requests(accounting_client: GitLabAPIClient):
+    def _calls(endpoint: str) -> int:
+        return sum(s.get('calls') for s in accounting_client.api_metrics.summary() if s.get('endpoint') == endpoint)
+
+    # Test every response received by the client's session is recorded against its endpoint
+    calls = _calls('/projects/:id/repository/files/:id')
+    accounting_client.get_file(1, 'src/app.py', 'main')
+    with pytest.raises(GitLabWatchmanGetObjectError):
+        accounting_client.get_file(1, 'missing.py', 'main')
+    assert _calls('/projects/:id/repository/files/:id') == calls + 2
+    assert _calls('/user') == 1
+    files = [s for s in accounting_client.api_metrics.summary() if s.get('endpoint').endswith('/files/:id')][0]
+    assert files.get('errors') == {'404': 1}
+    assert files.get('bytes') > 0
@@ -0,0 +1,116 @@
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+import requests
+
+from gitlab_watchman.clients.http_cache import CachingHTTPAdapter, DiskCache
+from gitlab_watchman.testing.mock_server import MockGitLabConfig, MockGitLabServer, MockRequest
+
+
+class MockETagHandler:
+    """ Answers requests for projects, which the mock server sends with ETags, recording the
+    path and If-None-Match header of each request """
+
+    def __init__(self):
+        self.requests: List[Tuple[str, str | None]] = []
+        self.projects = {'1': {'id': 1, 'name': 'Project'}}
+
+    def __call__(self, request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        self.requests.append((request.path, request.headers.get('If-None-Match')))
+        return 200, self.projects.get(request.path.rsplit('/', 1)[-1], {'path': request.path}), {'X-Total-Pages': 1}
+
+
+@pytest.fixture
+def etag_handler() -> MockETagHandler:
+    return MockETagHandler()
+
+
+@pytest.fixture
+def mock_gitlab_url(mock_gitlab_handler_server: Callable[..., MockGitLabServer], etag_handler: MockETagHandler) -> str:
+    return mock_gitlab_handler_server(etag_handler, MockGitLabConfig(token=None, rate_limit=10000)).url
+
+
+def _session(cache: DiskCache,
+             token: str = 'token',
+             on_store: Callable[[], None] | None = None) -> Tuple[requests.Session, CachingHTTPAdapter]:
+    session = requests.session()
+    session.headers.update({'Authorization': f'Bearer {token}'})
+    adapter = CachingHTTPAdapter(cache, on_store=on_store)
+    session.mount('http://', adapter)
+    return session, adapter
+
+
+def test_revalidates_cached_responses(mock_gitlab_url: str, etag_handler: MockETagHandler, tmp_path):
+    cache = DiskCache(str(tmp_path))
+    stores = []
+    session, adapter = _session(cache, on_store=lambda: stores.append(1))
+
+    # Test the first response is stored with its ETag, and reported to on_store
+    first = session.get(f'{mock_gitlab_url}/api/v4/projects/1')
+    assert first.json() == {'id': 1, 'name': 'Project'}
+    assert etag_handler.requests[-1] == ('/api/v4/projects/1', None)
+    assert len(stores) == 1
+
+    # Test the size on disk includes responses stored by other processes sharing the directory
+    size = cache.size
+    other_process_cache = DiskCache(str(tmp_path))
+    other_process_cache.set('ab' * 32, '"etag"', {}, b'{}')
+    assert cache.disk_size() == other_process_cache.size > size
+
+    # Test a new session, e.g. the next run, sends If-None-Match and gets the cached body back on a 304
+    session, adapter = _session(DiskCache(str(tmp_path)))
+    second = session.get(f'{mock_gitlab_url}/api/v4/projects/1')
+    assert etag_handler.requests[-1] == ('/api/v4/projects/1', first.headers.get('ETag'))
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get('X-Total-Pages') == '1'
+    assert second.headers.get('Content-Type') == 'application/json'
+    assert adapter.stats().get('revalidated') == 1
+
+    # Test the headers of the 304 response, such as the rate limit, replace the cached ones
+    assert int(second.headers.get('RateLimit-Remaining')) == int(first.headers.get('RateLimit-Remaining')) - 1
+
+    # Test a changed entity is downloaded again and replaces the cached response
+    etag_handler.projects['1'] = {'id': 1, 'name': 'Renamed'}
+    assert session.get(f'{mock_gitlab_url}/api/v4/projects/1').json() == {'id': 1, 'name': 'Renamed'}
+    assert adapter.stats().get('stored') == 1
+
+
+def test_uncached_requests(mock_gitlab_url: str, etag_handler: MockETagHandler, tmp_path):
+    cache = DiskCache(str(tmp_path))
+    session, _ = _session(cache)
+
+    # Test search results are never stored
+    session.get(f'{mock_gitlab_url}/api/v4/search?scope=blobs&search=AKIA')
+    session.get(f'{mock_gitlab_url}/api/v4/search?scope=blobs&search=AKIA')
+    assert [header for _, header in etag_handler.requests] == [None, None]
+    assert cache.size == 0
+
+    # Test responses are kept apart for different tokens
+    session.get(f'{mock_gitlab_url}/api/v4/projects/1')
+    other_session, _ = _session(cache, token='other')
+    other_session.get(f'{mock_gitlab_url}/api/v4/projects/1')
+    assert etag_handler.requests[-1] == ('/api/v4/projects/1', None)
+
+
+def test_evicts_least_recently_used(mock_gitlab_url: str, tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=2000)
+    session, _ = _session(cache)
+
+    # Test the cache is kept under its maximum size, removing the oldest responses first
+    for i in range(30):
+        session.get(f'{mock_gitlab_url}/api/v4/projects/{i + 100}')
+        key = DiskCache.key(session.prepare_request(
+            requests.Request('GET', f'{mock_gitlab_url}/api/v4/projects/{i + 100}')))
+        os.utime(os.path.join(str(tmp_path), key[:2], f'{key}.json'), (i, i))
+    assert cache.size <= 2000
+    newest = DiskCache.key(session.prepare_request(
+        requests.Request('GET', f'{mock_gitlab_url}/api/v4/projects/129')))
+    oldest = DiskCache.key(session.prepare_request(
+        requests.Request('GET', f'{mock_gitlab_url}/api/v4/projects/100')))
+    assert cache.get(newest) is not None
+    assert cache.get(oldest) is None
+
+    # Test the size of an existing cache is picked up when it is reopened
+    assert DiskCache(str(tmp_path), max_bytes=2000).size == cache.size
@@ -0,0 +1,124 @@
+import time
+from email.utils import formatdate
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+
+from gitlab_watchman.clients import rate_limiter
+from gitlab_watchman.clients.rate_limiter import RateLimiter, parse_retry_after, rate_limit_headers
+from gitlab_watchman.clients.session import GitLabSession
+from gitlab_watchman.clients.shared_state import SharedStateManager
+from gitlab_watchman.testing.mock_server import MockGitLabServer, MockRequest
+
+
+class MockClock:
+    """ Stand-in for time.monotonic and time.time that only moves when told to """
+    __test__ = False
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> MockClock:
+    mock_clock = MockClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', mock_clock)
+    monkeypatch.setattr(rate_limiter.time, 'time', mock_clock)
+    return mock_clock
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('30') == 30
+    assert parse_retry_after('0.5') == 0.5
+    assert parse_retry_after(formatdate(time.time() + 60, usegmt=True)) == pytest.approx(60, abs=2)
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_rate_limit_headers():
+    headers = {'RateLimit-Remaining': '90', 'RateLimit-Reset': '1700000000', 'Retry-After': '5'}
+    assert rate_limit_headers(200, headers) == (90, 1700000000, None)
+    assert rate_limit_headers(429, headers) == (90, 1700000000, 5)
+    assert rate_limit_headers(200, {}) == (None, None, None)
+
+
+def test_max_rate(clock: MockClock):
+    limiter = RateLimiter(max_rate=10)
+
+    # Test a burst of one second's worth of requests is allowed, then requests are paced at the maximum rate
+    assert [limiter.reserve() for _ in range(10)] == [0] * 10
+    assert limiter.reserve() == pytest.approx(0.1)
+    assert limiter.reserve() == pytest.approx(0.2)
+
+    # Test tokens are refilled as time passes
+    clock.now += 1
+    assert limiter.reserve() == 0
+    assert limiter.stats().get('delayed') == 2
+
+
+def test_unlimited_until_headers(clock: MockClock):
+    limiter = RateLimiter()
+    assert [limiter.reserve() for _ in range(100)] == [0] * 100
+
+    # Test the remaining requests are spread over the time until the limit resets, with some headroom
+    limiter.update(200, remaining=100, reset=clock.now + 10)
+    assert limiter.stats().get('rate') == pytest.approx(9)
+
+    # Test the rate never goes above the configured maximum
+    capped = RateLimiter(max_rate=2)
+    capped.update(200, remaining=100, reset=clock.now + 10)
+    assert capped.stats().get('rate') == 2
+
+
+def test_pauses(clock: MockClock):
+    limiter = RateLimiter()
+
+    # Test a 429 response pauses every request until Retry-After has passed
+    limiter.update(429, retry_after=5)
+    assert limiter.reserve() == pytest.approx(5)
+    clock.now += 5
+    assert limiter.reserve() == 0
+    assert limiter.stats().get('throttled') == 1
+
+    # Test requests are paused until the limit resets once no requests are remaining
+    limiter.update(200, remaining=0, reset=clock.now + 30)
+    assert limiter.reserve() >= 30
+
+
+def test_session_paces_requests(mock_gitlab_handler_server: Callable[..., MockGitLabServer]):
+    request_times: List[float] = []
+
+    def _throttle_first_request(_request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        request_times.append(time.monotonic())
+        headers = {'RateLimit-Remaining': 1000, 'RateLimit-Reset': int(time.time()) + 60}
+        if len(request_times) == 1:
+            return 429, None, {**headers, 'Retry-After': '0.3'}
+        return 200, None, headers
+
+    session = GitLabSession()
+    url = f'{mock_gitlab_handler_server(_throttle_first_request).url}/api/v4/projects/1'
+
+    # Test the session waits for Retry-After before sending the next request
+    assert session.get(url).status_code == 429
+    assert session.get(url).status_code == 200
+    assert len(request_times) == 2
+    assert request_times[1] - request_times[0] >= 0.3
+    assert session.rate_limiter.stats().get('throttled') == 1
+
+
+def test_shared_between_processes():
+    manager = SharedStateManager()
+    manager.start()
+    try:
+        # pylint: disable=no-member
+        limiter = manager.RateLimiter(1)
+
+        # Test tokens taken through the proxy are counted by the one rate limiter in the manager
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == pytest.approx(1, abs=0.1)
+        assert limiter.stats().get('delayed') == 1
+    finally:
+        manager.shutdown()
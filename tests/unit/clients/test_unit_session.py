@@ -0,0 +1,123 @@
+import argparse
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+import requests
+
+from gitlab_watchman.clients.session import GitLabSession, LatencyWindow, MIN_LATENCY_SAMPLES, parse_timeout
+from gitlab_watchman.testing.mock_server import MockGitLabServer, MockRequest
+
+
+class MockDelayHandler:
+    """ Answers each request with its path after a delay. The first request to /slow paths
+    takes `first_delay`, every other request `delay` """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.first_delay = 0.0
+        self.paths: List[str] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request: MockRequest) -> Tuple[int, Any, Dict[str, Any]]:
+        with self._lock:
+            first = request.path not in self.paths
+            self.paths.append(request.path)
+        time.sleep(self.first_delay if first and '/slow' in request.path else self.delay)
+        return 200, request.path, {}
+
+
+@pytest.fixture
+def delay_handler() -> MockDelayHandler:
+    return MockDelayHandler()
+
+
+@pytest.fixture
+def mock_gitlab_url(mock_gitlab_handler_server: Callable[..., MockGitLabServer],
+                    delay_handler: MockDelayHandler) -> str:
+    return mock_gitlab_handler_server(delay_handler).url
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('search=10:300', ('search', (10.0, 300.0))),
+    ('files=2.5:30', ('files', (2.5, 30.0))),
+])
+def test_parse_timeout(value: str, expected):
+    assert parse_timeout(value) == expected
+
+
+@pytest.mark.parametrize('value', ['search=10', 'search:10:300', 'blobs=10:300', 'search=a:b'])
+def test_parse_timeout_invalid(value: str):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_timeout(value)
+
+
+def test_latency_window():
+    window = LatencyWindow()
+
+    # Test no percentile is given until there are enough samples
+    for i in range(MIN_LATENCY_SAMPLES - 1):
+        window.add('projects', i / 100)
+    assert window.percentile('projects', 95) is None
+
+    window.add('projects', 1.0)
+    assert window.percentile('projects', 95) == 1.0
+    assert window.percentile('projects', 50) == 0.1
+    assert window.percentile('files', 95) is None
+
+
+def test_timeout_per_endpoint_class(mock_gitlab_url: str, delay_handler: MockDelayHandler):
+    session = GitLabSession(timeouts={'files': (1, 0.1)})
+    delay_handler.delay = 0.3
+
+    # Test the read timeout of the endpoint class is used when the request doesn't set one
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(f'{mock_gitlab_url}/api/v4/projects/1/repository/files/app.py')
+    assert session.get(f'{mock_gitlab_url}/api/v4/projects/1').status_code == 200
+
+    # Test a timeout given with the request takes precedence
+    assert session.get(f'{mock_gitlab_url}/api/v4/projects/1/repository/files/app.py', timeout=5).status_code == 200
+
+
+def test_hedged_requests(mock_gitlab_url: str, delay_handler: MockDelayHandler, monkeypatch):
+    session = GitLabSession(hedge=True)
+    for i in range(MIN_LATENCY_SAMPLES):
+        assert session.get(f'{mock_gitlab_url}/api/v4/projects/{i}').status_code == 200
+
+    responses, closed = [], []
+    send_limited = session._send_limited
+
+    def _send_recorded(*args, **kwargs) -> requests.Response:
+        response = send_limited(*args, **kwargs)
+        monkeypatch.setattr(response, 'close', lambda: closed.append(response))
+        responses.append(response)
+        return response
+
+    monkeypatch.setattr(session, '_send_limited', _send_recorded)
+
+    # Test a request slower than the p95 latency is sent again, and the faster response is used
+    delay_handler.first_delay = 1.0
+    start = time.monotonic()
+    response = session.get(f'{mock_gitlab_url}/api/v4/projects/1/slow')
+    assert time.monotonic() - start < 0.8
+    assert response.json() == '/api/v4/projects/1/slow'
+    assert delay_handler.paths.count('/api/v4/projects/1/slow') == 2
+    stats = session.concurrency_limiter.stats().get('projects')
+    assert stats.get('hedged') == 1
+    assert stats.get('hedge_wins') == 1
+
+    # Test the response of the slower request is closed once it arrives
+    deadline = time.monotonic() + 3
+    while not closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(responses) == 2
+    assert closed == [responses[1]]
+    assert responses[1] is not response
+
+    # Test requests are not hedged unless it is enabled
+    session.hedge = False
+    delay_handler.first_delay = 0.3
+    session.get(f'{mock_gitlab_url}/api/v4/projects/2/slow')
+    assert delay_handler.paths.count('/api/v4/projects/2/slow') == 1
+    session.close()
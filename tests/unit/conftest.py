@@ -0,0 +1,49 @@
+from typing import Callable, Iterator
+
+import pytest
+
+from gitlab_watchman.clients.cassette import Cassette
+from gitlab_watchman.clients.gitlab_client import ClientOptions, GitLabAPIClient
+from gitlab_watchman.testing.dataset import generate_dataset
+from gitlab_watchman.testing.mock_server import MockGitLabConfig, MockGitLabServer, MockHandler
+
+
+@pytest.fixture
+def mock_gitlab_server():
+    """ Mock GitLab server serving a small generated dataset """
+    with MockGitLabServer(generate_dataset(projects=5, files_per_project=3, seed=1)) as server:
+        yield server
+
+
+@pytest.fixture
+def mock_gitlab_handler_server() -> Iterator[Callable[..., MockGitLabServer]]:
+    """ Factory for mock GitLab servers answering every request with a MockHandler instead of a dataset.
+    Requests are accepted without a token unless a config with one is given. Servers are stopped after the test """
+    servers = []
+
+    def _start(handler: MockHandler, config: MockGitLabConfig | None = None) -> MockGitLabServer:
+        server = MockGitLabServer(config=config or MockGitLabConfig(token=None), handler=handler).start()
+        servers.append(server)
+        return server
+
+    yield _start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def recording_client(mock_gitlab_server: MockGitLabServer) -> GitLabAPIClient:
+    """ Client of the mock GitLab server recording every exchange in `recording_client.cassette` """
+    return GitLabAPIClient(mock_gitlab_server.config.token, mock_gitlab_server.url, ClientOptions(cassette=Cassette()))
+
+
+@pytest.fixture
+def replay_client() -> Callable[..., GitLabAPIClient]:
+    """ Factory for clients that answer every request from a cassette file, without a GitLab instance.
+    Pass the URL the cassette was recorded from, which the recorded web URLs use """
+
+    def _replay_client(path: str, url: str = 'http://gitlab.invalid', timed: bool = False) -> GitLabAPIClient:
+        return GitLabAPIClient('glpat-replay', url, ClientOptions(
+            cassette=Cassette.load(path), cassette_mode='replay-timed' if timed else 'replay'))
+
+    return _replay_client
@@ -0,0 +1,31 @@
+import pytest
+
+from gitlab_watchman.models import (
+    blob,
+    commit,
+    issue,
+    merge_request,
+    milestone,
+    note,
+    snippet,
+    wiki_blob
+)
+from gitlab_watchman.watchman_processor import SEARCH_FIELDS
+
+from fixtures import GitLabMockData
+
+
+@pytest.mark.parametrize('scope, model, mock_dict', [
+    ('blobs', blob, GitLabMockData.MOCK_BLOB_DICT),
+    ('wiki_blobs', wiki_blob, GitLabMockData.MOCK_WIKI_BLOB_DICT),
+    ('commits', commit, GitLabMockData.MOCK_COMMIT_DICT),
+    ('issues', issue, GitLabMockData.MOCK_ISSUE_DICT),
+    ('milestones', milestone, GitLabMockData.MOCK_MILESTONE_DICT),
+    ('merge_requests', merge_request, GitLabMockData.MOCK_MERGE_REQUEST_DICT),
+    ('notes', note, GitLabMockData.MOCK_NOTE_DICT),
+    ('snippet_titles', snippet, GitLabMockData.MOCK_SNIPPET_DICT),
+])
+def test_search_fields_cover_model(scope, model, mock_dict):
+    # Test the fields kept from each search result are enough to create the same model
+    projected = {field: value for field, value in mock_dict.items() if field in SEARCH_FIELDS.get(scope)}
+    assert model.create_from_dict(projected) == model.create_from_dict(mock_dict)
@@ -0,0 +1,115 @@
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter
+from gitlab_watchman.watchdog import (
+    PoolTask,
+    WorkerMonitor,
+    abandon_task,
+    item_key,
+    track_progress,
+    wait_for_task
+)
+
+
+def test_item_key():
+    assert item_key('blobs', {'project_id': 1, 'path': 'config/settings.py'}) == '1:config/settings.py'
+    assert item_key('wiki_blobs', {'group_id': 2, 'path': 'home.md'}) == '2:home.md'
+    assert item_key('commits', {'id': 'abc123'}) == 'abc123'
+
+
+def test_worker_monitor_progress():
+    monitor = WorkerMonitor()
+    assert monitor.status(1) is None
+
+    monitor.start(1, 1234)
+    time.sleep(0.05)
+    status = monitor.status(1)
+    assert status.get('worker') == 1234
+    assert status.get('index') == 0
+    assert status.get('idle') >= 0.05
+
+    # Test moving on to the next search result resets the idle time
+    monitor.progress(1, 3)
+    status = monitor.status(1)
+    assert status.get('index') == 3
+    assert status.get('idle') < 0.05
+
+    monitor.finish(1)
+    assert monitor.status(1) is None
+    # Test progress for a finished task is ignored
+    monitor.progress(1, 4)
+    assert monitor.stats() == {'running': 0, 'skipped': 0, 'recycled': 0}
+
+
+def test_worker_monitor_skipped():
+    monitor = WorkerMonitor()
+    monitor.skip('blobs', '1:config/settings.py', 'Matching took longer than the budget of 10.0s')
+    monitor.record_recycle()
+
+    assert monitor.skipped() == [{
+        'scope': 'blobs',
+        'item': '1:config/settings.py',
+        'reason': 'Matching took longer than the budget of 10.0s'
+    }]
+    assert monitor.stats() == {'running': 0, 'skipped': 1, 'recycled': 1}
+
+
+def test_track_progress():
+    monitor = WorkerMonitor()
+    monitor.start(1, 1234)
+    items = [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+
+    # Test each search result is reported as it is started
+    for index, _ in enumerate(track_progress(items, monitor, 1)):
+        assert monitor.status(1).get('index') == index
+    assert list(track_progress(items, None, None)) == items
+
+
+def test_wait_for_task():
+    monitor = WorkerMonitor()
+    release = threading.Event()
+    search_list = [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+
+    def _stalled_task():
+        monitor.start(1, 1234)
+        monitor.progress(1, 1)
+        release.wait(5)
+        return []
+
+    with ThreadPool(1) as pool:
+        # Test a task that finishes is waited for
+        finished = PoolTask(0, 'commits', search_list, pool.apply_async(lambda: [('aws_keys', {})]))
+        assert wait_for_task(finished, monitor, 0.5) is None
+        assert finished.async_result.get() == [('aws_keys', {})]
+
+        # Test a task that makes no progress is given up on, and its unfinished results skipped
+        stalled = PoolTask(1, 'commits', search_list, pool.apply_async(_stalled_task))
+        status = wait_for_task(stalled, monitor, 0.5)
+        assert status.get('index') == 1
+        message = abandon_task(stalled, monitor, status, 0.5, stop_worker=False)
+        release.set()
+
+    assert message == 'Worker made no progress for 0.5s, its task was abandoned and 2 commits skipped'
+    assert [skipped.get('item') for skipped in monitor.skipped()] == ['b', 'c']
+    assert monitor.stats() == {'running': 0, 'skipped': 2, 'recycled': 1}
+
+
+def test_abandon_task_releases_worker_slots():
+    monitor = WorkerMonitor()
+    limiter = ConcurrencyLimiter(initial_limit=1, max_limit=1)
+    worker = multiprocessing.Process(target=time.sleep, args=(30,), daemon=True)
+    worker.start()
+    monitor.start(1, worker.pid)
+    assert limiter.acquire('projects', 0.01, owner=worker.pid)
+
+    # Test a stalled worker process is killed, and the concurrency slots it held are released
+    stalled = PoolTask(1, 'commits', [{'id': 'a'}], None)
+    message = abandon_task(stalled, monitor, monitor.status(1), 0.5, stop_worker=True, concurrency_limiter=limiter)
+    worker.join(5)
+    assert worker.exitcode == -signal.SIGKILL
+    assert message == f'Worker made no progress for 0.5s, worker process {worker.pid} stopped and 1 commits skipped'
+    assert limiter.acquire('projects', 0.01)
@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import copy
+import time
+from typing import Dict, Any, List
+
+import pytest
+
+from gitlab_watchman import watchman_processor
+from gitlab_watchman.clients.api_metrics import ApiMetrics
+from gitlab_watchman.clients.concurrency import ConcurrencyLimiter
+from gitlab_watchman.clients.entity_cache import EntityCache
+from gitlab_watchman.clients.rate_limiter import RateLimiter
+from gitlab_watchman.matcher import SignatureMatcher
+from gitlab_watchman.models import signature
+from gitlab_watchman.watchdog import WorkerMonitor
+
+
+def _signature_dict(sig_id: str, scope: List[str], search_strings: List[str]) -> Dict[str, Any]:
+    return {
+        'name': sig_id.replace('_', ' ').title(),
+        'id': sig_id,
+        'status': 'enabled',
+        'author': 'PaperMtn',
+        'date': '2023-12-22',
+        'version': '1.0.0',
+        'description': f'Detects {sig_id}',
+        'severity': '70',
+        'watchman_apps': {
+            'gitlab': {
+                'scope': scope,
+                'search_strings': search_strings
+            }
+        },
+        'test_cases': {
+            'match_cases': [],
+            'fail_cases': []
+        },
+        'patterns': [
+            f'{sig_id}-[0-9a-z]{{8}}',
+            f'{sig_id.upper()}-[0-9A-Z]{{8}}'
+        ]
+    }
+
+
+@pytest.fixture
+def mock_signatures() -> List[signature.Signature]:
+    return [
+        signature.create_from_dict(_signature_dict('aws_keys', ['blobs', 'commits'], ['AKIA', 'aws_secret'])),
+        signature.create_from_dict(_signature_dict('aws_session', ['blobs'], ['AKIA', 'ASIA'])),
+        signature.create_from_dict(_signature_dict('slack_tokens', ['issues'], ['xoxb-'])),
+    ]
+
+
+def test_plan_searches_deduplicates_queries(mock_signatures: List[signature.Signature]) -> None:
+    plan = watchman_processor.plan_searches(mock_signatures, ['blobs', 'commits', 'issues'])
+
+    # Test each scope only contains unique search strings
+    assert list(plan.get('blobs').keys()) == ['AKIA', 'aws_secret', 'ASIA']
+    assert list(plan.get('commits').keys()) == ['AKIA', 'aws_secret']
+    assert list(plan.get('issues').keys()) == ['xoxb-']
+
+    # Test shared search strings are fanned out to every signature that uses them
+    assert [sig.id for sig in plan.get('blobs').get('AKIA')] == ['aws_keys', 'aws_session']
+    assert [sig.id for sig in plan.get('blobs').get('ASIA')] == ['aws_session']
+    assert [sig.id for sig in plan.get('commits').get('AKIA')] == ['aws_keys']
+
+
+def test_plan_searches_scopes(mock_signatures: List[signature.Signature]) -> None:
+    # Test scopes not requested are not planned
+    plan = watchman_processor.plan_searches(mock_signatures, ['blobs'])
+    assert list(plan.keys()) == ['blobs']
+
+    # Test scopes with no signatures are left out of the plan
+    plan = watchman_processor.plan_searches(mock_signatures, ['notes'])
+    assert plan == {}
+
+    # Test signatures without a scope or search strings are skipped
+    no_scope_dict = _signature_dict('no_scope', [], ['AKIA'])
+    no_scope_dict['watchman_apps']['gitlab'].pop('scope')
+    no_strings_dict = copy.deepcopy(no_scope_dict)
+    no_strings_dict['watchman_apps']['gitlab']['scope'] = ['blobs']
+    no_strings_dict['watchman_apps']['gitlab'].pop('search_strings')
+    plan = watchman_processor.plan_searches([
+        signature.create_from_dict(no_scope_dict),
+        signature.create_from_dict(no_strings_dict)
+    ], ['blobs'])
+    assert plan == {}
+
+
+def test_plan_searches_duplicate_search_strings(mock_signatures: List[signature.Signature]) -> None:
+    # Test a signature listing the same search string twice is only planned once
+    duplicate_dict = _signature_dict('duplicate', ['blobs'], ['AKIA', 'AKIA'])
+    plan = watchman_processor.plan_searches([signature.create_from_dict(duplicate_dict)], ['blobs'])
+    assert list(plan.get('blobs').keys()) == ['AKIA']
+    assert len(plan.get('blobs').get('AKIA')) == 1
+
+
+class MockGitLabAPIClient:
+    """ Stand-in for GitLabAPIClient returning commits that match the mock signatures """
+    __test__ = False
+
+    def __init__(self,
+                 entity_cache: EntityCache | None = None,
+                 api_metrics: ApiMetrics | None = None,
+                 result_count: int = 5,
+                 page_size: int = 2,
+                 stalled_results: int = 0,
+                 stall: float = 0):
+        self.entity_cache = entity_cache if entity_cache is not None else EntityCache()
+        self.api_metrics = api_metrics if api_metrics is not None else ApiMetrics()
+        self.rate_limiter = RateLimiter()
+        self.concurrency_limiter = ConcurrencyLimiter()
+        self.cassette = None
+        self.result_count = result_count
+        self.page_size = page_size
+        self.stalled_results = stalled_results
+        self.stall = stall
+        self.search_calls = []
+
+    def global_search_pages(self, search_term: str, search_scope: str, fields: List[str] | None = None):
+        self.search_calls.append((search_term, search_scope))
+        results = [{
+            'id': f'commit{i}',
+            'project_id': 2 if i < self.stalled_results else 1,
+            'message': f'aws_keys-abcdef{i:02d} AWS_SESSION-ABCDEF{i:02d}',
+            'committed_date': '2099-01-01T00:00:00.000+00:00',
+            'created_at': '2099-01-01T00:00:00.000+00:00'
+        } for i in range(self.result_count)]
+        for i in range(0, len(results), self.page_size):
+            yield results[i:i + self.page_size]
+
+    def get_project(self, project_id: int) -> Dict[str, Any]:
+        if project_id == 2:
+            time.sleep(self.stall)
+        project = self.entity_cache.get('project', project_id)
+        if project is None:
+            project = {'id': project_id, 'namespace': {'id': 1, 'kind': 'user', 'full_path': 'joe'}}
+            self.api_metrics.record('GET', f'https://gitlab.example.com/api/v4/projects/{project_id}', 200, 0.05, 512)
+            self.entity_cache.set('project', project_id, project)
+        return project
+
+    def get_user_by_username(self, username: str) -> Dict[str, Any]:
+        namespace_user = self.entity_cache.get('user', username)
+        if namespace_user is None:
+            namespace_user = {'id': 1, 'username': username}
+            self.entity_cache.set('user', username, namespace_user)
+        return namespace_user
+
+    def get_group_members(self, group_id: int) -> List[Dict[str, Any]]:
+        return []
+
+
+class MockAsyncGitLabAPIClient:
+    """ Stand-in for AsyncGitLabAPIClient, answering lookups the same way as MockGitLabAPIClient """
+    __test__ = False
+
+    def __init__(self, entity_cache: EntityCache | None = None, api_metrics: ApiMetrics | None = None, stall: float = 0):
+        self.client = MockGitLabAPIClient(entity_cache, api_metrics)
+        self.entity_cache = self.client.entity_cache
+        self.api_metrics = self.client.api_metrics
+        self.rate_limiter = self.client.rate_limiter
+        self.stall = stall
+        self.closed = False
+
+    async def get_project(self, project_id: int) -> Dict[str, Any]:
+        if project_id == 2:
+            await asyncio.sleep(self.stall)
+        return self.client.get_project(project_id)
+
+    async def get_user_by_username(self, username: str) -> Dict[str, Any]:
+        return self.client.get_user_by_username(username)
+
+    async def get_group_members(self, group_id: int) -> List[Dict[str, Any]]:
+        return self.client.get_group_members(group_id)
+
+    async def close(self):
+        self.closed = True
+
+
+def _mock_connections(monkeypatch, stalled_results: int = 0, stall: float = 0):
+    monkeypatch.setattr(watchman_processor, 'initiate_gitlab_connection',
+                        lambda token, url, options: MockGitLabAPIClient(
+                            options.entity_cache, options.api_metrics, stalled_results=stalled_results, stall=stall))
+    monkeypatch.setattr(watchman_processor, 'initiate_async_gitlab_connection',
+                        lambda token, url, options: MockAsyncGitLabAPIClient(
+                            options.entity_cache, options.api_metrics, stall=stall))
+
+
+def _parent_api_metrics() -> ApiMetrics:
+    api_metrics = ApiMetrics()
+    api_metrics.record('GET', 'https://gitlab.example.com/api/v4/user', 200, 0.05, 256)
+    return api_metrics
+
+
+class MockLogger:
+    """ Logger that records messages instead of printing them """
+    __test__ = False
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, level: str, message: Any, **kwargs):
+        self.messages.append((level, message))
+
+
+@pytest.fixture(params=['process', 'thread', 'async'])
+def mock_worker_pool(request, monkeypatch):
+    _mock_connections(monkeypatch)
+    worker_pool = watchman_processor.create_worker_pool(
+        'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+        options=watchman_processor.PoolOptions(executor=request.param, workers=2, max_tasks_per_child=1),
+        gitlab_client=MockGitLabAPIClient(api_metrics=_parent_api_metrics()))
+    yield worker_pool
+    watchman_processor.close_worker_pool(worker_pool)
+
+
+def test_search_fans_out_results(mock_signatures: List[signature.Signature],
+                                 mock_worker_pool: watchman_processor.WorkerPool) -> None:
+    commit_signatures = [
+        mock_signatures[0],
+        signature.create_from_dict(_signature_dict('aws_session', ['commits'], ['AKIA']))
+    ]
+    plan = watchman_processor.plan_searches(commit_signatures, ['commits'])
+    mock_client = MockGitLabAPIClient()
+
+    results = watchman_processor.search(mock_client, mock_worker_pool, plan.get('commits'), 'commits', False)
+
+    # Test each unique search string is only searched once
+    assert mock_client.search_calls == [('AKIA', 'commits'), ('aws_secret', 'commits')]
+
+    # Test results are returned for every signature using the search string, with duplicates removed
+    assert len(results.get('aws_keys')) == 5
+    assert len(results.get('aws_session')) == 5
+    assert {result.get('match_string') for result in results.get('aws_session')} == {
+        f'AWS_SESSION-ABCDEF{i:02d}' for i in range(5)}
+
+    # Test entity lookups from every worker are served by the shared entity cache
+    cache_stats = mock_worker_pool.entity_cache.stats()
+    assert cache_stats.get('size') == 2
+    assert cache_stats.get('hits') > cache_stats.get('misses')
+
+    # Test requests from every worker, and those made before the pool was created, are counted together
+    api_summary = {summary.get('endpoint'): summary for summary in mock_worker_pool.api_metrics.summary()}
+    assert api_summary.get('/user').get('calls') == 1
+    assert 1 <= api_summary.get('/projects/:id').get('calls') <= cache_stats.get('misses') - 1
+    assert api_summary.get('/projects/:id').get('bytes') == 512 * api_summary.get('/projects/:id').get('calls')
+
+
+def test_create_worker_pool_executor_type():
+    # Test an unknown executor type is rejected
+    with pytest.raises(ValueError):
+        watchman_processor.create_worker_pool(
+            'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+            options=watchman_processor.PoolOptions(executor='fibers'))
+
+
+@pytest.mark.parametrize('value, expected', [('100', 100), ('1', 1), ('0', 0)])
+def test_parse_max_tasks_per_child(value: str, expected: int) -> None:
+    assert watchman_processor.parse_max_tasks_per_child(value) == expected
+
+
+@pytest.mark.parametrize('value', ['-1', 'ten', '1.5'])
+def test_parse_max_tasks_per_child_invalid(value: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError):
+        watchman_processor.parse_max_tasks_per_child(value)
+
+
+@pytest.mark.parametrize('executor, regex_engines, item_budget, warned', [
+    ('process', ['re'], 10.0, False),
+    ('thread', ['re'], 10.0, True),
+    ('async', ['re2', 're'], 10.0, True),
+    ('thread', ['re2'], 10.0, False),
+    ('thread', ['re'], None, False),
+])
+def test_limits_warning(executor: str, regex_engines: List[str], item_budget: float | None, warned: bool) -> None:
+    options = watchman_processor.PoolOptions(executor=executor, item_budget=item_budget,
+                                             stall_timeout=item_budget and 600.0)
+
+    # Test the thread and async executors warn that they can't interrupt a search run with re
+    warning = watchman_processor.limits_warning(options, regex_engines)
+    assert (warning is not None) == warned
+    if warned:
+        assert f'The {executor} executor can\'t interrupt a regex search' in warning
+
+
+def test_create_worker_pool_max_tasks_per_child(monkeypatch) -> None:
+    _mock_connections(monkeypatch)
+
+    # Test 0 keeps worker processes for the whole run, rather than failing to create the pool
+    worker_pool = watchman_processor.create_worker_pool(
+        'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+        options=watchman_processor.PoolOptions(workers=1, max_tasks_per_child=0))
+    try:
+        assert worker_pool.pool._maxtasksperchild is None
+    finally:
+        watchman_processor.close_worker_pool(worker_pool)
+
+    # Test a negative number of tasks is rejected
+    with pytest.raises(ValueError):
+        watchman_processor.create_worker_pool(
+            'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+            options=watchman_processor.PoolOptions(max_tasks_per_child=-1))
+
+
+@pytest.mark.parametrize('executor', ['process', 'thread', 'async'])
+def test_search_gives_up_on_stalled_workers(monkeypatch, executor: str) -> None:
+    _mock_connections(monkeypatch, stalled_results=1, stall=3)
+    worker_pool = watchman_processor.create_worker_pool(
+        'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+        options=watchman_processor.PoolOptions(executor=executor, workers=2, stall_timeout=0.5),
+        gitlab_client=MockGitLabAPIClient(stalled_results=1, stall=3))
+    plan = watchman_processor.plan_searches(
+        [signature.create_from_dict(_signature_dict('aws_keys', ['commits'], ['AKIA']))], ['commits'])
+
+    start = time.monotonic()
+    try:
+        results = watchman_processor.search(
+            MockGitLabAPIClient(stalled_results=1), worker_pool, plan.get('commits'), 'commits', False)
+        skipped = worker_pool.monitor.skipped()
+        monitor_stats = worker_pool.monitor.stats()
+    finally:
+        watchman_processor.close_worker_pool(worker_pool)
+
+    # Test the search finishes without waiting for the stalled worker, with the other results matched
+    assert time.monotonic() - start < 3
+    assert len(results.get('aws_keys')) == 4
+    assert skipped == [{'scope': 'commits', 'item': 'commit0', 'reason': 'Worker made no progress for 0.5s'}]
+    assert monitor_stats == {'running': 0, 'skipped': 1, 'recycled': 1}
+
+
+def test_run_scope_worker_skips_items_over_budget(monkeypatch) -> None:
+    monitor = WorkerMonitor()
+    monkeypatch.setitem(watchman_processor._WORKER_STATE, 'gitlab_client', MockGitLabAPIClient())
+    monkeypatch.setitem(watchman_processor._WORKER_STATE, 'log_handler', MockLogger())
+    monkeypatch.setitem(watchman_processor._WORKER_STATE, 'monitor', monitor)
+    matcher = SignatureMatcher([signature.create_from_dict({'id': 'backtracking', 'patterns': ['(a+)+$']})],
+                               item_budget=0.2)
+    notes = [
+        {'id': 1, 'body': 'a' * 40 + 'b', 'created_at': '2099-01-01T00:00:00.000+00:00'},
+        {'id': 2, 'body': 'aaaa', 'created_at': '2099-01-01T00:00:00.000+00:00'},
+    ]
+
+    matches = watchman_processor._run_scope_worker(
+        'notes', notes, matcher, timeframe=watchman_processor.ALL_TIME, verbose=False, task_id=1)
+
+    # Test the item over budget is skipped, and the rest of the chunk is still matched
+    assert [match.get('note').id for _, match in matches] == [2]
+    assert monitor.skipped() == [{'scope': 'notes', 'item': '1',
+                                  'reason': 'Matching took longer than the budget of 0.2s'}]
+    assert monitor.stats().get('running') == 0
+
+
+def test_async_executor_shares_parent_state(monkeypatch) -> None:
+    _mock_connections(monkeypatch)
+    parent_client = MockGitLabAPIClient(api_metrics=_parent_api_metrics())
+    worker_pool = watchman_processor.create_worker_pool(
+        'token', 'https://gitlab.example.com', 'stdout', MockLogger(), False,
+        options=watchman_processor.PoolOptions(executor='async', workers=4),
+        gitlab_client=parent_client)
+    async_client = watchman_processor._WORKER_STATE.get('gitlab_client')
+    plan = watchman_processor.plan_searches(
+        [signature.create_from_dict(_signature_dict('aws_keys', ['commits'], ['AKIA']))], ['commits'])
+
+    try:
+        results = watchman_processor.search(MockGitLabAPIClient(), worker_pool, plan.get('commits'), 'commits', False)
+    finally:
+        watchman_processor.close_worker_pool(worker_pool)
+
+    # Test the workers look entities up with one asyncio client, sharing the parent client's cache and metrics
+    assert len(results.get('aws_keys')) == 5
+    assert isinstance(async_client, MockAsyncGitLabAPIClient)
+    assert async_client.entity_cache is parent_client.entity_cache
+    assert worker_pool.api_metrics is parent_client.api_metrics
+    assert parent_client.entity_cache.get('project', 1) is not None
+
+    # Test the client's session is closed with the pool
+    assert async_client.closed
@@ -0,0 +1,105 @@
+import datetime
+import re
+import statistics
+from collections import Counter
+
+import pytest
+
+from gitlab_watchman import watchman_processor
+from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
+from gitlab_watchman.matcher import SignatureMatcher
+from gitlab_watchman.models import signature, blob, commit, issue, merge_request, milestone, note, snippet, wiki_blob
+from gitlab_watchman.testing.corpus import CorpusConfig, SCOPES, SyntheticCorpus, build_dataset
+from gitlab_watchman.testing.mock_server import MockGitLabServer
+from gitlab_watchman.watchman_processor import SEARCH_FIELDS
+
+SECRET_PATTERN = re.compile(r'AKIA[0-9A-Z]{16}|xoxb-|glpat-|-----BEGIN|password = "')
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    return SyntheticCorpus(CorpusConfig(secret_density=0.1, seed=3))
+
+
+@pytest.mark.parametrize('scope, model', [
+    ('blobs', blob),
+    ('wiki_blobs', wiki_blob),
+    ('commits', commit),
+    ('issues', issue),
+    ('merge_requests', merge_request),
+    ('milestones', milestone),
+    ('notes', note),
+    ('snippet_titles', snippet),
+])
+def test_results_create_models(corpus: SyntheticCorpus, scope, model):
+    # Test results have every field the workers use, and create the same model once projected
+    for result in corpus.results(scope, 20):
+        projected = {field: value for field, value in result.items() if field in SEARCH_FIELDS.get(scope)}
+        assert model.create_from_dict(projected) == model.create_from_dict(result)
+
+
+def test_results_are_repeatable(corpus: SyntheticCorpus):
+    # Test timestamps aside, which are relative to when the corpus was created, results only depend on the config
+    second = SyntheticCorpus(corpus.config)
+    second.now = corpus.now
+    assert list(corpus.results('commits', 50)) == list(second.results('commits', 50))
+    assert list(corpus.results('notes', 10, start=1995)) == list(corpus.results('notes', 2005))[1995:]
+    assert [len(page) for page in corpus.pages('issues', 250, per_page=100)] == [100, 100, 50]
+    with pytest.raises(ValueError):
+        list(corpus.results('users', 1))
+
+
+@pytest.mark.parametrize('scope', SCOPES)
+def test_secret_density(corpus: SyntheticCorpus, scope):
+    results = list(corpus.results(scope, 2000))
+    with_secrets = sum(1 for result in results if SECRET_PATTERN.search(str(result)))
+    assert 0.07 < with_secrets / len(results) < 0.13
+
+
+def test_project_fan_out():
+    counts = Counter(result.get('project_id') for result in SyntheticCorpus(
+        CorpusConfig(projects=10, project_skew=0)).results('blobs', 5000))
+    assert set(counts) == set(range(1, 11))
+    assert min(counts.values()) > 350
+
+    # Test a skewed corpus concentrates results in the first projects
+    counts = Counter(result.get('project_id') for result in SyntheticCorpus(
+        CorpusConfig(projects=10, project_skew=2)).results('blobs', 5000))
+    assert counts.most_common(1)[0][0] == 1
+    assert counts.get(1) > 5000 * 0.5
+
+
+def test_blob_sizes_and_ages():
+    corpus = SyntheticCorpus(CorpusConfig(blob_size=1000, max_blob_size=4000, mean_age_days=10, max_age_days=60))
+    results = list(corpus.results('blobs', 2000))
+    sizes = [len(result.get('data')) for result in results]
+    assert 800 < statistics.median(sizes) < 1200
+    assert max(sizes) <= 4000 + 100
+
+    now = datetime.datetime.fromtimestamp(corpus.now, datetime.timezone.utc)
+    ages = [(now - datetime.datetime.fromisoformat(result.get('committed_date'))).total_seconds() / 86400
+            for result in corpus.results('commits', 2000)]
+    assert max(ages) < 60.001
+    assert 8 < statistics.mean(ages) < 12
+
+
+def test_corpus_through_mock_server_and_worker(corpus: SyntheticCorpus, monkeypatch):
+    dataset = build_dataset(corpus, {'blobs': 100, 'commits': 200})
+    commits = list(corpus.results('commits', 200))
+    expected = {result.get('id') for result in commits if re.search('AKIA[0-9A-Z]{16}', result.get('message'))}
+
+    with MockGitLabServer(dataset) as server:
+        client = GitLabAPIClient(server.config.token, server.url)
+        assert len(client.global_search('AKIA', 'commits')) == len(expected)
+
+        # Test the scope workers can be run directly over the corpus
+        aws_matcher = SignatureMatcher([signature.create_from_dict({'id': 'aws', 'patterns': ['AKIA[0-9A-Z]{16}']})])
+        monkeypatch.setitem(watchman_processor._WORKER_STATE, 'gitlab_client', client)
+        matches = watchman_processor._run_scope_worker(
+            'commits', commits, aws_matcher, timeframe=watchman_processor.ALL_TIME, verbose=False)
+        assert {match.get('commit').id for _, match in matches} == expected
+
+        blobs = list(corpus.results('blobs', 100))
+        matches = watchman_processor._run_scope_worker(
+            'blobs', blobs, aws_matcher, timeframe=watchman_processor.ALL_TIME, verbose=False)
+        assert len(matches) == sum(1 for result in blobs if re.search('AKIA[0-9A-Z]{16}', result.get('data')))
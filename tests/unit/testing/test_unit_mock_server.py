@@ -0,0 +1,145 @@
+import time
+from typing import Callable
+
+import pytest
+import requests
+
+from gitlab_watchman.clients.gitlab_client import GitLabAPIClient
+from gitlab_watchman.testing.dataset import generate_dataset
+from gitlab_watchman.testing.mock_server import MockGitLabConfig, MockGitLabServer, MockRequest
+
+
+@pytest.fixture
+def gitlab_client(mock_gitlab_server: MockGitLabServer):
+    return GitLabAPIClient(mock_gitlab_server.config.token, mock_gitlab_server.url)
+
+
+def test_generate_dataset_is_repeatable():
+    first = generate_dataset(projects=3, files_per_project=2, seed=7)
+    second = generate_dataset(projects=3, files_per_project=2, seed=7)
+    assert [project.get('path_with_namespace') for project in first.projects] == \
+           [project.get('path_with_namespace') for project in second.projects]
+    assert list(first.files.get(1)) == list(second.files.get(1))
+    assert len(first.projects) == 3
+    assert all(len(files) == 2 for files in first.files.values())
+
+
+def test_entity_lookups(mock_gitlab_server: MockGitLabServer, gitlab_client: GitLabAPIClient):
+    dataset = mock_gitlab_server.dataset
+    project = dataset.projects[0]
+    file_path, file_dict = next(iter(dataset.files.get(project.get('id')).items()))
+    commit_id = next(iter(dataset.commits.get(project.get('id'))))
+
+    assert gitlab_client.get_user_info().get('username') == 'watchman'
+    assert gitlab_client.get_project(str(project.get('id'))).get('web_url') == \
+           f"{mock_gitlab_server.url}/{project.get('path_with_namespace')}"
+    assert gitlab_client.get_project(project.get('path_with_namespace')).get('id') == project.get('id')
+    assert gitlab_client.get_group(str(dataset.groups[0].get('id'))).get('full_path') == 'group1'
+    assert gitlab_client.get_commit(str(project.get('id')), commit_id).get('short_id') == commit_id[:8]
+    assert gitlab_client.get_file(str(project.get('id')), file_path, 'main').get('blob_id') == file_dict.get('blob_id')
+    metadata = gitlab_client.get_file_metadata(str(project.get('id')), file_path, 'main')
+    assert metadata.get('size') == file_dict.get('size')
+    assert gitlab_client.get_wiki_page(str(project.get('id')), 'home').get('title') == 'Home'
+    assert len(gitlab_client.get_all_projects()) == len(dataset.projects)
+    assert gitlab_client.get_user_by_username('user2').get('id') == 2
+    assert gitlab_client.get_metadata().get('version')
+    assert gitlab_client.get_authed_access_token_value().get('scopes') == ['api', 'read_api']
+
+    counts = mock_gitlab_server.request_counts()
+    assert counts.get('GET /projects/:id') == 2
+    assert counts.get('HEAD /projects/:id/repository/files/:id') == 1
+
+
+def test_search_pagination(mock_gitlab_server: MockGitLabServer, gitlab_client: GitLabAPIClient):
+    expected = mock_gitlab_server.dataset.search('blobs', 'a')
+    assert len(expected) > 10
+
+    response = requests.get(f'{mock_gitlab_server.url}/api/v4/search',
+                            params={'scope': 'blobs', 'search': 'a', 'per_page': 5},
+                            headers={'PRIVATE-TOKEN': mock_gitlab_server.config.token}, timeout=5)
+    assert response.headers.get('X-Total') == str(len(expected))
+    assert response.headers.get('X-Next-Page') == '2'
+    assert 'rel="next"' in response.headers.get('Link')
+    assert len(response.json()) == 5
+
+    results = gitlab_client.global_search('a', 'blobs')
+    assert sorted((r.get('project_id'), r.get('path')) for r in results) == \
+           sorted((r.get('project_id'), r.get('path')) for r in expected)
+
+
+def test_authentication(mock_gitlab_server: MockGitLabServer):
+    response = requests.get(f'{mock_gitlab_server.url}/api/v4/user', headers={'PRIVATE-TOKEN': 'wrong'}, timeout=5)
+    assert response.status_code == 401
+    response = requests.get(f'{mock_gitlab_server.url}/api/v4/user',
+                            headers={'Authorization': f'Bearer {mock_gitlab_server.config.token}'}, timeout=5)
+    assert response.status_code == 200
+
+
+def test_not_found(mock_gitlab_server: MockGitLabServer):
+    headers = {'PRIVATE-TOKEN': mock_gitlab_server.config.token}
+    assert requests.get(f'{mock_gitlab_server.url}/api/v4/projects/999', headers=headers, timeout=5).status_code == 404
+    assert requests.get(f'{mock_gitlab_server.url}/api/v4/unknown', headers=headers, timeout=5).status_code == 404
+
+
+def test_etag_revalidation(mock_gitlab_server: MockGitLabServer):
+    headers = {'PRIVATE-TOKEN': mock_gitlab_server.config.token}
+    response = requests.get(f'{mock_gitlab_server.url}/api/v4/projects/1', headers=headers, timeout=5)
+    revalidated = requests.get(f'{mock_gitlab_server.url}/api/v4/projects/1',
+                               headers={**headers, 'If-None-Match': response.headers.get('ETag')}, timeout=5)
+    assert revalidated.status_code == 304
+
+
+def test_rate_limit():
+    config = MockGitLabConfig(rate_limit=3, rate_limit_window=60)
+    with MockGitLabServer(generate_dataset(projects=1), config) as server:
+        headers = {'PRIVATE-TOKEN': config.token}
+        responses = [requests.get(f'{server.url}/api/v4/projects/1', headers=headers, timeout=5) for _ in range(4)]
+    assert [r.status_code for r in responses] == [200, 200, 200, 429]
+    assert [r.headers.get('RateLimit-Remaining') for r in responses] == ['2', '1', '0', '0']
+    assert int(responses[-1].headers.get('Retry-After')) > 0
+
+
+def test_error_injection():
+    config = MockGitLabConfig(error_rate=0.5, error_codes=[503], seed=3)
+    with MockGitLabServer(generate_dataset(projects=1), config) as server:
+        headers = {'PRIVATE-TOKEN': config.token}
+        status_codes = {requests.get(f'{server.url}/api/v4/projects/1', headers=headers, timeout=5).status_code
+                        for _ in range(20)}
+        assert status_codes == {200, 503}
+
+        # Test the client retries injected errors until it gets a response
+        client = GitLabAPIClient(config.token, server.url)
+        assert client.get_project('1').get('id') == 1
+
+
+def test_latency():
+    config = MockGitLabConfig(latency=0.0, endpoint_latency={'projects': 0.2})
+    with MockGitLabServer(generate_dataset(projects=1), config) as server:
+        headers = {'PRIVATE-TOKEN': config.token}
+        start = time.monotonic()
+        requests.get(f'{server.url}/api/v4/user', headers=headers, timeout=5)
+        assert time.monotonic() - start < 0.2
+        start = time.monotonic()
+        requests.get(f'{server.url}/api/v4/projects/1', headers=headers, timeout=5)
+        assert time.monotonic() - start >= 0.2
+
+
+def test_handler(mock_gitlab_handler_server: Callable[..., MockGitLabServer]):
+    def _handler(request: MockRequest):
+        if request.path == '/api/v4/projects/1':
+            return 200, {'id': 1, 'ref': request.query.get('ref')}, {'X-Total-Pages': 1}
+        return 404, {'message': '404 Not Found'}, {}
+
+    server = mock_gitlab_handler_server(_handler)
+
+    # Test every request is answered by the handler, without a token, and recorded
+    response = requests.get(f'{server.url}/api/v4/projects/1?ref=main', timeout=5)
+    assert response.json() == {'id': 1, 'ref': 'main'}
+    assert response.headers.get('X-Total-Pages') == '1'
+    assert requests.get(f'{server.url}/api/v4/groups/1', timeout=5).status_code == 404
+    assert server.requests == [('GET', '/api/v4/projects/1?ref=main'), ('GET', '/api/v4/groups/1')]
+
+    # Test the handler's responses get ETags the same as the dataset's
+    revalidated = requests.get(f'{server.url}/api/v4/projects/1?ref=main',
+                               headers={'If-None-Match': response.headers.get('ETag')}, timeout=5)
+    assert revalidated.status_code == 304